@@ -0,0 +1,149 @@
+import argparse
+import glob
+import os
+from multiprocessing import Pool
+
+import geopandas as gpd
+import pandas as pd
+
+try:
+    import pyogrio
+except ImportError:
+    pyogrio = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# class columns of the LULC layers, the first one found is used
+CLASS_COLUMNS = ('Level_I', 'DESCR_1')
+
+
+def parse_args():
+    """Parse arguments."""
+    parser = argparse.ArgumentParser(
+        description='Sum the area of every class of several vector layers')
+    parser.add_argument(
+        'vector_files',
+        type=str,
+        help='glob of the vector files, e.g. "buffer/sisdp*.gpkg"')
+    parser.add_argument(
+        '--class-col',
+        type=str,
+        default=None,
+        help='class column, the first of ' + '/'.join(CLASS_COLUMNS) +
+        ' found in every file by default')
+    parser.add_argument(
+        '--nproc', type=int, default=1, help='number of processes')
+    parser.add_argument(
+        '--out', type=str, default=None, help='CSV of the class x file table')
+    args = parser.parse_args()
+    assert args.nproc > 0
+    return args
+
+
+def get_class_column(vector_file, candidates=CLASS_COLUMNS):
+    """Get the first candidate column present in a vector file.
+
+    Only the layer schema is read.
+
+    Args:
+        vector_file (str): Path of the vector file.
+        candidates (tuple[str]): Column names in order of preference.
+
+    Returns:
+        str: Name of the class column.
+    """
+    if pyogrio is not None:
+        fields = pyogrio.read_info(vector_file)['fields']
+    else:
+        fields = gpd.read_file(vector_file, rows=0).columns
+    for column in candidates:
+        if column in fields:
+            return column
+    raise ValueError(f'{vector_file} has none of the columns {candidates}')
+
+
+def read_classes(vector_file, class_col):
+    """Read only the geometry and the class column of a vector file.
+
+    The Arrow reader of pyogrio is used when pyarrow is installed.
+
+    Args:
+        vector_file (str): Path of the vector file.
+        class_col (str): Class column.
+
+    Returns:
+        gpd.GeoDataFrame: The class column and the geometries.
+    """
+    kwargs = dict()
+    if pyogrio is not None:
+        kwargs['engine'] = 'pyogrio'
+        kwargs['use_arrow'] = pyarrow is not None
+    return gpd.read_file(vector_file, columns=[class_col], **kwargs)
+
+
+def class_areas(vector_file, class_col=None):
+    """Sum the area of every class of a vector file.
+
+    Like ``area_calculation.ipynb``, the area of every feature is in units
+    of the layer CRS and truncated to an integer before summing.
+
+    Args:
+        vector_file (str): Path of the vector file.
+        class_col (str, optional): Class column, see
+            :func:`get_class_column` by default.
+
+    Returns:
+        pd.Series: Areas indexed by class and named after the file
+            basename without extension.
+    """
+    if class_col is None:
+        class_col = get_class_column(vector_file)
+    gdf = read_classes(vector_file, class_col)
+    areas = pd.Series(gdf.area.to_numpy().astype(int),
+                      index=pd.Index(gdf[class_col].to_numpy(), name='Class'))
+    return areas.groupby(level=0).sum().rename(
+        os.path.basename(vector_file).split('.')[0])
+
+
+def _class_areas(task):
+    return class_areas(*task)
+
+
+def area_table(vector_files, class_col=None, nproc=1):
+    """Get the area of every class of every vector file as one table.
+
+    Files are read in parallel and the columns are aligned by a single
+    concat instead of chained outer merges.
+
+    Args:
+        vector_files (list[str]): Paths of the vector files.
+        class_col (str, optional): Class column of all files, see
+            :func:`get_class_column` by default.
+        nproc (int): Number of processes.
+
+    Returns:
+        pd.DataFrame: Areas indexed by class with a column per file in the
+            order of ``vector_files``, NaN where a file lacks the class.
+    """
+    tasks = [(vector_file, class_col) for vector_file in vector_files]
+    if nproc > 1 and len(tasks) > 1:
+        with Pool(min(nproc, len(tasks))) as pool:
+            columns = pool.map(_class_areas, tasks)
+    else:
+        columns = list(map(_class_areas, tasks))
+    return pd.concat(columns, axis=1).sort_index()
+
+
+if __name__ == '__main__':
+    # Example usage: python area_calculation.py "buffer/sisdp*.gpkg"
+    args = parse_args()
+    vector_files = sorted(glob.glob(args.vector_files))
+    assert vector_files, f'no file matches {args.vector_files}'
+
+    table = area_table(vector_files, args.class_col, args.nproc)
+    print(table.to_string())
+    if args.out is not None:
+        table.to_csv(args.out)
@@ -1,48 +1,521 @@
-import os
+import argparse
 import csv
 import glob
+import heapq
+import itertools
+import json
+import os
+import re
+import tempfile
+from functools import partial
+from multiprocessing import Pool
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:
+    pd = None
+
+
+def parse_args():
+    """Parse arguments."""
+    parser = argparse.ArgumentParser(
+        description='Combine per-parameter prediction CSVs into one wide CSV')
+    parser.add_argument(
+        '--csv-dir',
+        type=str,
+        default='C:/shubham_data/Project_data/pred_csv/',
+        help='folder of the prediction CSV files')
+    parser.add_argument(
+        '--out',
+        type=str,
+        default='combined_predictions.csv',
+        help='combined CSV file')
+    parser.add_argument(
+        '--id-col', type=str, default='image_id', help='key column')
+    parser.add_argument(
+        '--value-col',
+        type=str,
+        default='predication',
+        help='prediction column')
+    parser.add_argument(
+        '--param-regex',
+        type=str,
+        default=None,
+        help='regex whose first group extracts the parameter from a file '
+        'name, the second "_" separated field by default')
+    parser.add_argument(
+        '--streaming',
+        action='store_true',
+        help='sort every file by image_id, on disk if needed, and merge '
+        'join them so memory does not grow with the number of rows')
+    parser.add_argument(
+        '--chunk-rows',
+        type=int,
+        default=1000000,
+        help='rows sorted in memory at once in streaming mode')
+    parser.add_argument(
+        '--tmp-dir',
+        type=str,
+        default=None,
+        help='dir of the sorted runs in streaming mode, the system '
+        'temporary dir by default')
+    parser.add_argument(
+        '--columnar',
+        action='store_true',
+        help='parse files in parallel into float32 columns with pandas')
+    parser.add_argument(
+        '--columnar-out',
+        type=str,
+        default=None,
+        help='also save the columnar combine as .parquet or .feather')
+    parser.add_argument(
+        '--store',
+        type=str,
+        default=None,
+        help='dir of a combined store, only new or changed files are read '
+        'into it before it is exported to --out')
+    parser.add_argument(
+        '--nproc', type=int, default=4, help='processes parsing files')
+    args = parser.parse_args()
+    assert args.chunk_rows > 0 and args.nproc > 0
+    assert args.streaming + args.columnar + (args.store is not None) <= 1
+    assert args.columnar or args.store is not None or \
+        args.columnar_out is None, '--columnar-out needs --columnar or --store'
+    assert args.columnar_out is None or \
+        os.path.splitext(args.columnar_out)[1] in ['.parquet', '.feather']
+    assert not (args.columnar or args.store) or pd is not None, \
+        'pandas is needed for --columnar and --store'
+    return args
+
+
+def get_parameter_name(file):
+    """Get the parameter name of a prediction file.
+
+    Assumes filenames like ``<prefix>_<parameter>.csv``, adjust this as per
+    your file naming convention.
+    """
+    return os.path.basename(file).split('.')[0].split('_')[1]
+
+
+def get_param_parser(regex=None):
+    """Get the function extracting the parameter name from a file path.
+
+    Args:
+        regex (str, optional): Pattern searched in the file name, its first
+            group is the parameter. Defaults to :func:`get_parameter_name`.
+
+    Returns:
+        callable: Maps a file path to its parameter name.
+    """
+    if regex is None:
+        return get_parameter_name
+    pattern = re.compile(regex)
+
+    def parse(file):
+        match = pattern.search(os.path.basename(file))
+        if match is None:
+            raise ValueError(f'{file} does not match {regex}')
+        return match.group(1)
+
+    return parse
+
+
+def read_predictions(file, id_col='image_id', value_col='predication'):
+    """Yield ``(image_id, prediction)`` string pairs of a prediction file."""
+    with open(file, mode='r', newline='') as f:
+        for row in csv.DictReader(f):
+            yield row[id_col], row[value_col]
+
+
+def combine_in_memory(csv_files, out_file, id_col='image_id',
+                      value_col='predication',
+                      param_parser=get_parameter_name):
+    """Combine prediction files through a dict of all rows.
+
+    Args:
+        csv_files (list[str]): Prediction files, one per parameter.
+        out_file (str): Combined CSV file.
+        id_col (str): Key column.
+        value_col (str): Prediction column.
+        param_parser (callable): Maps a file path to its parameter name.
+
+    Returns:
+        int: Number of written rows.
+    """
+    # the key is the image_id and the value is a dict of parameters
+    combined_data = {}
+    for file in csv_files:
+        parameter_name = param_parser(file)
+        for image_id, pred_value in read_predictions(file, id_col,
+                                                     value_col):
+            combined_data.setdefault(image_id, {})[parameter_name] = \
+                pred_value
+
+    all_params = sorted(set(param_parser(f) for f in csv_files))
+    with open(out_file, mode='w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=[id_col] + all_params)
+        writer.writeheader()
+        for image_id, params in combined_data.items():
+            row = {id_col: image_id}
+            row.update(params)
+            writer.writerow(row)
+    return len(combined_data)
+
+
+def sort_predictions(file, run_dir, chunk_rows=1000000, id_col='image_id',
+                     value_col='predication'):
+    """Iterate a prediction file sorted by image_id.
+
+    The file is sorted in chunks of ``chunk_rows`` rows written as runs to
+    ``run_dir``, which are merged lazily, so only one row per run stays in
+    memory. The sort is stable, so duplicated image_ids keep their order.
+
+    Args:
+        file (str): Prediction file.
+        run_dir (str): Dir of the sorted runs.
+        chunk_rows (int): Rows sorted in memory at once.
+        id_col (str): Key column.
+        value_col (str): Prediction column.
+
+    Returns:
+        iterator[tuple[str]]: ``(image_id, prediction)`` pairs.
+    """
+    rows = read_predictions(file, id_col, value_col)
+    key = lambda row: row[0]  # noqa: E731
+    runs = []
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+        if not chunk:
+            break
+        chunk.sort(key=key)
+        fd, run = tempfile.mkstemp(suffix='.csv', dir=run_dir)
+        with os.fdopen(fd, mode='w', newline='') as f:
+            csv.writer(f).writerows(chunk)
+        runs.append(run)
+    return heapq.merge(*[_read_run(run) for run in runs], key=key)
+
+
+def _read_run(run):
+    with open(run, mode='r', newline='') as f:
+        for image_id, pred_value in csv.reader(f):
+            yield image_id, pred_value
+
+
+def merge_join(streams, params):
+    """Join streams sorted by image_id into rows of parameters.
+
+    Args:
+        streams (list[iterator]): ``(image_id, prediction)`` pairs sorted by
+            image_id, one stream per parameter.
+        params (list[str]): Parameter of every stream.
+
+    Yields:
+        tuple[str, dict]: Every image_id once, in order, with its
+            predictions. Later rows win for image_ids repeated in a stream.
+    """
+    tagged = [_tag_stream(stream, param)
+              for stream, param in zip(streams, params)]
+    merged = heapq.merge(*tagged, key=lambda row: row[0])
+    for image_id, rows in itertools.groupby(merged, key=lambda row: row[0]):
+        yield image_id, {param: value for _, param, value in rows}
+
+
+def _tag_stream(stream, param):
+    for image_id, value in stream:
+        yield image_id, param, value
+
+
+def combine_streaming(csv_files, out_file, chunk_rows=1000000, tmp_dir=None,
+                      id_col='image_id', value_col='predication',
+                      param_parser=get_parameter_name):
+    """Combine prediction files with an external sort and a merge join.
+
+    Memory is bounded by ``chunk_rows`` while sorting and by one row per
+    file while merging. Rows are written in image_id order.
+
+    Args:
+        csv_files (list[str]): Prediction files, one per parameter.
+        out_file (str): Combined CSV file.
+        chunk_rows (int): Rows sorted in memory at once.
+        tmp_dir (str, optional): Parent dir of the sorted runs.
+        id_col (str): Key column.
+        value_col (str): Prediction column.
+        param_parser (callable): Maps a file path to its parameter name.
+
+    Returns:
+        int: Number of written rows.
+    """
+    params = [param_parser(file) for file in csv_files]
+    num_rows = 0
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir, \
+            open(out_file, mode='w', newline='') as f:
+        streams = [
+            sort_predictions(file, run_dir, chunk_rows, id_col, value_col)
+            for file in csv_files
+        ]
+        writer = csv.DictWriter(f, fieldnames=[id_col] + sorted(set(params)))
+        writer.writeheader()
+        for image_id, row in merge_join(streams, params):
+            row[id_col] = image_id
+            writer.writerow(row)
+            num_rows += 1
+    return num_rows
+
+
+def read_prediction_column(file, id_col='image_id', value_col='predication'):
+    """Parse a prediction file into typed arrays.
+
+    Args:
+        file (str): Prediction file.
+        id_col (str): Key column.
+        value_col (str): Prediction column.
+
+    Returns:
+        tuple[np.array]: Unique image_ids as objects and their float32
+            predictions. Later rows win for repeated image_ids, which keep
+            the position of their first row.
+    """
+    df = pd.read_csv(file, usecols=[id_col, value_col],
+                     dtype={id_col: str, value_col: np.float32})
+    codes, image_ids = pd.factorize(df[id_col], use_na_sentinel=False)
+    # image_ids keep the order of their first row, values of their last one
+    _, last = np.unique(codes[::-1], return_index=True)
+    values = df[value_col].to_numpy(dtype=np.float32)[len(codes) - 1 - last]
+    return np.asarray(image_ids, dtype=object), values
+
+
+def combine_columnar(csv_files, nproc=4, id_col='image_id',
+                     value_col='predication',
+                     param_parser=get_parameter_name):
+    """Combine prediction files into a typed wide DataFrame.
+
+    Files are parsed in parallel, then every file is aligned on a single
+    hash index of all image_ids built by one ``pd.factorize``.
+
+    Args:
+        csv_files (list[str]): Prediction files, one per parameter.
+        nproc (int): Processes parsing files.
+        id_col (str): Key column.
+        value_col (str): Prediction column.
+        param_parser (callable): Maps a file path to its parameter name.
+
+    Returns:
+        pd.DataFrame: ``id_col`` in order of first appearance and a float32
+            column per parameter, sorted by name, NaN where missing.
+    """
+    reader = partial(read_prediction_column, id_col=id_col,
+                     value_col=value_col)
+    if nproc > 1 and len(csv_files) > 1:
+        with Pool(min(nproc, len(csv_files))) as pool:
+            columns = pool.map(reader, csv_files)
+    else:
+        columns = [reader(file) for file in csv_files]
+
+    params = [param_parser(file) for file in csv_files]
+    all_params = sorted(set(params))
+    ids = [image_ids for image_ids, _ in columns]
+    codes, uniques = pd.factorize(
+        np.concatenate(ids) if ids else np.zeros((0, ), dtype=object))
+    data = np.full((len(uniques), len(all_params)), np.nan, dtype=np.float32)
+    bounds = np.cumsum([0] + [len(i) for i in ids])
+    for i, (param, (_, values)) in enumerate(zip(params, columns)):
+        data[codes[bounds[i]:bounds[i + 1]], all_params.index(param)] = values
+
+    df = pd.DataFrame(data, columns=all_params)
+    df.insert(0, id_col, uniques)
+    return df
+
+
+def write_columnar(df, out_file):
+    """Save a combined DataFrame as CSV, Parquet or Feather by extension."""
+    ext = os.path.splitext(out_file)[1]
+    if ext == '.parquet':
+        df.to_parquet(out_file, index=False)
+    elif ext == '.feather':
+        df.to_feather(out_file)
+    else:
+        df.to_csv(out_file, index=False)
+
+
+def get_file_state(file):
+    """Get the size and modification time identifying a file's version."""
+    stat = os.stat(file)
+    return dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+def load_store_manifest(store_dir):
+    """Load the manifest of a combined store, empty if it does not exist."""
+    manifest_file = os.path.join(store_dir, 'manifest.json')
+    if not os.path.exists(manifest_file):
+        return dict(version=1, files=dict(), columns=dict(), next_column=0)
+    with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+    assert manifest['version'] == 1, \
+        f"unknown store version {manifest['version']}"
+    return manifest
+
+
+def _replace(path, save, mode='wb'):
+    """Write a file through ``save(f)`` on a temporary file and move it in
+    place."""
+    tmp = path + '.tmp'
+    with open(tmp, mode) as f:
+        save(f)
+    os.replace(tmp, path)
+
+
+def update_store(store_dir, csv_files, nproc=4, id_col='image_id',
+                 value_col='predication', param_parser=get_parameter_name):
+    """Add new or changed prediction files to a combined store.
+
+    The store keeps the image_ids in ``image_ids.npy``, a float32 column
+    file per parameter aligned with them and a manifest of the ingested
+    files by path, size and modification time. Only parameters with new,
+    changed or removed files are read again, columns of the other ones are
+    neither read nor rewritten. Columns shorter than the index miss the
+    image_ids added after them. image_ids are never removed from the index.
+
+    Args:
+        store_dir (str): Dir of the store, created if needed.
+        csv_files (list[str]): Current prediction files.
+        nproc (int): Processes parsing files.
+        id_col (str): Key column.
+        value_col (str): Prediction column.
+        param_parser (callable): Maps a file path to its parameter name.
+
+    Returns:
+        list[str]: Parameters whose columns were rebuilt.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = load_store_manifest(store_dir)
+    states = {
+        os.path.abspath(file): dict(get_file_state(file),
+                                    param=param_parser(file))
+        for file in csv_files
+    }
+    old_states = manifest['files']
+    changed = set(
+        state['param'] for file, state in states.items()
+        if old_states.get(file) != state)
+    changed |= set(
+        state['param'] for file, state in old_states.items()
+        if file not in states)
+    if not changed:
+        return []
+
+    # a parameter is rebuilt from all of its files, later files win
+    param_files = sorted(
+        (state['param'], file) for file, state in states.items()
+        if state['param'] in changed)
+    reader = partial(read_prediction_column, id_col=id_col,
+                     value_col=value_col)
+    files = [file for _, file in param_files]
+    if nproc > 1 and len(files) > 1:
+        with Pool(min(nproc, len(files))) as pool:
+            columns = pool.map(reader, files)
+    else:
+        columns = [reader(file) for file in files]
+
+    index_file = os.path.join(store_dir, 'image_ids.npy')
+    image_ids = np.load(index_file) if os.path.exists(index_file) else \
+        np.zeros((0, ), dtype=str)
+    new_ids = pd.unique(np.concatenate(
+        [ids for ids, _ in columns] + [np.zeros((0, ), dtype=object)]))
+    new_ids = new_ids[pd.Index(image_ids).get_indexer(new_ids) < 0]
+    if len(new_ids):
+        image_ids = np.concatenate([image_ids, new_ids.astype(str)])
+        _replace(index_file, lambda f: np.save(f, image_ids))
+    index = pd.Index(image_ids)
+
+    built = dict()
+    for (param, _), (ids, values) in zip(param_files, columns):
+        column = built.setdefault(
+            param, np.full(len(image_ids), np.nan, dtype=np.float32))
+        column[index.get_indexer(ids)] = values
+    for param in sorted(changed):
+        if param not in manifest['columns']:
+            manifest['columns'][param] = f"{manifest['next_column']:05d}.npy"
+            manifest['next_column'] += 1
+        column_file = os.path.join(store_dir, manifest['columns'][param])
+        if param in built:
+            _replace(column_file, lambda f: np.save(f, built[param]))
+        else:
+            manifest['columns'].pop(param)
+            if os.path.exists(column_file):
+                os.remove(column_file)
+
+    # the manifest goes last, so an interrupted update is redone
+    manifest['files'] = states
+    _replace(os.path.join(store_dir, 'manifest.json'),
+             lambda f: json.dump(manifest, f, indent=4), 'w')
+    return sorted(changed)
+
+
+def load_store(store_dir, id_col='image_id'):
+    """Load a combined store as a wide DataFrame.
+
+    Args:
+        store_dir (str): Dir of the store.
+        id_col (str): Name of the key column.
+
+    Returns:
+        pd.DataFrame: ``id_col`` and a float32 column per parameter, sorted
+            by name, NaN where missing.
+    """
+    manifest = load_store_manifest(store_dir)
+    index_file = os.path.join(store_dir, 'image_ids.npy')
+    image_ids = np.load(index_file) if os.path.exists(index_file) else \
+        np.zeros((0, ), dtype=str)
+    data = np.full((len(image_ids), len(manifest['columns'])), np.nan,
+                   dtype=np.float32)
+    params = sorted(manifest['columns'])
+    for i, param in enumerate(params):
+        column = np.load(os.path.join(store_dir, manifest['columns'][param]),
+                         mmap_mode='r')
+        data[:len(column), i] = column
+
+    df = pd.DataFrame(data, columns=params)
+    df.insert(0, id_col, image_ids.astype(object))
+    return df
+
+
+def main():
+    """Main function of combining prediction files."""
+    args = parse_args()
+    # Get the list of all CSV files in the folder
+    csv_files = sorted(glob.glob(os.path.join(args.csv_dir, '*.csv')))
+
+    param_parser = get_param_parser(args.param_regex)
+
+    if args.store is not None:
+        changed = update_store(args.store, csv_files, args.nproc,
+                               args.id_col, args.value_col, param_parser)
+        print(f'Updated {len(changed)} parameters of {args.store}: '
+              f"{', '.join(changed)}")
+        df = load_store(args.store, args.id_col)
+        write_columnar(df, args.out)
+        if args.columnar_out is not None:
+            write_columnar(df, args.columnar_out)
+        num_rows = len(df)
+    elif args.columnar:
+        df = combine_columnar(csv_files, args.nproc, args.id_col,
+                              args.value_col, param_parser)
+        write_columnar(df, args.out)
+        if args.columnar_out is not None:
+            write_columnar(df, args.columnar_out)
+        num_rows = len(df)
+    elif args.streaming:
+        num_rows = combine_streaming(csv_files, args.out, args.chunk_rows,
+                                     args.tmp_dir, args.id_col,
+                                     args.value_col, param_parser)
+    else:
+        num_rows = combine_in_memory(csv_files, args.out, args.id_col,
+                                     args.value_col, param_parser)
+    print(f'Combined {len(csv_files)} files into {num_rows} rows of '
+          f'{args.out}')
+    print("Combined CSV file has been created successfully!")
+
 
-# Specify the path where your CSV files are located
-csv_folder_path = 'C:/shubham_data/Project_data/pred_csv/'
-
-# Get the list of all CSV files in the folder
-csv_files = glob.glob(csv_folder_path + "*.csv")
-
-# Dictionary to store the combined data, where the key is the image_id and the value is another dictionary of parameters
-combined_data = {}
-
-# Iterate through each CSV file
-for file in csv_files:
-    # Extract the parameter name from the filename (assumes the filename is the parameter)
-    parameter_name = os.path.basename(file).split('.')[0].split('_')[1]  # Adjust this as per your file naming convention
-
-    # Open the current CSV file and read it
-    with open(file, mode='r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            image_id = row['image_id']
-            pred_value = row['predication']
-            
-            # If the image_id is not already in the combined_data, add it
-            if image_id not in combined_data:
-                combined_data[image_id] = {}
-            
-            # Add the predicted value for this parameter
-            combined_data[image_id][parameter_name] = pred_value
-
-# Write the combined data to a new CSV file
-with open('combined_predictions.csv', mode='w', newline='') as f:
-    # Get the header (all parameter names) by checking the first entry in the combined_data
-    all_params = sorted(next(iter(combined_data.values())).keys())
-    fieldnames = ['image_id'] + all_params
-    
-    writer = csv.DictWriter(f, fieldnames=fieldnames)
-    writer.writeheader()
-
-    # Write each image_id and its associated parameter values
-    for image_id, params in combined_data.items():
-        row = {'image_id': image_id}
-        row.update(params)
-        writer.writerow(row)
-
-print("Combined CSV file has been created successfully!")
+if __name__ == '__main__':
+    main()
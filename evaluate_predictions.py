@@ -0,0 +1,218 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+
+def parse_args():
+    """Parse arguments."""
+    parser = argparse.ArgumentParser(
+        description='Evaluate predicted against actual perception scores')
+    parser.add_argument(
+        '--pred',
+        type=str,
+        required=True,
+        help='CSV of predictions and their *_norm_act columns')
+    parser.add_argument(
+        '--out', type=str, required=True, help='CSV of the metrics')
+    parser.add_argument(
+        '--suffix',
+        type=str,
+        default='_norm_act',
+        help='suffix of the actual columns')
+    parser.add_argument(
+        '--bins', type=int, default=100, help='bins of the density plots')
+    parser.add_argument(
+        '--plot-dir',
+        type=str,
+        default=None,
+        help='dir to save a density plot per study, needs matplotlib')
+    args = parser.parse_args()
+    assert args.bins > 0
+    assert args.plot_dir is None or plt is not None, \
+        'matplotlib is needed for --plot-dir'
+    return args
+
+
+def get_eval_pairs(df, suffix='_norm_act'):
+    """Find the ``(prediction, actual)`` column pairs of a frame.
+
+    Args:
+        df (pd.DataFrame): Frame with ``<study>`` and ``<study><suffix>``
+            columns.
+        suffix (str): Suffix of the actual columns.
+
+    Returns:
+        list[tuple[str]]: Prediction and actual column of every study.
+    """
+    return [(col[:-len(suffix)], col) for col in df.columns
+            if col.endswith(suffix) and col[:-len(suffix)] in df.columns]
+
+
+def _masked_arrays(df, pairs):
+    """Stack pairs into (N, K) arrays, NaN where either value is missing."""
+    pred = df[[p for p, _ in pairs]].to_numpy(dtype=np.float64, copy=True)
+    actual = df[[a for _, a in pairs]].to_numpy(dtype=np.float64, copy=True)
+    valid = np.isfinite(pred) & np.isfinite(actual)
+    pred[~valid] = np.nan
+    actual[~valid] = np.nan
+    return pred, actual, valid
+
+
+def _pearson(x, y, valid):
+    """Column-wise Pearson correlation, slope and intercept of y on x."""
+    num = valid.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.nansum(x, axis=0) / num
+        mean_y = np.nansum(y, axis=0) / num
+        dx, dy = x - mean_x, y - mean_y
+        cov = np.nansum(dx * dy, axis=0)
+        var_x = np.nansum(dx * dx, axis=0)
+        var_y = np.nansum(dy * dy, axis=0)
+        corr = cov / np.sqrt(var_x * var_y)
+        slope = cov / var_x
+    return corr, slope, mean_y - slope * mean_x
+
+
+def evaluate_pairs(df, pairs):
+    """Compute metrics of all prediction/actual pairs in one pass.
+
+    Rows missing either value of a pair are masked for that pair only.
+    Slope and intercept are of the least-squares line predicting the
+    prediction from the actual value, as plotted in ``merge_df.ipynb``.
+
+    Args:
+        df (pd.DataFrame): Frame with the columns of ``pairs``.
+        pairs (list[tuple[str]]): Prediction and actual columns.
+
+    Returns:
+        pd.DataFrame: One row per pair with ``study``, ``pred_col``,
+            ``actual_col``, ``n``, ``pearson``, ``spearman``, ``slope``,
+            ``intercept``, ``rmse`` and ``mae``.
+    """
+    pred, actual, valid = _masked_arrays(df, pairs)
+    num = valid.sum(axis=0)
+    pearson, slope, intercept = _pearson(actual, pred, valid)
+    # NaN stays unranked, so every pair is ranked over its own rows only
+    pred_rank = pd.DataFrame(pred).rank().to_numpy()
+    actual_rank = pd.DataFrame(actual).rank().to_numpy()
+    spearman, _, _ = _pearson(actual_rank, pred_rank, valid)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        err = pred - actual
+        rmse = np.sqrt(np.nansum(err * err, axis=0) / num)
+        mae = np.nansum(np.abs(err), axis=0) / num
+
+    return pd.DataFrame(
+        dict(
+            study=[p for p, _ in pairs],
+            pred_col=[p for p, _ in pairs],
+            actual_col=[a for _, a in pairs],
+            n=num,
+            pearson=pearson,
+            spearman=spearman,
+            slope=slope,
+            intercept=intercept,
+            rmse=rmse,
+            mae=mae))
+
+
+def density_histograms(df, pairs, bins=100):
+    """Bin the actual/prediction points of all pairs into 2D histograms.
+
+    Bin codes of all pairs are combined into one ``np.bincount``, so the
+    plots render from ``(K, bins, bins)`` counts instead of every point.
+
+    Args:
+        df (pd.DataFrame): Frame with the columns of ``pairs``.
+        pairs (list[tuple[str]]): Prediction and actual columns.
+        bins (int): Bins along each axis.
+
+    Returns:
+        tuple[np.array]: Counts with shape (K, bins, bins) indexed by
+            prediction bin then actual bin, and the actual and prediction
+            bin edges with shape (K, bins + 1).
+    """
+    pred, actual, valid = _masked_arrays(df, pairs)
+    num_pairs = len(pairs)
+
+    def edges_of(values):
+        low = np.where(valid, values, np.inf).min(axis=0)
+        high = np.where(valid, values, -np.inf).max(axis=0)
+        low = np.where(np.isfinite(low), low, 0.)
+        high = np.where(high > low, high, low + 1.)
+        return np.linspace(low, high, bins + 1, axis=1)
+
+    def bin_of(values, edges):
+        scale = bins / (edges[:, -1] - edges[:, 0])
+        inds = np.floor((values - edges[:, 0]) * scale)
+        return np.clip(np.nan_to_num(inds), 0, bins - 1).astype(np.int64)
+
+    actual_edges, pred_edges = edges_of(actual), edges_of(pred)
+    codes = (np.arange(num_pairs) * bins + bin_of(pred, pred_edges)) * bins \
+        + bin_of(actual, actual_edges)
+    counts = np.bincount(codes[valid], minlength=num_pairs * bins * bins)
+    return counts.reshape(num_pairs, bins, bins), actual_edges, pred_edges
+
+
+def plot_density(counts, actual_edges, pred_edges, metrics, out_file=None):
+    """Plot a binned density scatterplot with its best-fit line.
+
+    Args:
+        counts (np.array): Counts with shape (bins, bins).
+        actual_edges (np.array): Actual bin edges.
+        pred_edges (np.array): Prediction bin edges.
+        metrics (dict | pd.Series): A row of :func:`evaluate_pairs`.
+        out_file (str, optional): Save the plot here instead of showing it.
+    """
+    plt.figure(figsize=(10, 6))
+    mesh = plt.pcolormesh(actual_edges, pred_edges,
+                          np.ma.masked_equal(counts, 0), cmap='Blues')
+    plt.colorbar(mesh, label='Density')
+
+    line_x = actual_edges[[0, -1]]
+    plt.plot(line_x, metrics['slope'] * line_x + metrics['intercept'],
+             color='red', label='Best-fit line')
+    plt.text(0.05, 0.95, f"Correlation: {metrics['pearson']:.2f}",
+             ha='left', va='center', transform=plt.gca().transAxes,
+             fontsize=12, color='black')
+
+    plt.xlabel('Actual Values')
+    plt.ylabel('Predicted Values')
+    plt.title('Density Scatterplot of Actual vs Predicted Values '
+              f"{metrics['study']}")
+    plt.legend()
+    if out_file is None:
+        plt.show()
+    else:
+        plt.savefig(out_file)
+        plt.close()
+
+
+def main():
+    """Main function of the evaluation."""
+    args = parse_args()
+    df = pd.read_csv(args.pred)
+    pairs = get_eval_pairs(df, args.suffix)
+    assert pairs, f'no prediction has a {args.suffix} column'
+
+    metrics = evaluate_pairs(df, pairs)
+    metrics.to_csv(args.out, index=False)
+    print(metrics.to_string(index=False))
+
+    if args.plot_dir is not None:
+        os.makedirs(args.plot_dir, exist_ok=True)
+        counts, actual_edges, pred_edges = density_histograms(
+            df, pairs, args.bins)
+        for i, row in metrics.iterrows():
+            plot_density(counts[i], actual_edges[i], pred_edges[i], row,
+                         os.path.join(args.plot_dir, f"{row['study']}.png"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import argparse
+
+import pandas as pd
+
+
+def parse_args():
+    """Parse arguments."""
+    parser = argparse.ArgumentParser(
+        description='Add normalized trueskill scores to combined predictions')
+    parser.add_argument(
+        '--pred', type=str, required=True, help='combined predictions CSV')
+    parser.add_argument(
+        '--trueskill',
+        type=str,
+        required=True,
+        help='trueskill perception score CSV')
+    parser.add_argument(
+        '--out', type=str, required=True, help='output CSV')
+    parser.add_argument(
+        '--pred-key',
+        type=str,
+        default='image_filename',
+        help='image column of the predictions')
+    parser.add_argument(
+        '--score-range',
+        nargs=2,
+        type=float,
+        default=[0, 10],
+        help='range of the normalized scores')
+    return parser.parse_args()
+
+
+def multiway_merge(dfs, on='image_filename', how='outer', sort=False):
+    """Merge frames on a key column in one pass.
+
+    Gives the same rows and values as
+    ``reduce(lambda x, y: pd.merge(x, y, on=on, how=how), dfs)`` for unique
+    keys, but the key index is set once per frame and all frames are aligned
+    by a single concat, so the growing frame is not copied at every step.
+    Only the row order differs: an outer merge chain sorts the keys, which
+    ``sort=True`` reproduces, while the default keeps the order keys first
+    appear in.
+
+    Args:
+        dfs (list[pd.DataFrame]): Frames with the key column.
+        on (str): Key column, unique in every frame.
+        how (str): ``outer`` or ``inner``. Defaults to ``outer``.
+        sort (bool): If True, sort rows by key, otherwise keys keep the
+            order they first appear in. Defaults to False.
+
+    Returns:
+        pd.DataFrame: The key column and the other columns of all frames.
+    """
+    assert how in ['outer', 'inner']
+    indexed = []
+    columns = set()
+    for df in dfs:
+        df = df.set_index(on)
+        if not df.index.is_unique:
+            raise ValueError(f'duplicated {on} values can not be merged')
+        overlap = columns.intersection(df.columns)
+        if overlap:
+            raise ValueError(f'columns {sorted(overlap)} are in several '
+                             'frames')
+        columns.update(df.columns)
+        indexed.append(df)
+    merged = pd.concat(indexed, axis=1, join=how, sort=sort)
+    merged.index.name = on
+    return merged.reset_index()
+
+
+def normalize_scores(trueskill_data, start=0, end=10, study_col='study_id',
+                     img_col='img_id', score_col='trueskill.score'):
+    """Min-max scale scores per study and spread studies into columns.
+
+    Args:
+        trueskill_data (pd.DataFrame): One score per image and study.
+        start (float): Normalized score of the minimum of a study.
+        end (float): Normalized score of the maximum of a study.
+        study_col (str): Study column.
+        img_col (str): Image column.
+        score_col (str): Score column.
+
+    Returns:
+        pd.DataFrame: Indexed by image, a ``<study>_norm_act`` column per
+            study in the order studies first appear.
+    """
+    groups = trueskill_data.groupby(study_col, sort=False)[score_col]
+    min_ = groups.transform('min')
+    max_ = groups.transform('max')
+    norm = (trueskill_data[score_col] - min_) / (max_ - min_) * \
+        (end - start) + start
+
+    studies = trueskill_data[study_col].unique()
+    scores = pd.DataFrame({
+        img_col: trueskill_data[img_col],
+        study_col: trueskill_data[study_col],
+        'norm': norm
+    }).pivot(index=img_col, columns=study_col, values='norm')
+    scores = scores.reindex(columns=studies)
+    scores.columns = [f'{study}_norm_act' for study in studies]
+    scores.columns.name = None
+    return scores
+
+
+def add_normalized_scores(combined_pred, trueskill_data, start=0, end=10,
+                          pred_key='image_filename', **kwargs):
+    """Left join the normalized scores of every study to the predictions.
+
+    Args:
+        combined_pred (pd.DataFrame): Combined predictions.
+        trueskill_data (pd.DataFrame): Trueskill scores.
+        start (float): Normalized score of the minimum of a study.
+        end (float): Normalized score of the maximum of a study.
+        pred_key (str): Image column of the predictions.
+        kwargs (dict): Column names passed to :func:`normalize_scores`.
+
+    Returns:
+        pd.DataFrame: Predictions with a ``<study>_norm_act`` column per
+            study.
+    """
+    scores = normalize_scores(trueskill_data, start, end, **kwargs)
+    return combined_pred.join(scores, on=pred_key)
+
+
+def main():
+    """Main function of adding the normalized scores."""
+    args = parse_args()
+    combined_pred = pd.read_csv(args.pred)
+    trueskill_data = pd.read_csv(args.trueskill)
+    trueskill_data = trueskill_data.drop(columns=['Unnamed: 0'],
+                                         errors='ignore')
+
+    start, end = args.score_range
+    combined_pred = add_normalized_scores(combined_pred, trueskill_data,
+                                          start, end, args.pred_key)
+    combined_pred.to_csv(args.out, index=False)
+    print(f'Saved {len(combined_pred)} rows to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
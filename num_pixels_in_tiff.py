@@ -1,32 +1,881 @@
+import argparse
+import glob
+import os
+from multiprocessing import Pool
+
 import rasterio
 import numpy as np
+from rasterio import features, windows
+from rasterio.windows import Window
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    import geopandas as gpd
+except ImportError:
+    gpd = None
+
+# WGS84 semi-major axis and squared eccentricity for geodesic pixel areas
+WGS84_A = 6378137.
+WGS84_E2 = 6.69437999014e-3
+
+
+def parse_args():
+    """Parse arguments."""
+    parser = argparse.ArgumentParser(
+        description='Count pixels and area of every category of a raster')
+    parser.add_argument(
+        'tiff_file',
+        type=str,
+        help='path of the TIFF file, or a glob of TIFF files')
+    parser.add_argument(
+        '--band', type=int, default=1, help='band holding the categories')
+    parser.add_argument(
+        '--pixel-size',
+        type=float,
+        default=None,
+        help='pixel size in meters, taken from the raster transform if unset')
+    parser.add_argument(
+        '--max-pixels',
+        type=int,
+        default=1 << 24,
+        help='maximum number of pixels read at once')
+    parser.add_argument(
+        '--nproc',
+        type=int,
+        default=1,
+        help='processes counting blocks of all files')
+    parser.add_argument(
+        '--out',
+        type=str,
+        default=None,
+        help='CSV of the category x file area table, of the transitions '
+        'with --change-to or of the zones with --zones, needs pandas')
+    parser.add_argument(
+        '--change-to',
+        type=str,
+        default=None,
+        help='TIFF of a later epoch aligned with tiff_file, counts the '
+        'from/to category transitions between them')
+    parser.add_argument(
+        '--zones',
+        type=str,
+        default=None,
+        help='vector file of zones, counts categories per zone, needs '
+        'geopandas')
+    parser.add_argument(
+        '--zone-field',
+        type=str,
+        default=None,
+        help='attribute naming the zones, their row number by default')
+    parser.add_argument(
+        '--all-touched',
+        action='store_true',
+        help='count every pixel touched by a zone, not only those whose '
+        'center is inside it')
+    args = parser.parse_args()
+    assert args.nproc > 0
+    assert args.out is None or pd is not None, 'pandas is needed for --out'
+    assert args.zones is None or gpd is not None, \
+        'geopandas is needed for --zones'
+    assert args.zones is None or args.change_to is None
+    return args
+
+
+class CategoryCounts:
+    """Pixel counts and areas per category accumulated over blocks.
+
+    8 and 16 bit integer blocks are counted with ``np.bincount`` into a
+    fixed table over the whole dtype range. Wider integers are counted with
+    ``np.bincount`` over the value range of each block when it is small,
+    other blocks and floats fall back to ``np.unique``. Areas are summed by
+    the same ``np.bincount`` calls weighted by the pixel areas.
+    """
+
+    def __init__(self):
+        self._table = None
+        self._area_table = None
+        self._offset = 0
+        self._sparse = dict()
+
+    def update(self, data, weights=None):
+        """Count the pixels of a block.
+
+        Args:
+            data (np.array): Categories of the block.
+            weights (np.array, optional): Pixel areas broadcastable to
+                ``data``, e.g. with shape (H, 1) for per-row areas.
+        """
+        data = np.asarray(data)
+        if weights is not None:
+            weights = np.broadcast_to(weights, data.shape).ravel()
+        data = data.ravel()
+        if not data.size:
+            return
+        if data.dtype.kind in 'iub' and data.dtype.itemsize <= 2:
+            info = np.iinfo(data.dtype) if data.dtype.kind != 'b' else \
+                np.iinfo(np.uint8)
+            if self._table is None:
+                self._table = np.zeros(int(info.max) - int(info.min) + 1,
+                                       dtype=np.int64)
+                self._area_table = np.zeros(self._table.size)
+                self._offset = int(info.min)
+            if data.dtype.kind != 'u':
+                data = data.astype(np.int32) - self._offset
+            self._table += np.bincount(data, minlength=self._table.size)
+            if weights is not None:
+                self._area_table += np.bincount(
+                    data, weights, minlength=self._table.size)
+            return
+
+        if data.dtype.kind in 'iu':
+            low, high = int(data.min()), int(data.max())
+            if high - low < 1 << 20:
+                inds = (data - low).astype(np.intp)
+                counts = np.bincount(inds)
+                values = np.nonzero(counts)[0]
+                areas = None if weights is None else \
+                    np.bincount(inds, weights)[values]
+                self._add(values + low, counts[values], areas)
+                return
+        values, inds, counts = np.unique(data, return_inverse=True,
+                                         return_counts=True)
+        areas = None if weights is None else \
+            np.bincount(inds.ravel(), weights, minlength=values.size)
+        self._add(values, counts, areas)
+
+    def merge(self, other):
+        """Add the counts of another instance."""
+        if other._table is not None:
+            if self._table is None:
+                self._table = other._table.copy()
+                self._area_table = other._area_table.copy()
+                self._offset = other._offset
+            else:
+                self._table += other._table
+                self._area_table += other._area_table
+        for value, (count, area) in other._sparse.items():
+            self._add_one(value, count, area)
+
+    def result(self, nodata=None):
+        """Get the counted categories.
+
+        Args:
+            nodata (int | float, optional): Category left out, NaN is
+                always left out.
+
+        Returns:
+            tuple[np.array]: Sorted categories, their pixel counts and
+                summed weights, which are 0 without weights.
+        """
+        counts = dict(self._sparse)
+        if self._table is not None:
+            values = np.nonzero(self._table)[0]
+            for value, count, area in zip(
+                    (values + self._offset).tolist(),
+                    self._table[values].tolist(),
+                    self._area_table[values].tolist()):
+                old_count, old_area = counts.get(value, (0, 0.))
+                counts[value] = (old_count + count, old_area + area)
+        categories = np.array(sorted(
+            v for v in counts if v == v and (nodata is None or v != nodata)))
+        pixels = np.array([counts[v][0] for v in categories.tolist()],
+                          dtype=np.int64)
+        areas = np.array([counts[v][1] for v in categories.tolist()],
+                         dtype=np.float64)
+        return categories, pixels, areas
+
+    def _add(self, values, counts, areas=None):
+        areas = [0.] * len(values) if areas is None else areas.tolist()
+        for value, count, area in zip(values.tolist(), counts.tolist(),
+                                      areas):
+            self._add_one(value, count, area)
+
+    def _add_one(self, value, count, area):
+        old_count, old_area = self._sparse.get(value, (0, 0.))
+        self._sparse[value] = (old_count + count, old_area + area)
+
+
+def iter_block_windows(src, band=1, max_pixels=1 << 24):
+    """Iterate windows aligned with the internal blocks of a raster.
+
+    Whole rows of blocks are merged into windows of at most ``max_pixels``
+    pixels, so strip-based files are not read one strip at a time. Rows of
+    blocks larger than that are read block by block.
+
+    Args:
+        src (rasterio.DatasetReader): Opened raster.
+        band (int): Band whose block layout is followed.
+        max_pixels (int): Maximum pixels per window.
+
+    Yields:
+        rasterio.windows.Window: Windows covering the raster once.
+    """
+    block_height, _ = src.block_shapes[band - 1]
+    if src.width * block_height > max_pixels:
+        for _, window in src.block_windows(band):
+            yield window
+        return
+
+    rows = max(max_pixels // (src.width * block_height), 1) * block_height
+    for row in range(0, src.height, rows):
+        yield Window(0, row, src.width, min(rows, src.height - row))
+
+
+def get_pixel_area(transform):
+    """Get the area of a pixel in squared CRS units from its transform."""
+    return abs(transform.a * transform.e - transform.b * transform.d)
+
+
+def get_row_areas(src):
+    """Get the area of the pixels of every row of a raster.
+
+    Pixels of geographic rasters get their geodesic area on the WGS84
+    ellipsoid in squared meters, which only depends on the row. Projected
+    rasters get the area of :func:`get_pixel_area` for every row.
 
-# Define the pixel size (25 meters in both x and y directions)
-pixel_size = 25  # meters
+    Args:
+        src (rasterio.DatasetReader): Opened raster.
 
-def calculate_area_per_category(tiff_file):
-    # Open the TIFF file
+    Returns:
+        np.array: Pixel area of every row with shape (height, ).
+    """
+    transform = src.transform
+    if src.crs is None or not src.crs.is_geographic:
+        return np.full(src.height, get_pixel_area(transform))
+    if transform.b or transform.d:
+        raise ValueError('rotated geographic rasters are not supported')
+
+    lat = np.radians(transform.f + transform.e * np.arange(src.height + 1))
+    sin = np.sin(np.clip(lat, -np.pi / 2, np.pi / 2))
+    e = np.sqrt(WGS84_E2)
+    # authalic latitude function, the area between two parallels over a
+    # longitude span is proportional to its difference
+    q = sin / (1 - WGS84_E2 * sin**2) - \
+        np.log((1 - e * sin) / (1 + e * sin)) / (2 * e)
+    return np.abs(np.diff(q)) * abs(np.radians(transform.a)) * \
+        WGS84_A**2 * (1 - WGS84_E2) / 2
+
+
+def _count_windows(task):
+    """Count categories of windows of a raster in a worker."""
+    tiff_file, band, windows, row_off, row_areas = task
+    counts = CategoryCounts()
+    with rasterio.open(tiff_file) as src:
+        for col_off, row, width, height in windows:
+            data = src.read(band, window=Window(col_off, row, width, height))
+            weights = None if row_areas is None else \
+                row_areas[row - row_off:row - row_off + height, None]
+            counts.update(data, weights)
+    return tiff_file, counts
+
+
+def get_count_tasks(tiff_file, band=1, max_pixels=1 << 24,
+                    windows_per_task=4):
+    """Split the block windows of a raster into counting tasks.
+
+    Args:
+        tiff_file (str): Path of the raster.
+        band (int): Band holding the categories.
+        max_pixels (int): Maximum pixels read at once.
+        windows_per_task (int): Windows counted by every task.
+
+    Returns:
+        tuple[list[tuple], float | None, int | float | None]: Tasks, the
+            pixel area if it is the same for all rows and the nodata value.
+    """
     with rasterio.open(tiff_file) as src:
-        # Read the data as a numpy array
-        data = src.read(1)  # assuming single band; for multiband, adjust accordingly
+        windows = list(iter_block_windows(src, band, max_pixels))
+        row_areas = get_row_areas(src)
+        nodata = src.nodatavals[band - 1]
+
+    pixel_area = None
+    if (row_areas == row_areas[:1]).all():
+        # weights are only needed when the area changes along rows
+        pixel_area = float(row_areas[0]) if len(row_areas) else 0.
+    tasks = []
+    for i in range(0, len(windows), windows_per_task):
+        chunk = windows[i:i + windows_per_task]
+        row_off = min(w.row_off for w in chunk)
+        row_stop = max(w.row_off + w.height for w in chunk)
+        tasks.append((tiff_file, band,
+                      [(w.col_off, w.row_off, w.width, w.height)
+                       for w in chunk], row_off,
+                      None if pixel_area is not None else
+                      row_areas[row_off:row_stop]))
+    return tasks, pixel_area, nodata
+
+
+def count_files(tiff_files, band=1, max_pixels=1 << 24, nproc=1):
+    """Count pixels and areas of every category of several rasters.
+
+    Blocks of all files are counted on one process pool, so a single large
+    file is spread over every process as well.
+
+    Args:
+        tiff_files (list[str]): Paths of the rasters.
+        band (int): Band holding the categories.
+        max_pixels (int): Maximum pixels read at once.
+        nproc (int): Number of processes.
+
+    Returns:
+        dict: Sorted categories, their pixel counts and areas of every file.
+    """
+    tasks, pixel_areas, nodatas = [], dict(), dict()
+    for tiff_file in tiff_files:
+        file_tasks, pixel_areas[tiff_file], nodatas[tiff_file] = \
+            get_count_tasks(tiff_file, band, max_pixels)
+        tasks += file_tasks
+
+    counts = {tiff_file: CategoryCounts() for tiff_file in tiff_files}
+    if nproc > 1 and len(tasks) > 1:
+        with Pool(min(nproc, len(tasks))) as pool:
+            for tiff_file, task_counts in pool.imap_unordered(
+                    _count_windows, tasks):
+                counts[tiff_file].merge(task_counts)
+    else:
+        for tiff_file, task_counts in map(_count_windows, tasks):
+            counts[tiff_file].merge(task_counts)
 
-        # Get unique categories and their counts
-        unique, counts = np.unique(data, return_counts=True)
+    results = dict()
+    for tiff_file in tiff_files:
+        categories, pixels, areas = counts[tiff_file].result(
+            nodatas[tiff_file])
+        if pixel_areas[tiff_file] is not None:
+            areas = pixels * pixel_areas[tiff_file]
+        results[tiff_file] = (categories, pixels, areas)
+    return results
 
-        # Calculate the area for each category
-        pixel_area = pixel_size * pixel_size  # Area of each pixel in square meters
-        areas = counts * pixel_area  # Total area per category
 
-        # Create a dictionary to store the category and area information
-        category_area = dict(zip(unique, areas))
+def count_categories(tiff_file, band=1, max_pixels=1 << 24, nproc=1):
+    """Count the pixels of every category of a raster block by block.
 
-        # Print the results
-        print("Category -> Number of Pixels -> Area (square meters)")
-        for category, count, area in zip(unique, counts, areas):
-            print(f"{category} -> {count} pixels -> {area:.2f} square meters")
+    Memory is bounded by ``max_pixels`` per process whatever the raster
+    size. Pixels equal to the band's nodata value are not counted.
+
+    Args:
+        tiff_file (str): Path of the raster.
+        band (int): Band holding the categories.
+        max_pixels (int): Maximum pixels read at once.
+        nproc (int): Number of processes counting blocks.
+
+    Returns:
+        tuple[np.array]: Sorted categories, their pixel counts and areas,
+            see :func:`get_row_areas`.
+    """
+    return count_files([tiff_file], band, max_pixels, nproc)[tiff_file]
+
+
+def area_table(tiff_files, band=1, max_pixels=1 << 24, nproc=1,
+               pixel_size=None):
+    """Get the area of every category of every raster as one table.
+
+    Args:
+        tiff_files (list[str]): Paths of the rasters.
+        band (int): Band holding the categories.
+        max_pixels (int): Maximum pixels read at once.
+        nproc (int): Number of processes.
+        pixel_size (float, optional): Pixel size overriding the areas from
+            the rasters.
+
+    Returns:
+        pd.DataFrame: Areas indexed by category with a column per file
+            named after its basename without extension.
+    """
+    columns = []
+    for tiff_file, (categories, pixels, areas) in count_files(
+            tiff_files, band, max_pixels, nproc).items():
+        if pixel_size is not None:
+            areas = pixels * pixel_size * pixel_size
+        columns.append(pd.Series(
+            areas, index=pd.Index(categories, name='Category'),
+            name=os.path.splitext(os.path.basename(tiff_file))[0]))
+    return pd.concat(columns, axis=1).sort_index().fillna(0.)
+
+
+def calculate_area_per_category(tiff_file, pixel_size=None, band=1,
+                                max_pixels=1 << 24, nproc=1):
+    """Calculate the area of every category of a raster.
+
+    Args:
+        tiff_file (str): Path of the raster.
+        pixel_size (float, optional): Pixel size in meters in both x and y
+            directions. Defaults to the pixel size of the raster transform.
+        band (int): Band holding the categories. Defaults to 1.
+        max_pixels (int): Maximum pixels read at once.
+        nproc (int): Number of processes counting blocks.
+
+    Returns:
+        dict: Area in squared units of every category.
+    """
+    # Total area per category
+    categories, counts, areas = count_categories(tiff_file, band,
+                                                 max_pixels, nproc)
+    if pixel_size is not None:
+        pixel_area = pixel_size * pixel_size  # Area of each pixel
+        areas = counts * pixel_area
+
+    # Create a dictionary to store the category and area information
+    category_area = dict(zip(categories.tolist(), areas.tolist()))
+
+    # Print the results
+    print("Category -> Number of Pixels -> Area (square meters)")
+    for category, count, area in zip(categories, counts, areas):
+        print(f"{category} -> {count} pixels -> {area:.2f} square meters")
 
     return category_area
 
-# Example usage
-tiff_file = 'your_tiff_file.tif'  # Replace with the path to your TIFF file
-category_areas = calculate_area_per_category(tiff_file)
+
+class TransitionCounts:
+    """Pixel counts and areas per pair of categories of two rasters.
+
+    Every pixel pair is encoded as ``a * K + b`` and counted with one
+    ``np.bincount``. Integer blocks use their value range for ``K`` when
+    ``K * K`` is small, other blocks are first mapped to their unique
+    values.
+    """
+
+    def __init__(self):
+        self._pairs = dict()
+
+    def update(self, data_a, data_b, weights=None):
+        """Count the category pairs of a block.
+
+        Args:
+            data_a (np.array): Categories of the block in the first raster.
+            data_b (np.array): Categories of the block in the second raster.
+            weights (np.array, optional): Pixel areas broadcastable to the
+                block.
+        """
+        data_a, data_b = np.asarray(data_a), np.asarray(data_b)
+        assert data_a.shape == data_b.shape
+        if weights is not None:
+            weights = np.broadcast_to(weights, data_a.shape).ravel()
+        data_a, data_b = data_a.ravel(), data_b.ravel()
+        if not data_a.size:
+            return
+
+        if data_a.dtype.kind in 'iub' and data_b.dtype.kind in 'iub':
+            low = min(int(data_a.min()), int(data_b.min()))
+            k = max(int(data_a.max()), int(data_b.max())) - low + 1
+            if k * k <= 1 << 24:
+                codes = (data_a.astype(np.int64) - low) * k + \
+                    (data_b.astype(np.int64) - low)
+                self._add(codes, k, weights, np.arange(k) + low,
+                          np.arange(k) + low)
+                return
+        values_a, inds_a = np.unique(data_a, return_inverse=True)
+        values_b, inds_b = np.unique(data_b, return_inverse=True)
+        codes = inds_a.ravel().astype(np.int64) * len(values_b) + \
+            inds_b.ravel()
+        self._add(codes, len(values_b), weights, values_a, values_b)
+
+    def update_indexed(self, inds_a, values_a, data_b, weights=None):
+        """Count category pairs whose first categories are given by index.
+
+        The bincount spans ``len(values_a)`` first categories whatever
+        their values, so a block touching a few of many zones only counts
+        those.
+
+        Args:
+            inds_a (np.array): Indices into ``values_a`` of the pixels.
+            values_a (np.array): Categories of the first raster.
+            data_b (np.array): Categories of the pixels in the second
+                raster.
+            weights (np.array, optional): Pixel areas broadcastable to the
+                pixels.
+        """
+        inds_a, data_b = np.asarray(inds_a), np.asarray(data_b)
+        assert inds_a.shape == data_b.shape
+        if weights is not None:
+            weights = np.broadcast_to(weights, data_b.shape).ravel()
+        inds_a = inds_a.ravel().astype(np.int64)
+        data_b = data_b.ravel()
+        values_a = np.asarray(values_a)
+        if not data_b.size:
+            return
+
+        if data_b.dtype.kind in 'iub':
+            low = int(data_b.min())
+            k = int(data_b.max()) - low + 1
+            if len(values_a) * k <= 1 << 24:
+                self._add(inds_a * k + (data_b.astype(np.int64) - low), k,
+                          weights, values_a, np.arange(k) + low)
+                return
+        values_b, inds_b = np.unique(data_b, return_inverse=True)
+        self._add(inds_a * len(values_b) + inds_b.ravel(), len(values_b),
+                  weights, values_a, values_b)
+
+    def merge(self, other):
+        """Add the counts of another instance."""
+        for pair, (count, area) in other._pairs.items():
+            old_count, old_area = self._pairs.get(pair, (0, 0.))
+            self._pairs[pair] = (old_count + count, old_area + area)
+
+    def result(self, nodata_a=None, nodata_b=None):
+        """Get the counted transitions.
+
+        Args:
+            nodata_a (int | float, optional): Category of the first raster
+                left out, NaN is always left out.
+            nodata_b (int | float, optional): Same for the second raster.
+
+        Returns:
+            tuple[np.array]: Sorted categories of the first and the second
+                raster, pixel counts and summed weights with shape
+                (len(from), len(to)).
+        """
+        pairs = [(a, b) for a, b in self._pairs
+                 if a == a and b == b and (nodata_a is None or a != nodata_a)
+                 and (nodata_b is None or b != nodata_b)]
+        from_cats = np.array(sorted(set(a for a, _ in pairs)))
+        to_cats = np.array(sorted(set(b for _, b in pairs)))
+        from_inds = {v: i for i, v in enumerate(from_cats.tolist())}
+        to_inds = {v: i for i, v in enumerate(to_cats.tolist())}
+        pixels = np.zeros((len(from_cats), len(to_cats)), dtype=np.int64)
+        areas = np.zeros((len(from_cats), len(to_cats)))
+        for a, b in pairs:
+            i, j = from_inds[a], to_inds[b]
+            pixels[i, j], areas[i, j] = self._pairs[(a, b)]
+        return from_cats, to_cats, pixels, areas
+
+    def _add(self, codes, k, weights, values_a, values_b):
+        counts = np.bincount(codes)
+        nonzero = np.nonzero(counts)[0]
+        areas = np.zeros(len(nonzero)) if weights is None else \
+            np.bincount(codes, weights)[nonzero]
+        for a, b, count, area in zip(values_a[nonzero // k].tolist(),
+                                     values_b[nonzero % k].tolist(),
+                                     counts[nonzero].tolist(),
+                                     areas.tolist()):
+            old_count, old_area = self._pairs.get((a, b), (0, 0.))
+            self._pairs[(a, b)] = (old_count + count, old_area + area)
+
+
+def _count_transition_windows(task):
+    """Count category transitions of windows of two rasters in a worker."""
+    tiff_a, tiff_b, band, windows, row_off, row_areas = task
+    counts = TransitionCounts()
+    with rasterio.open(tiff_a) as src_a, rasterio.open(tiff_b) as src_b:
+        for col_off, row, width, height in windows:
+            window = Window(col_off, row, width, height)
+            weights = None if row_areas is None else \
+                row_areas[row - row_off:row - row_off + height, None]
+            counts.update(src_a.read(band, window=window),
+                          src_b.read(band, window=window), weights)
+    return counts
+
+
+def transition_matrix(tiff_a, tiff_b, band=1, max_pixels=1 << 24, nproc=1):
+    """Count the from/to category transitions between two rasters.
+
+    Both rasters are read block by block, following the blocks of
+    ``tiff_a``, and blocks are counted in parallel, so memory is bounded by
+    ``max_pixels`` per process. Pixels that are nodata in either raster are
+    not counted.
+
+    Args:
+        tiff_a (str): Raster of the earlier epoch.
+        tiff_b (str): Raster of the later epoch, on the same grid.
+        band (int): Band holding the categories.
+        max_pixels (int): Maximum pixels read at once.
+        nproc (int): Number of processes.
+
+    Returns:
+        tuple[np.array]: Sorted categories of ``tiff_a`` and ``tiff_b``, the
+            pixel counts and the areas from every category of ``tiff_a``
+            to every category of ``tiff_b``, see :func:`get_row_areas`.
+    """
+    with rasterio.open(tiff_a) as src_a, rasterio.open(tiff_b) as src_b:
+        if src_a.shape != src_b.shape or src_a.crs != src_b.crs or \
+                not np.allclose(src_a.transform[:6], src_b.transform[:6]):
+            raise ValueError(f'{tiff_a} and {tiff_b} are not on the same '
+                             'grid')
+        nodata_b = src_b.nodatavals[band - 1]
+    # the task layout and row areas are those of the first raster
+    tasks, pixel_area, nodata_a = get_count_tasks(tiff_a, band, max_pixels)
+    tasks = [(tiff_a, tiff_b) + task[1:] for task in tasks]
+
+    counts = TransitionCounts()
+    if nproc > 1 and len(tasks) > 1:
+        with Pool(min(nproc, len(tasks))) as pool:
+            for task_counts in pool.imap_unordered(_count_transition_windows,
+                                                   tasks):
+                counts.merge(task_counts)
+    else:
+        for task_counts in map(_count_transition_windows, tasks):
+            counts.merge(task_counts)
+
+    from_cats, to_cats, pixels, areas = counts.result(nodata_a, nodata_b)
+    if pixel_area is not None:
+        areas = pixels * pixel_area
+    return from_cats, to_cats, pixels, areas
+
+
+def transition_table(tiff_a, tiff_b, band=1, max_pixels=1 << 24, nproc=1,
+                     pixel_size=None):
+    """Get the transitions between two rasters as a tidy table.
+
+    Args:
+        tiff_a (str): Raster of the earlier epoch.
+        tiff_b (str): Raster of the later epoch, on the same grid.
+        band (int): Band holding the categories.
+        max_pixels (int): Maximum pixels read at once.
+        nproc (int): Number of processes.
+        pixel_size (float, optional): Pixel size overriding the areas from
+            the rasters.
+
+    Returns:
+        pd.DataFrame: ``From``, ``To``, ``Pixels`` and ``Area`` of every
+            transition that occurs.
+    """
+    from_cats, to_cats, pixels, areas = transition_matrix(
+        tiff_a, tiff_b, band, max_pixels, nproc)
+    if pixel_size is not None:
+        areas = pixels * pixel_size * pixel_size
+    from_inds, to_inds = np.nonzero(pixels)
+    return pd.DataFrame(
+        dict(From=from_cats[from_inds], To=to_cats[to_inds],
+             Pixels=pixels[from_inds, to_inds],
+             Area=areas[from_inds, to_inds]))
+
+
+def get_geometry_bounds(geometry):
+    """Get the bounds of a shapely or GeoJSON-like geometry."""
+    if hasattr(geometry, 'bounds'):
+        return tuple(geometry.bounds)
+
+    def flatten(coords):
+        if isinstance(coords[0], (int, float)):
+            yield coords[:2]
+        else:
+            for c in coords:
+                yield from flatten(c)
+
+    if geometry['type'] == 'GeometryCollection':
+        bounds = np.array([get_geometry_bounds(g)
+                           for g in geometry['geometries']])
+        return (*bounds[:, :2].min(axis=0), *bounds[:, 2:].max(axis=0))
+    points = np.array(list(flatten(geometry['coordinates'])), dtype=float)
+    return (*points.min(axis=0), *points.max(axis=0))
+
+
+def get_zone_layers(bounds, margin=(0., 0.)):
+    """Split zones into layers of zones with disjoint bounds.
+
+    Zones of one layer never share a pixel, so they can be rasterized
+    together into one array. Zones are put greedily into the first layer
+    where they overlap no other zone, so zones tiling a region take a few
+    layers and nested or overlapping buffers take one layer per depth.
+
+    Args:
+        bounds (np.array): Zone bounds (left, bottom, right, top) with
+            shape (N, 4).
+        margin (tuple[float]): Added around the bounds, a pixel size keeps
+            zones touching the same border pixel apart.
+
+    Returns:
+        np.array: Layer index of every zone with shape (N, ).
+    """
+    bounds = bounds + np.array([-margin[0], -margin[1], margin[0],
+                                margin[1]])
+    layers = np.zeros(len(bounds), dtype=np.int64)
+    for i in range(1, len(bounds)):
+        overlaps = (bounds[:i, 0] <= bounds[i, 2]) & \
+            (bounds[:i, 2] >= bounds[i, 0]) & \
+            (bounds[:i, 1] <= bounds[i, 3]) & \
+            (bounds[:i, 3] >= bounds[i, 1])
+        used = np.zeros(i + 1, dtype=bool)
+        used[layers[:i][overlaps]] = True
+        layers[i] = np.argmin(used)
+    return layers
+
+
+# zones of the worker processes, set once by the pool initializer
+_zones = None
+
+
+def _init_zones(geometries, bounds, layers):
+    global _zones
+    _zones = (geometries, bounds, layers)
+
+
+def _count_zone_windows(task):
+    """Count categories per zone of windows of a raster in a worker."""
+    tiff_file, band, block_windows, row_off, row_areas, all_touched = task
+    geometries, bounds, layers = _zones
+    counts = TransitionCounts()
+    with rasterio.open(tiff_file) as src:
+        for col_off, row, width, height in block_windows:
+            window = Window(col_off, row, width, height)
+            left, bottom, right, top = windows.bounds(window, src.transform)
+            # only zones overlapping the block are rasterized
+            hits = np.nonzero((bounds[:, 0] <= right) &
+                              (bounds[:, 2] >= left) &
+                              (bounds[:, 1] <= top) &
+                              (bounds[:, 3] >= bottom))[0]
+            if not len(hits):
+                continue
+            data = src.read(band, window=window)
+            block_areas = None if row_areas is None else np.broadcast_to(
+                row_areas[row - row_off:row - row_off + height, None],
+                data.shape)
+            for layer in np.unique(layers[hits]).tolist():
+                layer_hits = hits[layers[hits] == layer]
+                # zones are numbered within the layer's hits, so the
+                # bincount does not grow with the number of zones
+                local_ids = features.rasterize(
+                    [(geometries[i], j + 1)
+                     for j, i in enumerate(layer_hits.tolist())],
+                    out_shape=(height, width),
+                    transform=windows.transform(window, src.transform),
+                    fill=0,
+                    all_touched=all_touched,
+                    dtype=np.int32)
+                inside = local_ids > 0
+                counts.update_indexed(
+                    local_ids[inside] - 1, layer_hits + 1, data[inside],
+                    None if block_areas is None else block_areas[inside])
+    return counts
+
+
+def zonal_category_stats(tiff_file, geometries, band=1, max_pixels=1 << 24,
+                         nproc=1, all_touched=False):
+    """Count the pixels of every category inside every zone.
+
+    Zones overlapping a block are rasterized onto its grid and the zone and
+    category of every pixel are counted together with one combined-code
+    ``np.bincount``, without any polygon overlay. Overlapping zones are
+    rasterized in separate layers, see :func:`get_zone_layers`, so a pixel
+    inside several zones is counted for each of them. Blocks are counted in
+    parallel and memory is bounded by ``max_pixels`` per process.
+
+    Args:
+        tiff_file (str): Path of the raster.
+        geometries (list): Shapely or GeoJSON-like zone polygons in the CRS
+            of the raster.
+        band (int): Band holding the categories.
+        max_pixels (int): Maximum pixels read at once.
+        nproc (int): Number of processes.
+        all_touched (bool): If True, count every pixel touched by a zone,
+            otherwise only those whose center is inside. Defaults to False.
+
+    Returns:
+        tuple[np.array]: Sorted categories, pixel counts and areas with
+            shape (len(geometries), len(categories)).
+    """
+    geometries = [g.__geo_interface__ if hasattr(g, '__geo_interface__')
+                  else g for g in geometries]
+    bounds = np.array([get_geometry_bounds(g) for g in geometries],
+                      dtype=float).reshape(-1, 4)
+    with rasterio.open(tiff_file) as src:
+        pixel_size = (abs(src.transform.a) + abs(src.transform.b),
+                      abs(src.transform.d) + abs(src.transform.e))
+    layers = get_zone_layers(bounds, pixel_size)
+    tasks, pixel_area, nodata = get_count_tasks(tiff_file, band, max_pixels)
+    tasks = [task + (all_touched, ) for task in tasks]
+
+    counts = TransitionCounts()
+    if nproc > 1 and len(tasks) > 1:
+        with Pool(min(nproc, len(tasks)), _init_zones,
+                  (geometries, bounds, layers)) as pool:
+            for task_counts in pool.imap_unordered(_count_zone_windows,
+                                                   tasks):
+                counts.merge(task_counts)
+    else:
+        _init_zones(geometries, bounds, layers)
+        for task_counts in map(_count_zone_windows, tasks):
+            counts.merge(task_counts)
+
+    zone_ids, categories, zone_pixels, zone_areas = counts.result(
+        nodata_b=nodata)
+    pixels = np.zeros((len(geometries), len(categories)), dtype=np.int64)
+    areas = np.zeros((len(geometries), len(categories)))
+    pixels[zone_ids.astype(np.int64) - 1] = zone_pixels
+    areas[zone_ids.astype(np.int64) - 1] = zone_areas
+    if pixel_area is not None:
+        areas = pixels * pixel_area
+    return categories, pixels, areas
+
+
+def zonal_table(tiff_file, zones_file, zone_field=None, band=1,
+                max_pixels=1 << 24, nproc=1, all_touched=False,
+                pixel_size=None):
+    """Get the area of every category in every zone of a vector file.
+
+    Args:
+        tiff_file (str): Path of the raster.
+        zones_file (str): Vector file of zones, reprojected to the raster.
+        zone_field (str, optional): Attribute naming the zones. Defaults
+            to their row number.
+        band (int): Band holding the categories.
+        max_pixels (int): Maximum pixels read at once.
+        nproc (int): Number of processes.
+        all_touched (bool): See :func:`zonal_category_stats`.
+        pixel_size (float, optional): Pixel size overriding the areas from
+            the raster.
+
+    Returns:
+        pd.DataFrame: ``Zone``, ``Category``, ``Pixels`` and ``Area`` of
+            every category found in a zone.
+    """
+    columns = None if zone_field is None else [zone_field]
+    zones = gpd.read_file(zones_file, columns=columns)
+    with rasterio.open(tiff_file) as src:
+        zones = zones.to_crs(src.crs)
+    names = zones.index.to_numpy() if zone_field is None else \
+        zones[zone_field].to_numpy()
+
+    categories, pixels, areas = zonal_category_stats(
+        tiff_file, list(zones.geometry), band, max_pixels, nproc,
+        all_touched)
+    if pixel_size is not None:
+        areas = pixels * pixel_size * pixel_size
+    zone_inds, cat_inds = np.nonzero(pixels)
+    return pd.DataFrame(
+        dict(Zone=names[zone_inds], Category=categories[cat_inds],
+             Pixels=pixels[zone_inds, cat_inds],
+             Area=areas[zone_inds, cat_inds]))
+
+
+if __name__ == '__main__':
+    # Example usage: python num_pixels_in_tiff.py your_tiff_file.tif
+    # or: python num_pixels_in_tiff.py "lulc/*.tif" --nproc 8 --out areas.csv
+    # or: python num_pixels_in_tiff.py lulc_0506.tif --change-to lulc_1516.tif
+    # or: python num_pixels_in_tiff.py lulc.tif --zones districts.gpkg
+    args = parse_args()
+    tiff_files = sorted(glob.glob(args.tiff_file))
+    assert tiff_files, f'no file matches {args.tiff_file}'
+    if args.zones is not None:
+        assert len(tiff_files) == 1
+        table = zonal_table(tiff_files[0], args.zones, args.zone_field,
+                            args.band, args.max_pixels, args.nproc,
+                            args.all_touched, args.pixel_size)
+        print(table.pivot(index='Zone', columns='Category',
+                          values='Area').fillna(0.).to_string())
+        if args.out is not None:
+            table.to_csv(args.out, index=False)
+    elif args.change_to is not None:
+        assert pd is not None, 'pandas is needed for the transition table'
+        assert len(tiff_files) == 1
+        table = transition_table(tiff_files[0], args.change_to, args.band,
+                                 args.max_pixels, args.nproc,
+                                 args.pixel_size)
+        print(table.pivot(index='From', columns='To',
+                          values='Area').fillna(0.).to_string())
+        if args.out is not None:
+            table.to_csv(args.out, index=False)
+    elif args.out is None and len(tiff_files) == 1:
+        category_areas = calculate_area_per_category(
+            tiff_files[0], args.pixel_size, args.band, args.max_pixels,
+            args.nproc)
+    else:
+        assert pd is not None, 'pandas is needed for the area table'
+        table = area_table(tiff_files, args.band, args.max_pixels,
+                           args.nproc, args.pixel_size)
+        print(table.to_string())
+        if args.out is not None:
+            table.to_csv(args.out)
@@ -0,0 +1,349 @@
+# Benchmark of sodaa_split.py on synthetic SODA-A style scenes
+
+
+import argparse
+import copy
+import json
+import os
+import os.path as osp
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import sodaa_split
+from sodaa_split import (CLASSES, bbox_overlaps_iof, crop_and_save_img,
+                         fill_ign, get_sliding_window, get_window_obj,
+                         load_sodaa, single_split)
+
+
+def add_parser(parser):
+    """Add arguments."""
+    parser.add_argument(
+        '--work-dir',
+        type=str,
+        default=None,
+        help='dir of the synthetic dataset and outputs, a temporary dir '
+        'by default')
+    parser.add_argument(
+        '--num-images', type=int, default=4, help='number of scenes')
+    parser.add_argument(
+        '--img-size',
+        nargs=2,
+        type=int,
+        default=[4000, 4000],
+        help='width and height of the scenes')
+    parser.add_argument(
+        '--density',
+        type=float,
+        default=100.,
+        help='objects per megapixel')
+    parser.add_argument(
+        '--ign-regions',
+        type=int,
+        default=4,
+        help='ignore regions per scene')
+    parser.add_argument(
+        '--poly-shape',
+        type=str,
+        default='rbox',
+        choices=['rbox', 'quad'],
+        help='rotated boxes or irregular convex quadrilaterals')
+    parser.add_argument(
+        '--sizes', nargs='+', type=int, default=[800], help='window sizes')
+    parser.add_argument(
+        '--gaps', nargs='+', type=int, default=[650], help='window gaps')
+    parser.add_argument(
+        '--nproc',
+        nargs='+',
+        type=int,
+        default=[1, 4],
+        help='process numbers to run main() with')
+    parser.add_argument(
+        '--repeat', type=int, default=3, help='runs per function timing')
+    parser.add_argument(
+        '--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument(
+        '--out', type=str, default=None, help='json file of the results')
+
+
+def parse_args():
+    """Parse arguments."""
+    parser = argparse.ArgumentParser(description='Benchmark sodaa_split')
+    add_parser(parser)
+    return parser.parse_args()
+
+
+def make_polys(rng, num, width, height, poly_shape='rbox'):
+    """Generate random object polygons inside an image.
+
+    Args:
+        rng (np.random.Generator): Random generator.
+        num (int): Number of polygons.
+        width (int): Image width.
+        height (int): Image height.
+        poly_shape (str): ``rbox`` for rotated rectangles or ``quad`` for
+            irregular convex quadrilaterals.
+
+    Returns:
+        np.array: Polygons with shape (num, 8).
+    """
+    centers = rng.uniform([0, 0], [width, height], (num, 1, 2))
+    half_w = rng.lognormal(2.5, 0.5, num).clip(2, 200)
+    half_h = half_w * rng.uniform(0.3, 1., num)
+    if poly_shape == 'rbox':
+        corners = np.stack([
+            np.stack([-half_w, -half_h], -1),
+            np.stack([half_w, -half_h], -1),
+            np.stack([half_w, half_h], -1),
+            np.stack([-half_w, half_h], -1)
+        ], axis=1)
+    else:
+        angles = np.sort(rng.uniform(0, 2 * np.pi, (num, 4)), axis=1)
+        radius = np.stack([half_w] * 4, -1) * rng.uniform(0.6, 1., (num, 4))
+        corners = np.stack([radius * np.cos(angles),
+                            radius * np.sin(angles)], -1)
+    theta = rng.uniform(0, np.pi, num)
+    cos, sin = np.cos(theta)[:, None], np.sin(theta)[:, None]
+    rotated = np.stack([
+        corners[..., 0] * cos - corners[..., 1] * sin,
+        corners[..., 0] * sin + corners[..., 1] * cos
+    ], -1)
+    polys = (rotated + centers).clip(0, [width - 1, height - 1])
+    return polys.reshape(num, 8)
+
+
+def make_synthetic_sodaa(out_dir, num_images=4, img_size=(4000, 4000),
+                         density=100., ign_regions=4, poly_shape='rbox',
+                         seed=0):
+    """Generate a synthetic dataset in SODA-A's layout.
+
+    Scenes are smooth noise so that jpeg sizes stay realistic.
+
+    Args:
+        out_dir (str): Output dir, ``Images`` and ``Annotations`` are
+            created inside.
+        num_images (int): Number of scenes.
+        img_size (tuple[int]): Width and height of the scenes.
+        density (float): Objects per megapixel.
+        ign_regions (int): Ignore regions per scene.
+        poly_shape (str): See :func:`make_polys`.
+        seed (int): Random seed.
+
+    Returns:
+        tuple[str]: Dirs of images and annotations.
+    """
+    img_dir = osp.join(out_dir, 'Images')
+    ann_dir = osp.join(out_dir, 'Annotations')
+    os.makedirs(img_dir, exist_ok=True)
+    os.makedirs(ann_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    width, height = img_size
+    num_objs = int(density * width * height / 1e6)
+    for i in range(num_images):
+        small = rng.integers(0, 256, (height // 16 + 1, width // 16 + 1, 3),
+                             dtype=np.uint8)
+        img = cv2.resize(small, (width, height),
+                         interpolation=cv2.INTER_CUBIC)
+        img = cv2.add(img, rng.integers(0, 16, img.shape, dtype=np.uint8))
+
+        polys = make_polys(rng, num_objs, width, height, poly_shape)
+        cat_ids = rng.integers(0, len(CLASSES) - 1, num_objs)
+        annotations = [
+            dict(poly=poly.tolist(), category_id=int(cat_id))
+            for poly, cat_id in zip(polys, cat_ids)
+        ]
+        for _ in range(ign_regions):
+            ign_w, ign_h = rng.uniform(0.02, 0.15, 2) * [width, height]
+            x, y = rng.uniform(0, 1, 2) * [width - ign_w, height - ign_h]
+            annotations.append(
+                dict(poly=[x, y, x + ign_w, y, x + ign_w, y + ign_h, x,
+                           y + ign_h],
+                     category_id=len(CLASSES) - 1))
+
+        name = f'{i:05d}'
+        cv2.imwrite(osp.join(img_dir, name + '.jpg'), img)
+        with open(osp.join(ann_dir, name + '.json'), 'w') as f:
+            json.dump(dict(annotations=annotations), f)
+    return img_dir, ann_dir
+
+
+def time_call(func, repeat=3, setup=None):
+    """Time a function call.
+
+    Args:
+        func (callable): Called with the output of ``setup``.
+        repeat (int): Number of runs.
+        setup (callable, optional): Builds fresh arguments, not timed.
+
+    Returns:
+        dict: Min, mean and max seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return dict(min=min(times), mean=sum(times) / len(times), max=max(times))
+
+
+def bench_functions(infos, img_dir, work_dir, sizes, gaps, repeat=3):
+    """Time the public functions of sodaa_split on every scene.
+
+    Args:
+        infos (list[dict]): Loaded dataset.
+        img_dir (str): Dir of images.
+        work_dir (str): Dir for the written patches.
+        sizes (list[int]): Window sizes.
+        gaps (list[int]): Window gaps.
+        repeat (int): Runs per timing.
+
+    Returns:
+        dict: Summed timings per function and the max iof error against
+            the shapely reference.
+    """
+    results = dict()
+
+    def add(name, timing):
+        total = results.setdefault(name, dict(min=0., mean=0., max=0.))
+        for k, v in timing.items():
+            total[k] += v
+
+    iof_err = 0.
+    for info in infos:
+        windows = get_sliding_window(info, sizes, gaps, 0.6)
+        add('get_sliding_window',
+            time_call(lambda: get_sliding_window(info, sizes, gaps, 0.6),
+                      repeat))
+        add('get_window_obj',
+            time_call(lambda: get_window_obj(info, windows, 0.7), repeat))
+        if sodaa_split.shgeo is not None:
+            polys = info['ann']['polys']
+            iof_err = max(iof_err, float(np.abs(
+                bbox_overlaps_iof(polys, windows) -
+                sodaa_split._bbox_overlaps_iof_shapely(polys,
+                                                       windows)).max(
+                                                           initial=0)))
+
+        img = cv2.imread(osp.join(img_dir, info['filename']))
+        add('fill_ign',
+            time_call(fill_ign, repeat,
+                      lambda: (img.copy(), copy.deepcopy(info))))
+
+        save_dir = osp.join(work_dir, 'bench_patches')
+
+        def crop_setup():
+            shutil.rmtree(save_dir, ignore_errors=True)
+            os.makedirs(save_dir)
+            _info = copy.deepcopy(info)
+            return (_info, windows, get_window_obj(_info, windows, 0.7),
+                    img_dir, False, 0, save_dir, save_dir, '.jpg')
+
+        add('crop_and_save_img', time_call(crop_and_save_img, repeat,
+                                           crop_setup))
+
+        def split_setup():
+            shutil.rmtree(save_dir, ignore_errors=True)
+            os.makedirs(save_dir)
+            return ((copy.deepcopy(info), img_dir), sizes, gaps, 0.6, 0.7,
+                    False, 0, save_dir, save_dir, '.jpg')
+
+        add('single_split', time_call(single_split, repeat, split_setup))
+    shutil.rmtree(osp.join(work_dir, 'bench_patches'), ignore_errors=True)
+
+    results['iof_max_abs_err'] = iof_err \
+        if sodaa_split.shgeo is not None else None
+    return results
+
+
+def bench_main(img_dir, ann_dir, work_dir, sizes, gaps, nprocs):
+    """Time end-to-end runs of sodaa_split.py across process numbers.
+
+    Args:
+        img_dir (str): Dir of images.
+        ann_dir (str): Dir of annotations.
+        work_dir (str): Dir for configs and outputs.
+        sizes (list[int]): Window sizes.
+        gaps (list[int]): Window gaps.
+        nprocs (list[int]): Process numbers.
+
+    Returns:
+        dict: Wall time and the split stats summary per process number.
+    """
+    config = osp.join(work_dir, 'split_config.json')
+    with open(config, 'w') as f:
+        json.dump(dict(sizes=sizes, gaps=gaps, save_ext='.jpg'), f)
+
+    results = dict()
+    for nproc in nprocs:
+        save_dir = osp.join(work_dir, f'split_nproc{nproc}')
+        shutil.rmtree(save_dir, ignore_errors=True)
+        start = time.perf_counter()
+        subprocess.run([
+            sys.executable, sodaa_split.__file__, '--base-json', config,
+            '--img-dirs', img_dir, '--ann-dirs', ann_dir, '--save-dir',
+            save_dir, '--nproc', str(nproc)
+        ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        with open(osp.join(save_dir, 'split_stats.json'), 'r') as f:
+            stats = json.load(f)
+        results[str(nproc)] = dict(wall=elapsed, stats=stats)
+        shutil.rmtree(save_dir)
+    return results
+
+
+def get_environment():
+    """Describe the code version and environment of a benchmark run."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=osp.dirname(osp.abspath(__file__)),
+            capture_output=True,
+            text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return dict(
+        commit=commit,
+        python=platform.python_version(),
+        numpy=np.__version__,
+        cv2=cv2.__version__,
+        cpus=os.cpu_count())
+
+
+def main():
+    """Main function of the benchmark."""
+    args = parse_args()
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='sodaa_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    data_dir = osp.join(work_dir, 'data')
+    img_dir, ann_dir = make_synthetic_sodaa(
+        data_dir, args.num_images, args.img_size, args.density,
+        args.ign_regions, args.poly_shape, args.seed)
+    infos = load_sodaa(img_dir, ann_dir, nproc=1)
+
+    results = dict(
+        environment=get_environment(),
+        params=dict(vars(args), work_dir=work_dir),
+        functions=bench_functions(infos, img_dir, work_dir, args.sizes,
+                                  args.gaps, args.repeat),
+        main=bench_main(img_dir, ann_dir, work_dir, args.sizes, args.gaps,
+                        args.nproc))
+
+    text = json.dumps(results, indent=4)
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    print(text)
+    if args.work_dir is None:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+# Crop SODA-A patches on the fly instead of writing them to disk
+
+
+import os.path as osp
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from sodaa_split import (WindowedImageReader, fill_ign, fill_ign_window,
+                         get_sliding_window, get_window_obj, pad_patch,
+                         translate)
+
+
+class SodaaPatchDataset:
+    """Map-style dataset of SODA-A patches cropped on demand.
+
+    Windows of every scene are computed up front from the image sizes
+    only, which is cheap. Objects of the windows and the decoded,
+    ignore-masked scene are computed when a scene is first needed and kept
+    in an LRU cache, so neighbouring windows of a scene decode it once.
+    Iterating in index order visits the windows scene by scene.
+
+    It only depends on numpy and cv2, so it can be wrapped by the dataset
+    class of any training framework.
+
+    Args:
+        infos (list[dict]): Dataset's contents from ``load_sodaa``.
+        img_dirs (str | list[str]): Dir of the images, or one dir per info.
+        sizes (list[int]): List of window's sizes.
+        gaps (list[int]): List of window's gaps.
+        img_rate_thr (float): Threshold of window area divided by image
+            area. Defaults to 0.6.
+        iof_thr (float): Threshold of overlaps between bbox and window.
+            Defaults to 0.7.
+        no_padding (bool): If True, patches on the border are not padded.
+            Defaults to False.
+        padding_value (tuple[int|float]): Padding value. Defaults to 0.
+        cache_size (int): Number of scenes kept decoded. Defaults to 4.
+        windowed_read (bool): If True, read every window on its own, only
+            the opened readers are cached. Defaults to False.
+    """
+
+    def __init__(self, infos, img_dirs, sizes, gaps, img_rate_thr=0.6,
+                 iof_thr=0.7, no_padding=False, padding_value=0,
+                 cache_size=4, windowed_read=False):
+        if isinstance(img_dirs, str):
+            img_dirs = [img_dirs] * len(infos)
+        assert len(img_dirs) == len(infos)
+        self.infos = infos
+        self.img_dirs = img_dirs
+        self.iof_thr = iof_thr
+        self.no_padding = no_padding
+        self.padding_value = padding_value
+        self.cache_size = max(cache_size, 1)
+        self.windowed_read = windowed_read
+
+        self.windows = [
+            get_sliding_window(info, sizes, gaps, img_rate_thr)
+            for info in infos
+        ]
+        nums = [w.shape[0] for w in self.windows]
+        self._img_inds = np.repeat(np.arange(len(infos)), nums)
+        self._win_inds = np.concatenate(
+            [np.arange(n) for n in nums] + [np.zeros((0, ), np.int64)])
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return self._img_inds.shape[0]
+
+    def __getitem__(self, idx):
+        """Crop a patch.
+
+        Args:
+            idx (int): Index of the patch.
+
+        Returns:
+            tuple[np.array, dict]: BGR patch with shape (H, W, 3), and its
+                ``polys`` in patch coordinate, ``cat_ids`` and ``trunc``.
+        """
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f'patch index {idx} out of range')
+        img_ind, win_ind = int(self._img_inds[idx]), int(self._win_inds[idx])
+        source, window_anns = self._get_scene(img_ind)
+
+        x_start, y_start, x_stop, y_stop = \
+            self.windows[img_ind][win_ind].tolist()
+        if self.windowed_read:
+            patch = source.read(x_start, y_start, x_stop, y_stop)
+            patch = fill_ign_window(patch, self.infos[img_ind]['ann'],
+                                    x_start, y_start)
+        else:
+            patch = source[y_start:y_stop, x_start:x_stop].copy()
+        if not self.no_padding:
+            patch = pad_patch(patch, y_stop - y_start, x_stop - x_start,
+                              self.padding_value)
+
+        ann = window_anns[win_ind]
+        labels = dict(
+            polys=translate(ann['polys'], -x_start, -y_start),
+            cat_ids=ann['cat_ids'],
+            trunc=ann['trunc'])
+        return patch, labels
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def patch_info(self, idx):
+        """Get the source scene and window of a patch.
+
+        Args:
+            idx (int): Index of the patch.
+
+        Returns:
+            dict: ``ori_id``, ``filename`` of the scene and the window's
+                ``x_start``, ``y_start``, ``x_stop`` and ``y_stop``.
+        """
+        info = self.infos[self._img_inds[idx]]
+        window = self.windows[self._img_inds[idx]][self._win_inds[idx]]
+        return dict(
+            ori_id=info['id'],
+            filename=info['filename'],
+            **dict(zip(['x_start', 'y_start', 'x_stop', 'y_stop'],
+                       window.tolist())))
+
+    def _get_scene(self, img_ind):
+        """Get the image source and window objects of a scene via the LRU."""
+        if img_ind in self._cache:
+            self._cache.move_to_end(img_ind)
+            return self._cache[img_ind]
+
+        info = self.infos[img_ind]
+        window_anns = get_window_obj(info, self.windows[img_ind],
+                                     self.iof_thr)
+        img_path = osp.join(self.img_dirs[img_ind], info['filename'])
+        if self.windowed_read:
+            source = WindowedImageReader(img_path)
+        else:
+            # fill_ign replaces the annotations of the info it is given
+            source, _ = fill_ign(cv2.imread(img_path), dict(info))
+
+        self._cache[img_ind] = (source, window_anns)
+        while len(self._cache) > self.cache_size:
+            _, (old_source, _) = self._cache.popitem(last=False)
+            if self.windowed_read:
+                old_source.close()
+        return self._cache[img_ind]
+
+    def __getstate__(self):
+        # decoded scenes and open readers stay with their process
+        state = self.__dict__.copy()
+        state['_cache'] = OrderedDict()
+        return state
@@ -8,23 +8,32 @@
 
 
 import argparse
-import codecs
 import datetime
+import hashlib
+import io
 import itertools
 import json
 import logging
 import os
 import os.path as osp
+import queue
+import tarfile
+import threading
 import time
-from functools import partial, reduce
+import uuid
+import warnings
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from math import ceil
-from multiprocessing import Manager, Pool
+from multiprocessing import Pool, resource_tracker, util
+from multiprocessing.shared_memory import SharedMemory
 
 import cv2
 import numpy as np
 from PIL import Image
 import cv2
-import copy
 
 Image.MAX_IMAGE_PIXELS = None
 
@@ -33,10 +42,22 @@ try:
 except ImportError:
     shgeo = None
 
+try:
+    import rasterio
+    from rasterio.windows import Window
+except ImportError:
+    rasterio = None
+
 CLASSES = ['airplane', 'helicopter', 'small-vehicle', 'large-vehicle',
            'ship', 'container', 'storage-tank', 'swimming-pool',
            'windmill', 'ignore']
 
+LABEL_FORMATS = ('yolo-obb', 'yolo-hbb', 'dota')
+
+# tiled or strip formats whose windows are decoded without the rows above
+WINDOWED_FORMATS = ('.tif', '.tiff')
+
+
 def add_parser(parser):
     """Add arguments."""
     parser.add_argument(
@@ -54,6 +75,12 @@ def add_parser(parser):
         type=str,
         default=None,
         help='images dirs, must give a value')
+    parser.add_argument(
+        '--index-dir',
+        type=str,
+        default=None,
+        help='dir of cached dataset indexes, one per img/ann dir pair, '
+        'speeds up loading on later runs')
     parser.add_argument(
         '--ann-dirs',
         nargs='+',
@@ -112,6 +139,86 @@ def add_parser(parser):
         type=str,
         default='.png',
         help='the extension of saving images')
+    parser.add_argument(
+        '--label-format',
+        type=str,
+        default='yolo-obb',
+        choices=LABEL_FORMATS,
+        help='format of the label files')
+    parser.add_argument(
+        '--output-format',
+        type=str,
+        default='files',
+        choices=['files', 'tar'],
+        help='save every patch and label as its own file, or append them '
+        'to tar shards with an index')
+    parser.add_argument(
+        '--shard-size',
+        type=int,
+        default=1024,
+        help='size in MB after which a new tar shard is started')
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='reuse an existing save dir, only split new or changed images '
+        'and remove patches of stale ones')
+    parser.add_argument(
+        '--windowed-read',
+        action='store_true',
+        help='decode the scene in one pass over bands of rows instead of '
+        'as a whole, peak memory scales with the window height, needs '
+        'rasterio; jpeg pixels differ from the default cv2 decoding')
+    parser.add_argument(
+        '--jpeg-quality',
+        type=int,
+        default=None,
+        help='jpeg quality of saved patches (0-100), cv2 default if unset')
+    parser.add_argument(
+        '--png-compression',
+        type=int,
+        default=None,
+        help='png compression level of saved patches (0-9), cv2 default '
+        'if unset')
+    parser.add_argument(
+        '--writer-threads',
+        type=int,
+        default=4,
+        help='threads encoding and writing patches in every process, 0 '
+        'writes in the splitting thread')
+    parser.add_argument(
+        '--writer-queue',
+        type=int,
+        default=16,
+        help='maximum number of patches waiting to be written per process')
+    parser.add_argument(
+        '--window-batch',
+        type=int,
+        default=0,
+        help='split images in tasks of this many windows that share the '
+        'decoded scene, 0 splits every image in one task')
+    parser.add_argument(
+        '--scene-lookahead',
+        type=int,
+        default=None,
+        help='maximum number of images split at once with --window-batch, '
+        'the process number by default')
+
+    # argument for selecting windows
+    parser.add_argument(
+        '--empty-rate',
+        type=float,
+        default=1.,
+        help='fraction of windows without objects to keep')
+    parser.add_argument(
+        '--drop-ignored',
+        action='store_true',
+        help='drop windows without objects lying entirely inside ignore '
+        'regions')
+    parser.add_argument(
+        '--select-seed',
+        type=int,
+        default=0,
+        help='seed of choosing the kept windows without objects')
 
 
 def parse_args():
@@ -136,11 +243,23 @@ def parse_args():
     assert args.ann_dirs is None or len(args.ann_dirs) == len(args.img_dirs)
     assert len(args.sizes) == len(args.gaps)
     assert len(args.sizes) == 1 or len(args.rates) == 1
-    assert args.save_ext in ['.jpg']
+    assert args.save_ext in ['.jpg', '.png']
+    assert args.jpeg_quality is None or 0 <= args.jpeg_quality <= 100
+    assert args.png_compression is None or 0 <= args.png_compression <= 9
+    assert args.writer_threads >= 0 and args.writer_queue > 0
+    assert args.window_batch >= 0
+    assert args.scene_lookahead is None or args.scene_lookahead > 0
+    assert args.output_format == 'files' or not args.incremental, \
+        'incremental splitting needs --output-format files'
+    assert args.shard_size > 0
+    assert 0 <= args.empty_rate <= 1
     assert args.iof_thr >= 0 and args.iof_thr < 1
     assert args.iof_thr >= 0 and args.iof_thr <= 1
-    assert not osp.exists(args.save_dir), \
+    assert args.incremental or not osp.exists(args.save_dir), \
         f'{osp.join(args.save_dir)} already exists'
+    if args.windowed_read and rasterio is None:
+        warnings.warn('rasterio is not installed, --windowed-read falls '
+                      'back to decoding whole scenes')
     return args
 
 
@@ -209,11 +328,98 @@ def poly2hbb(polys):
     return np.concatenate([lt_point, rb_point], axis=-1)
 
 
+def poly_areas(polys):
+    """Compute areas of polygons with the shoelace formula.
+
+    Args:
+        polys (np.array): Polygons with shape (N, 2K).
+
+    Returns:
+        np.array: Areas with shape (N, ).
+    """
+    polys = np.asarray(polys, dtype=np.float64)
+    # the point number is given explicitly so that empty input also works
+    polys = polys.reshape(polys.shape[0], polys.shape[-1] // 2, 2)
+    x, y = polys[..., 0], polys[..., 1]
+    cross = x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y
+    return np.abs(cross.sum(axis=1)) / 2
+
+
+def poly_rect_overlaps(polys, rects, chunk=65536):
+    """Compute intersection areas between polygons and rectangles pairwise.
+
+    Polygons lying inside their rectangle keep their own area, the others
+    are clipped by the four sides of the rectangle (Sutherland-Hodgman),
+    vectorized over all pairs at once.
+
+    Args:
+        polys (np.array): Polygons with shape (M, 2K).
+        rects (np.array): Horizontal rectangles (l, t, r, b) with shape
+            (M, 4).
+        chunk (int, optional): Number of pairs clipped at a time, which
+            bounds the temporary memory. Defaults to 65536.
+
+    Returns:
+        np.array: Intersection areas with shape (M, ).
+    """
+    num = polys.shape[0]
+    hpolys = poly2hbb(polys)
+    inside = (hpolys[:, :2] >= rects[:, :2]).all(axis=1) & \
+        (hpolys[:, 2:] <= rects[:, 2:]).all(axis=1)
+    overlaps = np.empty(num)
+    if inside.any():
+        overlaps[inside] = poly_areas(polys[inside])
+    outside = np.nonzero(~inside)[0]
+    for i in range(0, outside.shape[0], chunk):
+        inds = outside[i:i + chunk]
+        overlaps[inds] = _clip_poly_areas(polys[inds], rects[inds])
+    return overlaps
+
+
+def _clip_poly_areas(polys, rects):
+    """Clip polygons by rectangles pairwise and return the clipped areas."""
+    num = polys.shape[0]
+    pts = np.asarray(polys, dtype=np.float64).reshape(num, -1, 2)
+    rects = np.asarray(rects, dtype=np.float64)
+    cnts = np.full(num, pts.shape[1])
+    for axis, side in ((0, 0), (1, 1), (0, 2), (1, 3)):
+        bound = rects[:, side, None]
+        sign = 1 if side < 2 else -1
+        idx = np.arange(pts.shape[1])
+        valid = idx < cnts[:, None]
+        prev = np.where(idx == 0, cnts[:, None] - 1, idx - 1).clip(0)
+        prev_pts = np.take_along_axis(pts, prev[..., None], axis=1)
+        cur_in = sign * (pts[..., axis] - bound) >= 0
+        prev_in = sign * (prev_pts[..., axis] - bound) >= 0
+
+        # the edge prev -> cur crosses the clipping line
+        cross = valid & (cur_in != prev_in)
+        delta = pts[..., axis] - prev_pts[..., axis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(cross, (bound - prev_pts[..., axis]) / delta, 0)
+        inter = prev_pts + t[..., None] * (pts - prev_pts)
+
+        # every vertex emits [intersection, vertex], then compact
+        out = np.stack([inter, pts], axis=2).reshape(num, -1, 2)
+        keep = np.stack([cross, valid & cur_in], axis=2).reshape(num, -1)
+        cnts = keep.sum(axis=1)
+        order = np.argsort(~keep, axis=1, kind='stable')
+        order = order[:, :max(int(cnts.max()), 1)]
+        pts = np.take_along_axis(out, order[..., None], axis=1)
+
+    idx = np.arange(pts.shape[1])
+    valid = idx < cnts[:, None]
+    nxt = np.where(idx + 1 < cnts[:, None], idx + 1, 0)
+    nxt_pts = np.take_along_axis(pts, nxt[..., None], axis=1)
+    cross = pts[..., 0] * nxt_pts[..., 1] - nxt_pts[..., 0] * pts[..., 1]
+    return np.abs(np.where(valid, cross, 0).sum(axis=1)) / 2
+
+
 def bbox_overlaps_iof(polys1, polys2, eps=1e-6):
     """Compute bbox overlaps (iof).
 
     Args:
-        polys1 (np.array): Horizontal polys1.
+        polys1 (np.array): Polygons with shape (N, 8).
         polys2 (np.array): Horizontal polys2.
         eps (float, optional): Defaults to 1e-6.
 
@@ -223,15 +429,43 @@ def bbox_overlaps_iof(polys1, polys2, eps=1e-6):
     rows = polys1.shape[0]
     cols = polys2.shape[0]
 
+    if rows * cols == 0:
+        return np.zeros((rows, cols), dtype=np.float32)
+
+    # the following lines were used to avoid single ann with a shape like (N, )
+    polys1 = polys1.reshape(-1, 8)
+    hpolys1 = poly2hbb(polys1)[:, None, :]
+    hpolys2 = polys2
+    lt = np.maximum(hpolys1[..., :2], hpolys2[..., :2])
+    rb = np.minimum(hpolys1[..., 2:], hpolys2[..., 2:])
+    wh = np.clip(rb - lt, 0, np.inf)
+    h_overlaps = wh[..., 0] * wh[..., 1]
+
+    inds1, inds2 = np.nonzero(h_overlaps)
+    overlaps = np.zeros(h_overlaps.shape)
+    overlaps[inds1, inds2] = poly_rect_overlaps(polys1[inds1],
+                                                polys2[inds2])
+    unions = poly_areas(polys1).astype(np.float32)[..., None]
+
+    unions = np.clip(unions, eps, np.inf)
+    return overlaps / unions
+
+
+def _bbox_overlaps_iof_shapely(polys1, polys2, eps=1e-6):
+    """Reference shapely implementation of :func:`bbox_overlaps_iof`.
+
+    Intersects one pair of polygons at a time, kept to check the vectorized
+    version against.
+    """
+    rows = polys1.shape[0]
+    cols = polys2.shape[0]
+
     if rows * cols == 0:
         return np.zeros((rows, cols), dtype=np.float32)
 
     hpolys1 = poly2hbb(polys1).reshape(-1, 4)
     hpolys2 = polys2
-    try:
-        hpolys1 = hpolys1[:, None, :]
-    except IndexError:
-        print()
+    hpolys1 = hpolys1[:, None, :]
     lt = np.maximum(hpolys1[..., :2], hpolys2[..., :2])
     rb = np.minimum(hpolys1[..., 2:], hpolys2[..., 2:])
     wh = np.clip(rb - lt, 0, np.inf)
@@ -242,7 +476,6 @@ def bbox_overlaps_iof(polys1, polys2, eps=1e-6):
     if shgeo is None:
         raise ImportError('Please run "pip install shapely" '
                           'to install shapely first.')
-    # the following lines were used to avoid single ann with a shape like (N, )
     polys1 = polys1.reshape(-1, 8)
     rows = polys1.shape[0]
     sg_polys1 = [shgeo.Polygon(p) for p in polys1.reshape(rows, -1, 2)]
@@ -254,10 +487,106 @@ def bbox_overlaps_iof(polys1, polys2, eps=1e-6):
     unions = unions[..., None]
 
     unions = np.clip(unions, eps, np.inf)
-    outputs = overlaps / unions
-    if outputs.ndim == 1:
-        outputs = outputs[..., None]
-    return outputs
+    return overlaps / unions
+
+
+def _grid_cells(boxes, origin, cell, grid_shape):
+    """Expand boxes into the grid cells they cover.
+
+    Args:
+        boxes (np.array): Horizontal boxes with shape (N, 4).
+        origin (np.array): Top-left corner of the grid.
+        cell (float): Side of a grid cell.
+        grid_shape (tuple[int]): Number of cells along x and y.
+
+    Returns:
+        tuple[np.array]: Box indices and flat cell ids, one per covered cell.
+    """
+    gx, gy = grid_shape
+    lt = np.floor((boxes[:, :2] - origin) / cell).astype(np.int64)
+    rb = np.floor((boxes[:, 2:] - origin) / cell).astype(np.int64)
+    lt = np.maximum(lt, 0)
+    rb = np.minimum(rb, [gx - 1, gy - 1])
+    nums = np.clip(rb - lt + 1, 0, None)
+    totals = nums[:, 0] * nums[:, 1]
+
+    box_inds = np.repeat(np.arange(boxes.shape[0]), totals)
+    offsets = np.arange(totals.sum()) - np.repeat(
+        np.cumsum(totals) - totals, totals)
+    nx = nums[box_inds, 0]
+    cx = lt[box_inds, 0] + offsets % nx
+    cy = lt[box_inds, 1] + offsets // nx
+    return box_inds, cy * gx + cx
+
+
+def get_window_candidates(hboxes, windows):
+    """Find (object, window) pairs whose horizontal boxes overlap.
+
+    Windows are bucketed into a uniform grid whose cell is the smallest
+    window side, so every object is only compared with the windows sharing
+    its cells instead of with all windows.
+
+    Args:
+        hboxes (np.array): Horizontal boxes of objects with shape (N, 4).
+        windows (np.array): information of sliding windows.
+
+    Returns:
+        tuple[np.array]: Object and window indices of the candidate pairs,
+            sorted by window and then by object.
+    """
+    empty = np.zeros((0, ), dtype=np.int64)
+    if hboxes.shape[0] == 0 or windows.shape[0] == 0:
+        return empty, empty
+
+    origin = windows[:, :2].min(axis=0)
+    cell = max(float((windows[:, 2:] - windows[:, :2]).min()), 1.)
+    grid_shape = tuple(
+        (np.floor((windows[:, 2:].max(axis=0) - origin) / cell) + 1)
+        .astype(np.int64).tolist())
+
+    win_inds, win_cells = _grid_cells(windows, origin, cell, grid_shape)
+    order = np.argsort(win_cells, kind='stable')
+    win_inds, win_cells = win_inds[order], win_cells[order]
+    obj_inds, obj_cells = _grid_cells(hboxes, origin, cell, grid_shape)
+
+    lo = np.searchsorted(win_cells, obj_cells, side='left')
+    nums = np.searchsorted(win_cells, obj_cells, side='right') - lo
+    pair_objs = np.repeat(obj_inds, nums)
+    pair_cells = np.repeat(obj_cells, nums)
+    pair_pos = np.repeat(lo - np.cumsum(nums) + nums, nums) + \
+        np.arange(nums.sum())
+    pair_wins = win_inds[pair_pos]
+
+    lt = np.maximum(hboxes[pair_objs, :2], windows[pair_wins, :2])
+    rb = np.minimum(hboxes[pair_objs, 2:], windows[pair_wins, 2:])
+    # a pair sharing several cells is only kept in the cell holding the
+    # top-left corner of its intersection
+    corner = np.floor((lt - origin) / cell).astype(np.int64)
+    keep = ((rb - lt) > 0).all(axis=1) & \
+        (corner[:, 1] * grid_shape[0] + corner[:, 0] == pair_cells)
+    pair_objs, pair_wins = pair_objs[keep], pair_wins[keep]
+
+    order = np.argsort(pair_wins * hboxes.shape[0] + pair_objs)
+    return pair_objs[order], pair_wins[order]
+
+
+def bbox_overlaps_iof_sparse(polys, windows, eps=1e-6):
+    """Compute iof only for the (object, window) pairs that overlap.
+
+    Args:
+        polys (np.array): Polygons with shape (N, 8).
+        windows (np.array): information of sliding windows.
+        eps (float, optional): Defaults to 1e-6.
+
+    Returns:
+        tuple[np.array]: Object indices, window indices and iofs of the
+            overlapping pairs, sorted by window and then by object.
+    """
+    polys = polys.reshape(-1, 8)
+    obj_inds, win_inds = get_window_candidates(poly2hbb(polys), windows)
+    overlaps = poly_rect_overlaps(polys[obj_inds], windows[win_inds])
+    areas = np.clip(poly_areas(polys).astype(np.float32), eps, np.inf)
+    return obj_inds, win_inds, overlaps / areas[obj_inds]
 
 
 def get_window_obj(info, windows, iof_thr):
@@ -272,12 +601,21 @@ def get_window_obj(info, windows, iof_thr):
         list[dict]: List of bbox annotations of every window.
     """
     polys = info['ann']['polys']
-    iofs = bbox_overlaps_iof(polys, windows)
+    if iof_thr > 0:
+        obj_inds, win_inds, iofs = bbox_overlaps_iof_sparse(polys, windows)
+        keep = iofs >= iof_thr
+        obj_inds, win_inds, iofs = obj_inds[keep], win_inds[keep], iofs[keep]
+    else:
+        # a zero threshold keeps objects outside the window as well
+        iofs = bbox_overlaps_iof(polys, windows).T
+        win_inds, obj_inds = np.nonzero(iofs >= iof_thr)
+        iofs = iofs[win_inds, obj_inds]
+    bounds = np.searchsorted(win_inds, np.arange(windows.shape[0] + 1))
 
     window_anns = []
     for i in range(windows.shape[0]):
-        win_iofs = iofs[:, i]
-        pos_inds = np.nonzero(win_iofs >= iof_thr)[0].tolist()
+        win_iofs = iofs[bounds[i]:bounds[i + 1]]
+        pos_inds = obj_inds[bounds[i]:bounds[i + 1]].tolist()
 
         win_ann = dict()
         for k, v in info['ann'].items():
@@ -287,13 +625,446 @@ def get_window_obj(info, windows, iof_thr):
                 win_ann[k] = v[pos_inds]
             except TypeError:
                 win_ann[k] = [v[i] for i in pos_inds]
-        win_ann['trunc'] = win_iofs[pos_inds] < 1
+        win_ann['trunc'] = win_iofs < 1
         window_anns.append(win_ann)
     return window_anns
 
 
+def select_windows(info, windows, window_anns, empty_rate=1.,
+                   drop_ignored=False, seed=0):
+    """Drop fully ignored windows and subsample windows without objects.
+
+    The kept empty windows only depend on ``seed`` and the image id, so
+    reruns and runs with another process number keep the same windows.
+
+    Args:
+        info (dict): Dict of bbox annotations.
+        windows (np.array): information of sliding windows.
+        window_anns (list[dict]): Objects of every window.
+        empty_rate (float): Fraction of windows without objects to keep.
+            Defaults to 1.
+        drop_ignored (bool): If True, drop windows without objects whose
+            pixels are all masked by ignore regions. Defaults to False.
+        seed (int): Seed of choosing the kept empty windows. Defaults to 0.
+
+    Returns:
+        tuple[np.array, list[dict], dict]: Kept windows, their objects and
+            the counts of all ``windows``, ``empty_dropped`` and
+            ``ignored_dropped`` ones.
+    """
+    keep = np.ones(windows.shape[0], dtype=bool)
+    empty = np.array([len(ann['polys']) == 0 for ann in window_anns],
+                     dtype=bool)
+    if drop_ignored:
+        for i in np.nonzero(empty)[0]:
+            keep[i] = not is_window_ignored(info, windows[i])
+    num_ignored = int((~keep).sum())
+
+    empty_inds = np.nonzero(empty & keep)[0]
+    num_drop = len(empty_inds) - int(round(len(empty_inds) * empty_rate))
+    if num_drop > 0:
+        rng = np.random.default_rng(
+            [seed, zlib.crc32(info['id'].encode('utf-8'))])
+        keep[rng.permutation(empty_inds)[:num_drop]] = False
+
+    counts = dict(windows=len(keep), empty_dropped=max(num_drop, 0),
+                  ignored_dropped=num_ignored)
+    return windows[keep], [a for a, k in zip(window_anns, keep) if k], counts
+
+
+def is_window_ignored(info, window):
+    """Check if every image pixel of a window is masked by ignore regions.
+
+    Args:
+        info (dict): Dict of bbox annotations with ``ign_polys``.
+        window (np.array): The window's x_start, y_start, x_stop, y_stop.
+
+    Returns:
+        bool: True if :func:`fill_ign` zeroes the whole window.
+    """
+    ign_polys = info['ann'].get('ign_polys', [])
+    if not len(ign_polys):
+        return False
+    x_start, y_start = window[:2]
+    x_stop = min(window[2], info['width'])
+    y_stop = min(window[3], info['height'])
+    # masking zeroes the ignored pixels, so start from ones
+    mask = np.ones((y_stop - y_start, x_stop - x_start), dtype=np.uint8)
+    mask_ign_regions(mask[..., None], ign_polys, info['ann']['polys'],
+                     x_start, y_start)
+    return not mask.any()
+
+
+class WindowedImageReader:
+    """Read rectangular regions of an image without decoding the whole scene.
+
+    With rasterio installed, regions are read through GDAL. Tiled and strip
+    formats only decode the tiles or strips covering a window, but jpeg
+    scenes can only be decoded from the top, so reading windows in any
+    order makes GDAL either hold the decoded scene in its block cache or
+    decode it again for every window. With ``sequential=True`` full-width
+    bands of rows are read in one top-to-bottom pass instead: the rows of
+    the previous windows are kept, only the missing rows are decoded and
+    GDAL's block cache is limited to ``cache_max`` MB, so the peak memory
+    is about ``window height * image width * 3`` bytes whatever the format.
+    Windows must then be read in non-decreasing ``y_start``, going back
+    restarts the pass.
+
+    GDAL's jpeg decoder does not give the same pixels as cv2's, they may
+    differ by tens of levels per channel on noisy scenes, so patches of
+    jpeg scenes are not identical to those cropped from ``cv2.imread``.
+    Lossless formats give identical pixels. Without
+    rasterio the scene is decoded once with cv2, which gives the same peak
+    memory as reading the whole image.
+
+    Args:
+        filename (str): Path of the image.
+        sequential (bool): If True, read bands of rows in one pass, see
+            above. Defaults to False.
+        cache_max (int): GDAL block cache in MB while reading sequentially.
+            Defaults to 16.
+    """
+
+    def __init__(self, filename, sequential=False, cache_max=16):
+        self.filename = filename
+        self.sequential = sequential
+        self._src = None
+        self._img = None
+        self._env = None
+        self._band = None
+        self._band_start = 0
+        if rasterio is not None:
+            if sequential:
+                # every row is decoded once, so cached blocks are never reused
+                self._env = rasterio.Env(GDAL_CACHEMAX=cache_max)
+                self._env.__enter__()
+            with warnings.catch_warnings():
+                # plain jpg/png scenes carry no georeference
+                warnings.simplefilter('ignore')
+                self._src = rasterio.open(filename)
+            self.width, self.height = self._src.width, self._src.height
+        else:
+            self._img = cv2.imread(filename)
+            self.height, self.width = self._img.shape[:2]
+
+    def read(self, x_start, y_start, x_stop, y_stop):
+        """Read a window clipped to the image bounds.
+
+        Args:
+            x_start (int): Left of the window.
+            y_start (int): Top of the window.
+            x_stop (int): Right of the window.
+            y_stop (int): Bottom of the window.
+
+        Returns:
+            np.array: BGR patch with shape (H, W, 3), same layout as
+                ``cv2.imread``.
+        """
+        x_stop, y_stop = min(x_stop, self.width), min(y_stop, self.height)
+        if self._src is None:
+            return self._img[y_start:y_stop, x_start:x_stop].copy()
+        if not self.sequential:
+            return self._read(x_start, y_start, x_stop, y_stop)
+
+        if self._band is None or y_start < self._band_start:
+            self._band = self._read(0, y_start, self.width, y_stop)
+        else:
+            band_stop = self._band_start + self._band.shape[0]
+            band = self._band[y_start - self._band_start:]
+            if y_stop > max(band_stop, y_start):
+                band = np.concatenate([
+                    band,
+                    self._read(0, max(band_stop, y_start), self.width,
+                               y_stop)
+                ])
+            self._band = band
+        self._band_start = y_start
+        return self._band[:y_stop - y_start, x_start:x_stop].copy()
+
+    def _read(self, x_start, y_start, x_stop, y_stop):
+        """Read a window through GDAL as a BGR array."""
+        count = self._src.count
+        indexes = [1, 1, 1] if count < 3 else [3, 2, 1]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            patch = self._src.read(
+                indexes,
+                window=Window(x_start, y_start, x_stop - x_start,
+                              y_stop - y_start))
+        return np.ascontiguousarray(patch.transpose(1, 2, 0))
+
+    def close(self):
+        """Release the underlying dataset."""
+        if self._src is not None:
+            self._src.close()
+        if self._env is not None:
+            self._env.__exit__()
+        self._src = self._img = self._env = self._band = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SplitStats:
+    """Per-stage timings and counters of the split pipeline.
+
+    Every worker fills its own instance and returns it with its results,
+    and the parent merges them, so no lock is shared between processes.
+    ``encode`` and ``write`` times are summed over writer threads, ``wait``
+    is the time spent blocked on a full writer queue.
+    """
+
+    STAGES = ('load', 'window', 'iof', 'mask', 'crop', 'encode', 'write',
+              'wait')
+    COUNTS = ('images', 'objects', 'windows', 'empty_dropped',
+              'ignored_dropped', 'patches', 'bytes')
+
+    def __init__(self):
+        self.times = dict.fromkeys(self.STAGES, 0.)
+        self.counts = dict.fromkeys(self.COUNTS, 0)
+        self._lock = threading.Lock()
+
+    def add(self, stage=None, seconds=0., **counts):
+        """Add time to a stage and/or increase counters."""
+        with self._lock:
+            if stage is not None:
+                self.times[stage] += seconds
+            for k, v in counts.items():
+                self.counts[k] += v
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the enclosed block as ``stage``."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def merge(self, other):
+        """Add the timings and counters of another instance."""
+        for k, v in other.times.items():
+            self.add(k, v)
+        self.add(**other.counts)
+
+    def summary(self, elapsed):
+        """Summarize throughput over a wall time.
+
+        Args:
+            elapsed (float): Wall time in seconds.
+
+        Returns:
+            dict: Counters, stage seconds and images/s, patches/s, MB/s.
+        """
+        elapsed = max(elapsed, 1e-6)
+        return dict(
+            elapsed=elapsed,
+            counts=dict(self.counts),
+            stage_seconds=dict(self.times),
+            images_per_s=self.counts['images'] / elapsed,
+            patches_per_s=self.counts['patches'] / elapsed,
+            mb_per_s=self.counts['bytes'] / 2**20 / elapsed)
+
+    def __getstate__(self):
+        return dict(times=self.times, counts=self.counts)
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.times.update(state['times'])
+        self.counts.update(state['counts'])
+
+
+class ShardWriter:
+    """Append samples to fixed-size tar shards with a random access index.
+
+    A sample's members are stored next to each other, WebDataset style,
+    and a new shard is started once the current one reaches
+    ``shard_size`` bytes. Every shard ``<name>.tar`` gets an index
+    ``<name>.idx`` with one JSON line per sample, mapping member names to
+    the ``[offset, size]`` of their data in the tar. Shard names include
+    a random token, so every process writes its own shards without
+    locking. Threads of one process share the instance.
+
+    Args:
+        shard_dir (str): Dir of the shards.
+        shard_size (int): Bytes after which a new shard is started.
+    """
+
+    def __init__(self, shard_dir, shard_size=1 << 30):
+        self.shard_dir = shard_dir
+        self.shard_size = shard_size
+        self.prefix = f'shard-{uuid.uuid4().hex[:12]}'
+        self._num_shards = 0
+        self._tar = self._index = None
+        self._lock = threading.Lock()
+
+    def write(self, key, members):
+        """Append a sample.
+
+        Args:
+            key (str): Key of the sample.
+            members (list[tuple[str, bytes]]): Names and data of the
+                sample's members.
+        """
+        with self._lock:
+            if self._tar is None:
+                self._open_shard()
+            locations = dict()
+            for name, data in members:
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.size = len(data)
+                tarinfo.mtime = int(time.time())
+                self._tar.addfile(tarinfo, io.BytesIO(data))
+                padded = -(-len(data) // tarfile.BLOCKSIZE) * \
+                    tarfile.BLOCKSIZE
+                locations[name] = [self._tar.offset - padded, len(data)]
+            self._index.write(
+                json.dumps(dict(key=key, members=locations)) + '\n')
+            if self._tar.offset >= self.shard_size:
+                self._close_shard()
+
+    def close(self):
+        """Finish the current shard."""
+        with self._lock:
+            self._close_shard()
+
+    def _open_shard(self):
+        name = f'{self.prefix}-{self._num_shards:05d}'
+        self._num_shards += 1
+        self._tar = tarfile.open(osp.join(self.shard_dir, name + '.tar'), 'w')
+        self._index = open(osp.join(self.shard_dir, name + '.idx'), 'w')
+
+    def _close_shard(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._index.close()
+        self._tar = self._index = None
+
+
+_shard_writer = None
+
+
+def get_shard_writer(shard_dir, shard_size):
+    """Get the shard writer of the current process.
+
+    The writer lives as long as the process, so small scenes share shards,
+    and it is closed when the process exits.
+
+    Args:
+        shard_dir (str): Dir of the shards.
+        shard_size (int): Bytes after which a new shard is started.
+
+    Returns:
+        ShardWriter: Writer of this process.
+    """
+    global _shard_writer
+    if _shard_writer is None:
+        _shard_writer = ShardWriter(shard_dir, shard_size)
+        util.Finalize(_shard_writer, _shard_writer.close, exitpriority=10)
+    return _shard_writer
+
+
+def close_shard_writer():
+    """Close the shard writer of the current process, if any."""
+    global _shard_writer
+    if _shard_writer is not None:
+        _shard_writer.close()
+        _shard_writer = None
+
+
+class PatchWriter:
+    """Encode and write patches and their label files on a thread pool.
+
+    cv2 releases the GIL while encoding, so the caller keeps cropping while
+    earlier patches are encoded and written. At most ``max_pending``
+    patches wait to be written, ``write`` blocks beyond that so memory
+    stays bounded.
+
+    Args:
+        num_threads (int): Number of writer threads, 0 writes in the
+            calling thread. Defaults to 4.
+        max_pending (int): Maximum number of queued patches. Defaults to 16.
+        encode_params (list[int], optional): Flags passed to
+            ``cv2.imencode``, e.g. ``[cv2.IMWRITE_JPEG_QUALITY, 95]``.
+        stats (SplitStats, optional): Receives encode and write times,
+            written bytes and the time blocked on a full queue.
+        shard_writer (ShardWriter, optional): Append patches and labels to
+            tar shards instead of writing one file each.
+    """
+
+    def __init__(self, num_threads=4, max_pending=16, encode_params=None,
+                 stats=None, shard_writer=None):
+        self.encode_params = encode_params or []
+        self.stats = stats if stats is not None else SplitStats()
+        self.shard_writer = shard_writer
+        self._executor = ThreadPoolExecutor(num_threads) \
+            if num_threads > 0 else None
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._error = None
+
+    def write(self, img_path, patch, label_path, label_text):
+        """Queue a patch and its label file for writing.
+
+        Args:
+            img_path (str): Path of the patch image.
+            patch (np.array): Patch to encode, must not be modified after.
+            label_path (str): Path of the label file.
+            label_text (str): Content of the label file.
+        """
+        self._raise_error()
+        if self._executor is None:
+            self._write(img_path, patch, label_path, label_text)
+            return
+        with self.stats.timer('wait'):
+            self._slots.acquire()
+        future = self._executor.submit(self._write, img_path, patch,
+                                       label_path, label_text)
+        future.add_done_callback(self._done)
+
+    def close(self):
+        """Wait for the queued patches and raise the first write error."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._raise_error()
+
+    def _write(self, img_path, patch, label_path, label_text):
+        ext = osp.splitext(img_path)[1]
+        with self.stats.timer('encode'):
+            ok, buf = cv2.imencode(ext, patch, self.encode_params)
+        if not ok:
+            raise IOError(f'Failed to encode {img_path}')
+        label = label_text.encode('utf-8')
+        with self.stats.timer('write'):
+            if self.shard_writer is not None:
+                self.shard_writer.write(
+                    osp.splitext(osp.basename(img_path))[0],
+                    [(osp.basename(img_path), buf.tobytes()),
+                     (osp.basename(label_path), label)])
+            else:
+                with open(img_path, 'wb') as f:
+                    f.write(buf)
+                with open(label_path, 'wb') as f:
+                    f.write(label)
+        self.stats.add(bytes=buf.nbytes + len(label))
+
+    def _done(self, future):
+        self._slots.release()
+        if future.exception() is not None and self._error is None:
+            self._error = future.exception()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+
 def crop_and_save_img(info, windows, window_anns, img_dir, no_padding,
-                      padding_value, save_dir, anno_dir, img_ext):
+                      padding_value, save_dir, anno_dir, img_ext,
+                      windowed_read=False, writer=None, stats=None,
+                      label_format='yolo-obb'):
     """
 
     Args:
@@ -306,14 +1077,69 @@ def crop_and_save_img(info, windows, window_anns, img_dir, no_padding,
         save_dir (str): Save filename.
         anno_dir (str): Annotation filename.
         img_ext (str): Picture suffix.
+        windowed_read (bool): If True, read and mask every window on its
+            own in one top-to-bottom pass over bands of rows instead of
+            decoding the whole scene, see :class:`WindowedImageReader`.
+            Patches of jpeg scenes are not identical to the default cv2
+            decoding. Defaults to False.
+        writer (PatchWriter, optional): Writer of patches and labels. The
+            caller must close it. Defaults to writing synchronously.
+        stats (SplitStats, optional): Receives load, mask and crop times.
+        label_format (str): Format of label files, see :func:`format_labels`.
 
     Returns:
         list[dict]: Information of paths.
     """
-    img = cv2.imread(osp.join(img_dir, info['filename']))
-    img, info = fill_ign(img, info)
+    if stats is None:
+        stats = SplitStats()
+    img_path = osp.join(img_dir, info['filename'])
+    if not windowed_read:
+        with stats.timer('load'):
+            img = cv2.imread(img_path)
+        with stats.timer('mask'):
+            img, info = fill_ign(img, info)
+        return _crop_and_save_windows(
+            info, windows, window_anns, range(windows.shape[0]), no_padding,
+            padding_value, save_dir, anno_dir, img_ext,
+            lambda x1, y1, x2, y2: img[y1:y2, x1:x2], writer, stats,
+            label_format)
+
+    ann = info['ann']
+    info = dict(info)
+    info['ann'] = dict(polys=ann['polys'], cat_ids=ann['cat_ids'])
+    # row-major order reads every row of the scene once
+    order = np.lexsort((windows[:, 0], windows[:, 1])).tolist()
+    with WindowedImageReader(img_path, sequential=True) as reader:
+
+        def read_patch(x_start, y_start, x_stop, y_stop):
+            with stats.timer('load'):
+                patch = reader.read(x_start, y_start, x_stop, y_stop)
+            with stats.timer('mask'):
+                return fill_ign_window(patch, ann, x_start, y_start)
+
+        return _crop_and_save_windows(info, windows, window_anns, order,
+                                      no_padding, padding_value, save_dir,
+                                      anno_dir, img_ext, read_patch, writer,
+                                      stats, label_format)
+
+
+def _crop_and_save_windows(info, windows, window_anns, order, no_padding,
+                           padding_value, save_dir, anno_dir, img_ext,
+                           read_patch, writer=None, stats=None,
+                           label_format='yolo-obb'):
+    """Crop, pad and save windows in ``order``.
+
+    ``read_patch(x_start, y_start, x_stop, y_stop)`` returns the masked
+    pixels of a window, clipped to the image bounds. Time not spent in
+    ``read_patch`` or ``writer`` is counted as the crop stage.
+    """
+    if stats is None:
+        stats = SplitStats()
+    if writer is None:
+        writer = PatchWriter(num_threads=0, stats=stats)
     patch_infos = []
-    for i in range(windows.shape[0]):
+    start, other_time = time.perf_counter(), 0.
+    for i in order:
         patch_info = dict()
         for k, v in info.items():
             if k not in ['id', 'fileanme', 'width', 'height', 'ann']:
@@ -333,104 +1159,195 @@ def crop_and_save_img(info, windows, window_anns, img_dir, no_padding,
         ann['polys'] = translate(ann['polys'], -x_start, -y_start)
         patch_info['ann'] = ann
 
-        patch = img[y_start:y_stop, x_start:x_stop]
+        read_start = time.perf_counter()
+        patch = read_patch(x_start, y_start, x_stop, y_stop)
+        other_time += time.perf_counter() - read_start
         if not no_padding:
-            height = y_stop - y_start
-            width = x_stop - x_start
-            if height > patch.shape[0] or width > patch.shape[1]:
-                padding_patch = np.empty((height, width, patch.shape[-1]),
-                                         dtype=np.uint8)
-                if not isinstance(padding_value, (int, float)):
-                    assert len(padding_value) == patch.shape[-1]
-                padding_patch[...] = padding_value
-                padding_patch[:patch.shape[0], :patch.shape[1], ...] = patch
-                patch = padding_patch
+            patch = pad_patch(patch, y_stop - y_start, x_stop - x_start,
+                              padding_value)
         patch_info['height'] = patch.shape[0]
         patch_info['width'] = patch.shape[1]
 
-        cv2.imwrite(osp.join(save_dir, patch_info['id'] + img_ext), patch)
         patch_info['filename'] = patch_info['id'] + img_ext
         patch_infos.append(patch_info)
 
-        polys_num = patch_info['ann']['polys'].shape[0]
-        outdir = os.path.join(anno_dir, patch_info['id'] + '.json')
-
-        # categories
-        categories = [
-            dict(id=0, name='airplane'),
-            dict(id=1, name='helicopter'),
-            dict(id=2, name='small-vehicle'),
-            dict(id=3, name='large-vehicle'),
-            dict(id=4, name='ship'),
-            dict(id=5, name='container'),
-            dict(id=6, name='storage-tank'),
-            dict(id=7, name='swimming-pool'),
-            dict(id=8, name='windmill')
-        ]
-        # annotations
-        annotations = [
-            dict(poly=patch_info['ann']['polys'][i].tolist(),
-                 cat_id=int(patch_info['ann']['cat_ids'][i]),
-                 trunc=1 if patch_info['ann']['trunc'][i] else 0)
-            for i in range(polys_num)
-        ]
-        
-        patch_info['annotations'] = annotations
-        patch_info['categories'] = categories
-
-        #json.dump(patch_info, open(outdir, 'w'), indent=4)
-        
-        #Change this part to convert the labels to YOLO format
-        
-
-        text_list = [f'''{int(patch_info['ann']['cat_ids'][i])} {int(patch_info["ann"]["polys"][i][0])/patch_info['width']} {int(patch_info["ann"]["polys"][i][1])/patch_info['height']} {int(patch_info["ann"]["polys"][i][2])/patch_info['width']} {int(patch_info["ann"]["polys"][i][3])/patch_info['height']} {int(patch_info["ann"]["polys"][i][4])/patch_info['width']} {int(patch_info["ann"]["polys"][i][7])/patch_info['height']} {int(patch_info["ann"]["polys"][i][6])/patch_info['width']} {int(patch_info["ann"]["polys"][i][7])/patch_info['height']}''' 
-                for i in range(polys_num)
-                ]
-                
-        
-        
-        txt_ann = outdir.replace('.json', '.txt')
-        with codecs.open(txt_ann, 'w', 'utf-8') as f:
-            for row in text_list:
-                f.write(row + '\n')   
+        txt_ann = osp.join(anno_dir, patch_info['id'] + '.txt')
+        label_text = format_labels(patch_info['ann']['polys'],
+                                   patch_info['ann']['cat_ids'],
+                                   patch_info['width'], patch_info['height'],
+                                   label_format)
+        write_start = time.perf_counter()
+        writer.write(
+            osp.join(save_dir, patch_info['filename']), patch, txt_ann,
+            label_text)
+        other_time += time.perf_counter() - write_start
 
         patch_info.pop('ann')
+    stats.add('crop', time.perf_counter() - start - other_time)
     return patch_infos
 
 
+def pad_patch(patch, height, width, padding_value):
+    """Pad a patch clipped by the image border to the window size.
+
+    Args:
+        patch (np.array): Patch with shape (h, w, C).
+        height (int): Height of the window.
+        width (int): Width of the window.
+        padding_value (tuple[int|float]): Padding value.
+
+    Returns:
+        np.array: Patch with shape (height, width, C), ``patch`` itself if
+            it already fills the window.
+    """
+    if height > patch.shape[0] or width > patch.shape[1]:
+        padding_patch = np.empty((height, width, patch.shape[-1]),
+                                 dtype=np.uint8)
+        if not isinstance(padding_value, (int, float)):
+            assert len(padding_value) == patch.shape[-1]
+        padding_patch[...] = padding_value
+        padding_patch[:patch.shape[0], :patch.shape[1], ...] = patch
+        patch = padding_patch
+    return patch
+
+
+def format_labels(polys, cat_ids, width, height, label_format='yolo-obb'):
+    """Format the labels of a patch with one bulk string formatting call.
+
+    Formats:
+        - ``yolo-obb``: ``cls x1 y1 x2 y2 x3 y3 x4 y4`` with corners
+          truncated to pixels and normalized by the patch size.
+        - ``yolo-hbb``: ``cls cx cy w h`` of the horizontal box, clipped to
+          the patch and normalized by the patch size.
+        - ``dota``: ``x1 y1 x2 y2 x3 y3 x4 y4 name difficult`` in pixels.
+
+    Args:
+        polys (np.array): Polygons in patch coordinate with shape (K, 8).
+        cat_ids (np.array): Category ids with shape (K, ).
+        width (int): Width of the patch.
+        height (int): Height of the patch.
+        label_format (str): One of ``LABEL_FORMATS``.
+
+    Returns:
+        str: Content of the label file, one line per object.
+    """
+    assert label_format in LABEL_FORMATS, \
+        f'unknown label format {label_format}'
+    polys = polys.reshape(-1, 8)
+    num = polys.shape[0]
+    if num == 0:
+        return ''
+    cat_ids = np.asarray(cat_ids).astype(np.int64)
+
+    if label_format == 'dota':
+        names = np.array(CLASSES, dtype=object)[cat_ids]
+        rows = np.empty((num, 10), dtype=object)
+        rows[:, :8] = polys.astype(np.float64)
+        rows[:, 8] = names
+        rows[:, 9] = 0
+        return ('%.1f ' * 8 + '%s %d\n') * num % tuple(rows.ravel().tolist())
+
+    size = np.array([width, height], dtype=np.float64)
+    if label_format == 'yolo-obb':
+        coords = np.trunc(polys).reshape(-1, 4, 2) / size
+    else:
+        hbbs = poly2hbb(polys).reshape(-1, 2, 2).clip(0, size)
+        coords = np.stack([hbbs.mean(axis=1), hbbs[:, 1] - hbbs[:, 0]],
+                          axis=1) / size
+    rows = np.concatenate([cat_ids[:, None], coords.reshape(num, -1)], 1)
+    fmt = '%d' + ' %.6f' * (rows.shape[1] - 1) + '\n'
+    return fmt * num % tuple(rows.ravel().tolist())
+
+
 def fill_ign(img, info):
     """ Fill ignore regions of original image with 0, and return the masked image
-        and filtered annotations. """
+        and filtered annotations. The image is masked in place. """
     ann = info['ann']
-    polys = ann['polys']
-    cat_ids = ann['cat_ids']
-    ign_polys = ann['ign_polys']
-    vld_polys = copy.deepcopy(polys).reshape(-1, 8)
-
-    ign_mask = np.ones_like(img[:, :, 0])
-    for ign_poly in ign_polys:
-        ign_poly = np.array(ign_poly).astype(np.int32).reshape([-1, 2])
-        cv2.fillPoly(ign_mask, [ign_poly], 0)
-    for vld_poly in vld_polys:
-        try:
-            vld_poly = vld_poly.astype(np.int32).reshape([-1, 2])
-        except ValueError:
-            print()
-        cv2.fillPoly(ign_mask, [vld_poly], 1)
-    ign_mask = np.expand_dims(ign_mask, 2)  # (H, W, 1)
-    img = img * ign_mask
+    mask_ign_regions(img, ann['ign_polys'], ann['polys'])
 
     ann = dict(
-        polys = polys,
-        cat_ids = cat_ids
+        polys = ann['polys'],
+        cat_ids = ann['cat_ids']
     )   # discard ign_polys
     info['ann'] = ann
     return img, info
 
 
+def fill_ign_window(patch, ann, x_start, y_start):
+    """Fill ignore regions inside a single window with 0.
+
+    Produces the same pixels as cropping the output of :func:`fill_ign`,
+    up to cv2 rounding of ignore edges crossing the window border. Windows
+    without ignore regions are left untouched.
+
+    Args:
+        patch (np.array): Window pixels with shape (H, W, C), masked in place.
+        ann (dict): Image's annotations with ``polys`` and ``ign_polys``.
+        x_start (int): Left of the window in the image.
+        y_start (int): Top of the window in the image.
+
+    Returns:
+        np.array: The masked patch.
+    """
+    return mask_ign_regions(patch, ann['ign_polys'], ann['polys'], x_start,
+                            y_start)
+
+
+def mask_ign_regions(img, ign_polys, vld_polys, x_start=0, y_start=0):
+    """Zero pixels inside ignore polygons but outside valid objects in place.
+
+    Only the bounding box of every ignore polygon, clipped to ``img``, is
+    rasterized, so the cost scales with the ignored area instead of the
+    image size.
+
+    Args:
+        img (np.array): Image or window with shape (H, W, C).
+        ign_polys (list[list[float]]): Ignore polygons in image coordinate.
+        vld_polys (np.array): Valid polygons with shape (N, 8).
+        x_start (int): Left of ``img`` in the image. Defaults to 0.
+        y_start (int): Top of ``img`` in the image. Defaults to 0.
+
+    Returns:
+        np.array: The masked ``img``.
+    """
+    if not len(ign_polys):
+        return img
+    height, width = img.shape[:2]
+    offset = np.array([x_start, y_start], dtype=np.int32)
+    vld_polys = vld_polys.reshape(-1, 4, 2).astype(np.int32) - offset
+    vld_lt, vld_rb = vld_polys.min(axis=1), vld_polys.max(axis=1)
+
+    for ign_poly in ign_polys:
+        ign_poly = np.array(ign_poly).astype(np.int32).reshape([-1, 2])
+        ign_poly = ign_poly - offset
+        lt = np.maximum(ign_poly.min(axis=0), 0)
+        rb = np.minimum(ign_poly.max(axis=0) + 1, [width, height])
+        if (lt >= rb).any():
+            continue
+
+        hits = (vld_rb >= lt).all(axis=1) & (vld_lt < rb).all(axis=1)
+        if hits.any():
+            # objects crossing the box border would be rasterized with
+            # different rounding, so grow the mask to cover them
+            lt = np.maximum(np.minimum(lt, vld_lt[hits].min(axis=0)), 0)
+            rb = np.minimum(np.maximum(rb, vld_rb[hits].max(axis=0) + 1),
+                            [width, height])
+
+        ign_mask = np.zeros((rb[1] - lt[1], rb[0] - lt[0]), dtype=np.uint8)
+        cv2.fillPoly(ign_mask, [ign_poly - lt], 1)
+        for vld_poly in vld_polys[hits]:
+            cv2.fillPoly(ign_mask, [vld_poly - lt], 0)
+        region = img[lt[1]:rb[1], lt[0]:rb[0]]
+        np.copyto(region, 0, where=ign_mask[..., None].astype(bool))
+    return img
+
+
 def single_split(arguments, sizes, gaps, img_rate_thr, iof_thr, no_padding,
-                 padding_value, save_dir, anno_dir, img_ext, lock, prog, total,
-                 logger):
+                 padding_value, save_dir, anno_dir, img_ext,
+                 windowed_read=False, encode_params=None, writer_threads=4,
+                 writer_queue=16, label_format='yolo-obb', shard_dir=None,
+                 shard_size=1 << 30, empty_rate=1., drop_ignored=False,
+                 select_seed=0):
     """
 
     Args:
@@ -444,34 +1361,558 @@ def single_split(arguments, sizes, gaps, img_rate_thr, iof_thr, no_padding,
         save_dir (str): Save filename.
         anno_dir (str): Annotation filename.
         img_ext (str): Picture suffix.
-        lock (object): Lock of Manager.
-        prog (object): Progress of Manager.
-        total (object): Length of infos.
-        logger (object): Logger.
+        windowed_read (bool): If True, decode the scene band by band, see
+            :func:`crop_and_save_img`.
+        encode_params (list[int], optional): Flags of ``cv2.imencode``.
+        writer_threads (int): Number of threads encoding and writing patches.
+        writer_queue (int): Maximum number of patches waiting to be written.
+        label_format (str): Format of label files, see :func:`format_labels`.
+        shard_dir (str, optional): If given, patches and labels are appended
+            to this process' tar shards in this dir instead of loose files.
+        shard_size (int): Bytes after which a new shard is started.
+        empty_rate (float): Fraction of windows without objects to keep.
+        drop_ignored (bool): If True, drop windows fully inside ignore
+            regions.
+        select_seed (int): Seed of choosing the kept empty windows.
 
     Returns:
-        list[dict]: Information of paths.
+        tuple[str, list[dict], SplitStats]: Id of the image, information of
+            paths, which is empty if every window is dropped, and the stage
+            timings of this image.
+    """
+    stats = SplitStats()
+    info, img_dir = arguments
+    windows, window_anns = get_scene_windows(info, sizes, gaps, img_rate_thr,
+                                             iof_thr, empty_rate,
+                                             drop_ignored, select_seed, stats)
+    shard_writer = None if shard_dir is None else \
+        get_shard_writer(shard_dir, shard_size)
+    writer = PatchWriter(writer_threads, writer_queue, encode_params, stats,
+                         shard_writer)
+    try:
+        patch_infos = crop_and_save_img(info, windows, window_anns, img_dir,
+                                        no_padding, padding_value, save_dir,
+                                        anno_dir, img_ext, windowed_read,
+                                        writer, stats, label_format)
+    finally:
+        writer.close()
+
+    stats.add(patches=len(patch_infos))
+    return info['id'], patch_infos, stats
+
+
+def get_scene_windows(info, sizes, gaps, img_rate_thr, iof_thr,
+                      empty_rate=1., drop_ignored=False, select_seed=0,
+                      stats=None):
+    """Get the selected windows of an image and their objects.
+
+    Args:
+        info (dict): Image's information.
+        sizes (list): List of window's sizes.
+        gaps (list): List of window's gaps.
+        img_rate_thr (float): Threshold of window area divided by image area.
+        iof_thr (float): Threshold of overlaps between bbox and window.
+        empty_rate (float): Fraction of windows without objects to keep.
+        drop_ignored (bool): If True, drop windows fully inside ignore
+            regions.
+        select_seed (int): Seed of choosing the kept empty windows.
+        stats (SplitStats, optional): Receives window and iof times, the
+            image, object and window counts.
+
+    Returns:
+        tuple[np.array, list[dict]]: Kept windows and their objects.
+    """
+    if stats is None:
+        stats = SplitStats()
+    with stats.timer('window'):
+        windows = get_sliding_window(info, sizes, gaps, img_rate_thr)
+    with stats.timer('iof'):
+        window_anns = get_window_obj(info, windows, iof_thr)
+    with stats.timer('window'):
+        windows, window_anns, select_counts = select_windows(
+            info, windows, window_anns, empty_rate, drop_ignored,
+            select_seed)
+    stats.add(images=1,
+              objects=info['ann']['polys'].reshape(-1, 8).shape[0],
+              **select_counts)
+    return windows, window_anns
+
+
+def prepare_scene(arguments, sizes, gaps, img_rate_thr, iof_thr,
+                  shm_name=None, empty_rate=1., drop_ignored=False,
+                  select_seed=0):
+    """Get the windows of an image and decode it into shared memory.
+
+    The shared memory is created and unlinked by the caller, sized
+    ``height * width * 3`` bytes. The scene is masked by ignore regions in
+    place, so :func:`crop_window_batch` only crops it.
+
+    Args:
+        arguments (object): Image's information and dir.
+        sizes (list): List of window's sizes.
+        gaps (list): List of window's gaps.
+        img_rate_thr (float): Threshold of window area divided by image area.
+        iof_thr (float): Threshold of overlaps between bbox and window.
+        shm_name (str, optional): Name of the shared memory receiving the
+            masked scene. If None, the scene is not decoded.
+        empty_rate (float): Fraction of windows without objects to keep.
+        drop_ignored (bool): If True, drop windows fully inside ignore
+            regions.
+        select_seed (int): Seed of choosing the kept empty windows.
+
+    Returns:
+        tuple[np.array, list[dict], SplitStats]: Kept windows, their
+            objects and the stats of this stage.
     """
+    stats = SplitStats()
     info, img_dir = arguments
-    windows = get_sliding_window(info, sizes, gaps, img_rate_thr)
-    window_anns = get_window_obj(info, windows, iof_thr)
-    patch_infos = crop_and_save_img(info, windows, window_anns, img_dir,
-                                    no_padding, padding_value, save_dir,
-                                    anno_dir, img_ext)
-    assert patch_infos
-
-    lock.acquire()
-    prog.value += 1
-    msg = f'({prog.value / total:3.1%} {prog.value}:{total})'
+    windows, window_anns = get_scene_windows(info, sizes, gaps, img_rate_thr,
+                                             iof_thr, empty_rate,
+                                             drop_ignored, select_seed, stats)
+    if shm_name is None or not windows.shape[0]:
+        return windows, window_anns, stats
+
+    with stats.timer('load'):
+        img = cv2.imread(osp.join(img_dir, info['filename']))
+    shape = (info['height'], info['width'], 3)
+    if img is None or img.shape != shape:
+        raise ValueError(f"Failed to decode {info['filename']} with shape "
+                         f'{shape}')
+    shm = SharedMemory(shm_name)
+    try:
+        scene = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        scene[...] = img
+        del img
+        with stats.timer('mask'):
+            mask_ign_regions(scene, info['ann']['ign_polys'],
+                             info['ann']['polys'])
+        del scene
+    finally:
+        shm.close()
+    return windows, window_anns, stats
+
+
+def crop_window_batch(batch, no_padding, padding_value, save_dir, anno_dir,
+                      img_ext, shm_name=None, encode_params=None,
+                      writer_threads=4, writer_queue=16,
+                      label_format='yolo-obb', shard_dir=None,
+                      shard_size=1 << 30):
+    """Crop and save a batch of windows of one image.
+
+    Args:
+        batch (tuple): Image's information, the batch's windows, their
+            objects and the image dir.
+        no_padding (bool): If True, no padding.
+        padding_value (tuple[int|float]): Padding value.
+        save_dir (str): Save filename.
+        anno_dir (str): Annotation filename.
+        img_ext (str): Picture suffix.
+        shm_name (str, optional): Shared memory holding the masked scene
+            from :func:`prepare_scene`. If None, every window is read from
+            the image file on its own.
+        encode_params (list[int], optional): Flags of ``cv2.imencode``.
+        writer_threads (int): Number of threads encoding and writing patches.
+        writer_queue (int): Maximum number of patches waiting to be written.
+        label_format (str): Format of label files, see :func:`format_labels`.
+        shard_dir (str, optional): Dir of tar shards, see
+            :func:`single_split`.
+        shard_size (int): Bytes after which a new shard is started.
+
+    Returns:
+        tuple[list[dict], SplitStats]: Information of paths and the stats
+            of this batch.
+    """
+    stats = SplitStats()
+    info, windows, window_anns, img_dir = batch
+    shard_writer = None if shard_dir is None else \
+        get_shard_writer(shard_dir, shard_size)
+    writer = PatchWriter(writer_threads, writer_queue, encode_params, stats,
+                         shard_writer)
+    if shm_name is None:
+        try:
+            patch_infos = crop_and_save_img(info, windows, window_anns,
+                                            img_dir, no_padding,
+                                            padding_value, save_dir,
+                                            anno_dir, img_ext, True, writer,
+                                            stats, label_format)
+        finally:
+            writer.close()
+        return patch_infos, stats
+
+    shm = SharedMemory(shm_name)
+    try:
+        patch_infos = _crop_shared_scene(shm, info, windows, window_anns,
+                                         no_padding, padding_value, save_dir,
+                                         anno_dir, img_ext, writer, stats,
+                                         label_format)
+    finally:
+        shm.close()
+    return patch_infos, stats
+
+
+def _crop_shared_scene(shm, info, windows, window_anns, no_padding,
+                       padding_value, save_dir, anno_dir, img_ext, writer,
+                       stats, label_format):
+    """Crop windows from a scene in shared memory and close ``writer``.
+
+    Queued patches are views of the shared memory, so every one of them is
+    written, and dropped with this frame, before the caller closes it.
+    """
+    scene = np.ndarray((info['height'], info['width'], 3), dtype=np.uint8,
+                       buffer=shm.buf)
+    try:
+        return _crop_and_save_windows(
+            info, windows, window_anns, range(windows.shape[0]), no_padding,
+            padding_value, save_dir, anno_dir, img_ext,
+            lambda x1, y1, x2, y2: scene[y1:y2, x1:x2], writer, stats,
+            label_format)
+    finally:
+        writer.close()
+
+
+def schedule_window_batches(pool, tasks, prepare, crop, batch_size=16,
+                            shared=True, lookahead=None):
+    """Split images on a process pool at window-batch granularity.
+
+    A worker computes the windows of an image and, if ``shared``, decodes
+    and masks it into shared memory owned by this process. Batches of
+    ``batch_size`` windows are then cropped and written by any worker, so
+    a few giant scenes do not leave the other workers idle at the end of a
+    run. At most ``lookahead`` images are in flight, which bounds the
+    shared memory in use. The pool must be created once the resource
+    tracker runs, so that workers share it with this process.
+
+    Args:
+        pool (multiprocessing.Pool): Process pool.
+        tasks (list[tuple]): Image's information and dir of every image.
+        prepare (callable): :func:`prepare_scene` with its parameters bound,
+            called as ``prepare(task, shm_name=shm_name)``.
+        crop (callable): :func:`crop_window_batch` with its parameters
+            bound, called as ``crop(batch, shm_name=shm_name)``.
+        batch_size (int): Number of windows per batch. Defaults to 16.
+        shared (bool | callable): If True, scenes are decoded once into
+            shared memory, otherwise every batch reads its windows from the
+            image file. A callable decides per image from its information,
+            see :func:`use_shared_scene`. Defaults to True.
+        lookahead (int, optional): Maximum number of images in flight.
+            Defaults to the number of tasks.
+
+    Yields:
+        tuple[str, list[dict], SplitStats]: Same as :func:`single_split`,
+            in the order images finish.
+    """
+    events = queue.Queue()
+    tasks = iter(tasks)
+    lookahead = max(lookahead or 1 << 30, 1)
+    scenes, keys = dict(), itertools.count()
+
+    def on_error(e):
+        events.put(('error', None, e))
+
+    def submit_scene():
+        task = next(tasks, None)
+        if task is None:
+            return False
+        info, key = task[0], next(keys)
+        shm = SharedMemory(create=True,
+                           size=max(info['height'] * info['width'] * 3, 1)) \
+            if (shared(info) if callable(shared) else shared) else None
+        scenes[key] = dict(task=task, shm=shm, stats=None, results=dict())
+        pool.apply_async(
+            prepare, (task, ),
+            dict(shm_name=None if shm is None else shm.name),
+            callback=lambda r: events.put(('scene', key, r)),
+            error_callback=on_error)
+        return True
+
+    def finish_scene(key):
+        scene = scenes.pop(key)
+        if scene['shm'] is not None:
+            scene['shm'].unlink()
+            scene['shm'].close()
+        patch_infos = []
+        for b in sorted(scene['results']):
+            batch_infos, batch_stats = scene['results'][b]
+            patch_infos += batch_infos
+            scene['stats'].merge(batch_stats)
+        scene['stats'].add(patches=len(patch_infos))
+        return scene['task'][0]['id'], patch_infos, scene['stats']
+
+    try:
+        while len(scenes) < lookahead and submit_scene():
+            pass
+        while scenes:
+            kind, key, result = events.get()
+            if kind == 'error':
+                raise result
+
+            if kind == 'scene':
+                scene = scenes[key]
+                windows, window_anns, scene['stats'] = result
+                info, img_dir = scene['task']
+                if scene['shm'] is not None:
+                    order = np.arange(windows.shape[0])
+                    info = dict(info, ann=dict())
+                else:
+                    # row-major order keeps strip-based decoders reading
+                    # forward
+                    order = np.lexsort((windows[:, 0], windows[:, 1]))
+                scene['num_batches'] = ceil(len(order) / batch_size)
+                for b in range(scene['num_batches']):
+                    inds = order[b * batch_size:(b + 1) * batch_size]
+                    batch = (info, windows[inds],
+                             [window_anns[i] for i in inds], img_dir)
+                    pool.apply_async(
+                        crop, (batch, ),
+                        dict(shm_name=None if scene['shm'] is None else
+                             scene['shm'].name),
+                        callback=lambda r, key=key, b=b: events.put(
+                            ('batch', (key, b), r)),
+                        error_callback=on_error)
+            else:
+                key, b = key
+                scene = scenes[key]
+                scene['results'][b] = result
+
+            if len(scene['results']) == scene['num_batches']:
+                yield finish_scene(key)
+                submit_scene()
+    finally:
+        for scene in scenes.values():
+            if scene['shm'] is not None:
+                scene['shm'].unlink()
+                scene['shm'].close()
+
+
+def use_shared_scene(info, windowed_read=False):
+    """Check if window batches of an image should share a decoded scene.
+
+    Jpeg and png scenes can only be decoded from the top, so every batch
+    reading its windows from the file would decode the scene again. They
+    are decoded once into shared memory even with ``windowed_read``, only
+    the tiled or strip formats of ``WINDOWED_FORMATS`` are read per batch.
+
+    Args:
+        info (dict): Image's information.
+        windowed_read (bool): If True, read windows from the file where
+            the format allows it.
+
+    Returns:
+        bool: True if the scene should be decoded into shared memory.
+    """
+    if not windowed_read or rasterio is None:
+        return True
+    return osp.splitext(info['filename'])[1].lower() not in WINDOWED_FORMATS
+
+
+def log_progress(logger, info, stats, done, total, elapsed):
+    """Log the progress after an image is split.
+
+    Args:
+        logger (object): Logger.
+        info (dict): Information of the finished image.
+        stats (SplitStats): Stats of the finished image.
+        done (int): Number of finished images.
+        total (int): Number of images to split.
+        elapsed (float): Seconds since splitting started.
+    """
+    msg = f'({done / max(total, 1):3.1%} {done}:{total})'
     msg += ' - ' + f"Filename: {info['filename']}"
     msg += ' - ' + f"width: {info['width']:<5d}"
     msg += ' - ' + f"height: {info['height']:<5d}"
-    msg += ' - ' + f"Objects: {len(info['ann']['polys']):<5d}"
-    msg += ' - ' + f'Patches: {len(patch_infos)}'
+    msg += ' - ' + f"Objects: {stats.counts['objects']:<5d}"
+    msg += ' - ' + f"Patches: {stats.counts['patches']:<5d}"
+    msg += ' - ' + f"Dropped: {stats.counts['empty_dropped']} empty, " \
+        f"{stats.counts['ignored_dropped']} ignored"
+    msg += ' - ' + f'{done / max(elapsed, 1e-6):.2f} img/s'
     logger.info(msg)
-    lock.release()
 
-    return patch_infos
+
+def get_encode_params(args):
+    """Get ``cv2.imencode`` flags from arguments.
+
+    Args:
+        args (object): Parsed arguments.
+
+    Returns:
+        list[int]: Encoder flags, empty to keep cv2's defaults.
+    """
+    encode_params = []
+    if args.jpeg_quality is not None:
+        encode_params += [cv2.IMWRITE_JPEG_QUALITY, args.jpeg_quality]
+    if args.png_compression is not None:
+        encode_params += [cv2.IMWRITE_PNG_COMPRESSION, args.png_compression]
+    return encode_params
+
+
+def write_manifest(f, patch_infos):
+    """Append patch records to a JSON Lines manifest.
+
+    Records are flushed right away, so the manifest keeps every finished
+    image when the run is interrupted.
+
+    Args:
+        f (object): Manifest file opened for writing.
+        patch_infos (list[dict]): Information of patches of one image.
+
+    Returns:
+        int: Number of written records.
+    """
+    for patch_info in patch_infos:
+        f.write(json.dumps(patch_info) + '\n')
+    f.flush()
+    return len(patch_infos)
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Compute the sha1 digest of a file's content.
+
+    Args:
+        path (str): Path of the file.
+        chunk_size (int): Bytes read at a time.
+
+    Returns:
+        str: Hex digest.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(partial(f.read, chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_source_state(img_file, ann_file, prev_state=None):
+    """Get sizes, mtimes and digests of an image and its annotation.
+
+    Digests of files whose size and mtime match ``prev_state`` are reused,
+    so unchanged files are not read again.
+
+    Args:
+        img_file (str): Path of the image.
+        ann_file (str): Path of the annotation, may be None.
+        prev_state (dict, optional): State from the completion cache.
+
+    Returns:
+        dict: ``[size, mtime_ns, digest]`` of the image and annotation.
+    """
+    state = dict()
+    for k, path in (('img', img_file), ('ann', ann_file)):
+        if path is None:
+            state[k] = None
+            continue
+        stat = os.stat(path)
+        prev = (prev_state or {}).get(k)
+        if prev is not None and prev[:2] == [stat.st_size, stat.st_mtime_ns]:
+            state[k] = prev
+        else:
+            state[k] = [stat.st_size, stat.st_mtime_ns, file_digest(path)]
+    return state
+
+
+def get_split_key(state, split_params):
+    """Key an image on its content and the split parameters.
+
+    Args:
+        state (dict): Output of :func:`get_source_state`.
+        split_params (dict): Parameters changing the produced patches.
+
+    Returns:
+        str: Hex digest, equal keys mean the image's patches are current.
+    """
+    digests = [None if v is None else v[2] for v in state.values()]
+    content = json.dumps([digests, split_params], sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def load_split_cache(cache_file):
+    """Load the per-image completion cache.
+
+    The cache is a JSON Lines log where the last record of an image wins,
+    a record with ``removed`` drops the image.
+
+    Args:
+        cache_file (str): Path of the cache.
+
+    Returns:
+        dict: Completion records keyed by image id.
+    """
+    cache = dict()
+    if not osp.exists(cache_file):
+        return cache
+    with open(cache_file, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn last line of an interrupted run
+            if record.get('removed'):
+                cache.pop(record['id'], None)
+            else:
+                cache[record['id']] = record
+    return cache
+
+
+def append_split_cache(cache_file, record):
+    """Append the completion record of one image to the cache.
+
+    Args:
+        cache_file (str): Path of the cache.
+        record (dict): Completion record of the image.
+    """
+    with open(cache_file, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def save_split_cache(cache_file, cache):
+    """Rewrite the completion cache with one record per image.
+
+    Args:
+        cache_file (str): Path of the cache.
+        cache (dict): Completion records keyed by image id.
+    """
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        for record in cache.values():
+            f.write(json.dumps(record) + '\n')
+    os.replace(tmp_file, cache_file)
+
+
+def remove_patches(filenames, save_dir, anno_dir):
+    """Remove patch images and their label files.
+
+    Args:
+        filenames (list[str]): Filenames of patch images.
+        save_dir (str): Dir of patch images.
+        anno_dir (str): Dir of label files.
+    """
+    for filename in filenames:
+        label = osp.splitext(filename)[0] + '.txt'
+        for path in (osp.join(save_dir, filename), osp.join(anno_dir, label)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def filter_manifest(manifest, drop_ids):
+    """Drop the records of some source images from a manifest.
+
+    Args:
+        manifest (str): Path of the JSON Lines manifest.
+        drop_ids (set[str]): Ids of the source images to drop.
+    """
+    if not osp.exists(manifest) or not drop_ids:
+        return
+    tmp_file = manifest + '.tmp'
+    with open(manifest, 'r') as fin, open(tmp_file, 'w') as fout:
+        for line in fin:
+            try:
+                ori_id = json.loads(line)['ori_id']
+            except ValueError:
+                continue
+            if ori_id not in drop_ids:
+                fout.write(line)
+    os.replace(tmp_file, manifest)
 
 
 def setup_logger(log_path):
@@ -518,13 +1959,16 @@ def translate(polys, x, y):
     return translated
 
 
-def load_sodaa(img_dir, ann_dir=None, nproc=10):
+def load_sodaa(img_dir, ann_dir=None, nproc=10, index_file=None):
     """Load SODA-A dataset.
 
     Args:
         img_dir (str): Path of images.
         ann_dir (str): Path of annotations.
         nproc (int): number of processes.
+        index_file (str, optional): Path of a cached dataset index. Only
+            annotations and images whose size or mtime changed since the
+            index was written are parsed again, and the index is updated.
 
     Returns:
         list: Dataset's contents.
@@ -535,21 +1979,136 @@ def load_sodaa(img_dir, ann_dir=None, nproc=10):
 
     print('Starting loading SODA-A dataset information.')
     start_time = time.time()
+    annfiles = sorted(os.listdir(ann_dir))
+    contents, file_stats = [None] * len(annfiles), None
+    if index_file is not None:
+        annfiles = [f for f in annfiles if osp.splitext(f)[1] == '.json']
+        file_stats = [
+            _get_sodaa_file_stat(annfile, img_dir, ann_dir)
+            for annfile in annfiles
+        ]
+        index = load_sodaa_index(index_file)
+        for i, (annfile, stat) in enumerate(zip(annfiles, file_stats)):
+            if annfile in index and index[annfile][0] == stat:
+                contents[i] = index[annfile][1]
+    todo = [i for i, c in enumerate(contents) if c is None]
+
     _load_func = partial(_load_sodaa_single, img_dir=img_dir, ann_dir=ann_dir)
-    if nproc > 1:
+    if nproc > 1 and len(todo) > 1:
         pool = Pool(nproc)
-        contents = pool.map(_load_func, sorted(os.listdir(ann_dir)))
+        loaded = pool.map(_load_func, [annfiles[i] for i in todo])
         pool.close()
     else:
-        contents = list(map(_load_func, sorted(os.listdir(ann_dir))))
+        loaded = list(map(_load_func, [annfiles[i] for i in todo]))
+    for i, content in zip(todo, loaded):
+        contents[i] = content
+
+    if index_file is not None and (todo or len(index) != len(annfiles)):
+        save_sodaa_index(index_file, annfiles, file_stats, contents)
     contents = [c for c in contents if c is not None]
     end_time = time.time()
+    parsed = '' if index_file is None else f' ({len(todo)} parsed)'
     print(f'Finishing loading SODA-A dataset, get {len(contents)} images,',
-          f'using {end_time - start_time:.3f}s.')
+          f'using {end_time - start_time:.3f}s{parsed}.')
 
     return contents
 
 
+def _get_sodaa_file_stat(annfile, img_dir, ann_dir):
+    """Get sizes and mtimes of an annotation and its image."""
+    ann_id = osp.splitext(annfile)[0]
+    ann_stat = os.stat(osp.join(ann_dir, annfile))
+    img_stat = os.stat(osp.join(img_dir, ann_id + '.jpg'))
+    return (ann_stat.st_size, ann_stat.st_mtime_ns, img_stat.st_size,
+            img_stat.st_mtime_ns)
+
+
+def save_sodaa_index(index_file, annfiles, file_stats, contents):
+    """Save loaded SODA-A contents as a compact index.
+
+    All polygons are stored in one flat float32 array with per-image
+    offsets, and ignore polygons as flat coordinates with offsets, so the
+    whole dataset is a handful of arrays in one ``.npz`` file.
+
+    Args:
+        index_file (str): Path of the index.
+        annfiles (list[str]): Filenames of annotations.
+        file_stats (list[tuple]): Output of ``_get_sodaa_file_stat``.
+        contents (list[dict]): Contents from :func:`_load_sodaa_single`.
+    """
+    polys, cat_ids, ign_polys = [], [], []
+    poly_nums, ign_nums, sizes = [], [], []
+    for content in contents:
+        ann = content['ann']
+        polys.append(ann['polys'].reshape(-1, 8))
+        cat_ids.append(ann['cat_ids'].astype(np.float32))
+        ign_polys.extend(ann['ign_polys'])
+        poly_nums.append(polys[-1].shape[0])
+        ign_nums.append(len(ann['ign_polys']))
+        sizes.append((content['width'], content['height']))
+    ign_point_nums = [len(p) for p in ign_polys]
+
+    os.makedirs(osp.dirname(osp.abspath(index_file)), exist_ok=True)
+    tmp_file = index_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.savez(
+            f,
+            version=np.array(1),
+            annfiles=np.array(annfiles, dtype=str),
+            file_stats=np.array(file_stats, dtype=np.int64).reshape(-1, 4),
+            sizes=np.array(sizes, dtype=np.int64).reshape(-1, 2),
+            poly_offsets=np.cumsum([0] + poly_nums),
+            polys=np.concatenate(polys + [np.zeros((0, 8), np.float32)]),
+            cat_ids=np.concatenate(cat_ids + [np.zeros((0, ), np.float32)]),
+            ign_offsets=np.cumsum([0] + ign_nums),
+            ign_point_offsets=np.cumsum([0] + ign_point_nums),
+            ign_coords=np.array(
+                list(itertools.chain.from_iterable(ign_polys)),
+                dtype=np.float64))
+    os.replace(tmp_file, index_file)
+
+
+def load_sodaa_index(index_file):
+    """Load an index written by :func:`save_sodaa_index`.
+
+    Args:
+        index_file (str): Path of the index.
+
+    Returns:
+        dict: ``(file_stat, content)`` keyed by annotation filename, empty
+            if the index does not exist or is outdated.
+    """
+    if not osp.exists(index_file):
+        return dict()
+    with np.load(index_file) as data:
+        if int(data['version']) != 1:
+            return dict()
+        data = dict(data)
+
+    index = dict()
+    poly_offsets, ign_offsets = data['poly_offsets'], data['ign_offsets']
+    ign_point_offsets = data['ign_point_offsets']
+    for i, annfile in enumerate(data['annfiles'].tolist()):
+        p0, p1 = poly_offsets[i], poly_offsets[i + 1]
+        ign_polys = [
+            data['ign_coords'][ign_point_offsets[j]:
+                               ign_point_offsets[j + 1]].tolist()
+            for j in range(ign_offsets[i], ign_offsets[i + 1])
+        ]
+        cat_ids = data['cat_ids'][p0:p1] if p1 > p0 else \
+            np.zeros((0,), dtype=np.int64)
+        ann_id = osp.splitext(annfile)[0]
+        content = dict(
+            ann=dict(polys=data['polys'][p0:p1], cat_ids=cat_ids,
+                     ign_polys=ign_polys))
+        content.update(
+            dict(width=int(data['sizes'][i, 0]),
+                 height=int(data['sizes'][i, 1]),
+                 filename=ann_id + '.jpg', id=ann_id))
+        index[annfile] = (tuple(data['file_stats'][i].tolist()), content)
+    return index
+
+
 def _load_sodaa_single(annfile, img_dir, ann_dir):
     """Load DOTA's single image.
 
@@ -603,7 +2162,7 @@ def _load_sodaa_json(jsonfile):
                 # poly = np.array(poly, dtype=np.float32).reshape(-1, 8)
                 polys.append(poly)
                 cat_ids.append(cat_id)
-    polys = np.array(polys, dtype=np.float32).squeeze() if polys else \
+    polys = np.array(polys, dtype=np.float32).reshape(-1, 8) if polys else \
         np.zeros((0, 8), dtype=np.float32)
     cat_ids = np.array(cat_ids, dtype=np.float32) if cat_ids else \
         np.zeros((0,), dtype=np.int64)
@@ -625,21 +2184,88 @@ def main():
         gaps += [int(gap / rate) for gap in args.gaps]
     save_imgs = osp.join(args.save_dir, 'Images')
     save_files = osp.join(args.save_dir, 'Annotations')
-    os.makedirs(save_imgs)
-    os.makedirs(save_files)
+    save_shards = None
+    if args.output_format == 'tar':
+        save_shards = osp.join(args.save_dir, 'Shards')
+        os.makedirs(save_shards)
+    else:
+        os.makedirs(save_imgs, exist_ok=args.incremental)
+        os.makedirs(save_files, exist_ok=args.incremental)
     logger = setup_logger(args.save_dir)
 
     print('Loading original data!!!')
-    infos, img_dirs = [], []
+    infos, img_dirs, ann_dirs = [], [], []
     for img_dir, ann_dir in zip(args.img_dirs, args.ann_dirs):
-        _infos = load_sodaa(img_dir=img_dir, ann_dir=ann_dir, nproc=args.nproc)
+        index_file = None
+        if args.index_dir is not None:
+            dirs_key = hashlib.sha1(
+                f'{osp.abspath(img_dir)}|{osp.abspath(ann_dir)}'.encode(
+                    'utf-8')).hexdigest()[:16]
+            index_file = osp.join(args.index_dir,
+                                  f'sodaa_index_{dirs_key}.npz')
+        _infos = load_sodaa(img_dir=img_dir, ann_dir=ann_dir, nproc=args.nproc,
+                            index_file=index_file)
         _img_dirs = [img_dir for _ in range(len(_infos))]
         infos.extend(_infos)
         img_dirs.extend(_img_dirs)
+        ann_dirs.extend([ann_dir for _ in range(len(_infos))])
+
+    manifest = osp.join(args.save_dir, 'patch_infos.jsonl')
+    cache_file = osp.join(args.save_dir, 'split_cache.jsonl')
+    if args.window_batch > 0:
+        # workers attaching to shared memory must report to the tracker of
+        # the parent, which owns and unlinks it
+        resource_tracker.ensure_running()
+    pool = Pool(args.nproc) if args.nproc > 1 else None
+    tasks, pending = list(zip(infos, img_dirs)), dict()
+    if args.incremental:
+        print('Checking completion cache!!!')
+        cache = load_split_cache(cache_file)
+        split_params = dict(
+            sizes=sizes,
+            gaps=gaps,
+            img_rate_thr=args.img_rate_thr,
+            iof_thr=args.iof_thr,
+            no_padding=args.no_padding,
+            padding_value=padding_value,
+            save_ext=args.save_ext,
+            label_format=args.label_format,
+            encode_params=get_encode_params(args),
+            empty_rate=args.empty_rate,
+            drop_ignored=args.drop_ignored,
+            select_seed=args.select_seed,
+            windowed_read=args.windowed_read)
+        state_args = [
+            (osp.join(img_dir, info['filename']),
+             None if ann_dir is None else osp.join(ann_dir,
+                                                   info['id'] + '.json'),
+             cache.get(info['id'], {}).get('sources'))
+            for info, img_dir, ann_dir in zip(infos, img_dirs, ann_dirs)
+        ]
+        states = pool.starmap(get_source_state, state_args) \
+            if pool is not None else [get_source_state(*a) for a in state_args]
+
+        tasks = []
+        for info, img_dir, state in zip(infos, img_dirs, states):
+            key = get_split_key(state, split_params)
+            record = cache.get(info['id'])
+            if record is None or record['key'] != key:
+                tasks.append((info, img_dir))
+                pending[info['id']] = dict(id=info['id'], key=key,
+                                           sources=state)
+        current_ids = set(info['id'] for info in infos)
+        stale_ids = set(
+            i for i in cache if i in pending or i not in current_ids)
+        for i in stale_ids:
+            remove_patches(cache.pop(i)['patches'], save_imgs, save_files)
+        save_split_cache(cache_file, cache)
+        filter_manifest(manifest, stale_ids | set(pending))
+        print(f'{len(tasks)} new or changed images, '
+              f'{len(infos) - len(tasks)} up to date, '
+              f'{len(stale_ids - set(pending))} removed')
 
     print('Start splitting images!!!')
     start = time.time()
-    manager = Manager()
     worker = partial(
         single_split,
         sizes=sizes,
@@ -651,22 +2277,83 @@ def main():
         save_dir=save_imgs,
         anno_dir=save_files,
         img_ext=args.save_ext,
-        lock=manager.Lock(),
-        prog=manager.Value('i', 0),
-        total=len(infos),
-        logger=logger)
-
-    if args.nproc > 1:
-        pool = Pool(args.nproc)
-        patch_infos = pool.map(worker, zip(infos, img_dirs))
-        pool.close()
-    else:
-        patch_infos = list(map(worker, zip(infos, img_dirs)))
+        windowed_read=args.windowed_read,
+        encode_params=get_encode_params(args),
+        writer_threads=args.writer_threads,
+        writer_queue=args.writer_queue,
+        label_format=args.label_format,
+        shard_dir=save_shards,
+        shard_size=args.shard_size << 20,
+        empty_rate=args.empty_rate,
+        drop_ignored=args.drop_ignored,
+        select_seed=args.select_seed)
+    prepare = partial(
+        prepare_scene,
+        sizes=sizes,
+        gaps=gaps,
+        img_rate_thr=args.img_rate_thr,
+        iof_thr=args.iof_thr,
+        empty_rate=args.empty_rate,
+        drop_ignored=args.drop_ignored,
+        select_seed=args.select_seed)
+    crop = partial(
+        crop_window_batch,
+        no_padding=args.no_padding,
+        padding_value=padding_value,
+        save_dir=save_imgs,
+        anno_dir=save_files,
+        img_ext=args.save_ext,
+        encode_params=get_encode_params(args),
+        writer_threads=args.writer_threads,
+        writer_queue=args.writer_queue,
+        label_format=args.label_format,
+        shard_dir=save_shards,
+        shard_size=args.shard_size << 20)
+
+    num_patches, stats = 0, SplitStats()
+    task_infos = {info['id']: info for info, _ in tasks}
+    with open(manifest, 'a' if args.incremental else 'w') as f:
+        if pool is not None and args.window_batch > 0:
+            results = schedule_window_batches(
+                pool, tasks, prepare, crop, args.window_batch,
+                partial(use_shared_scene, windowed_read=args.windowed_read),
+                args.scene_lookahead or args.nproc)
+        elif pool is not None:
+            results = pool.imap_unordered(worker, tasks)
+        else:
+            results = map(worker, tasks)
+        for ori_id, patch_infos, img_stats in results:
+            num_patches += write_manifest(f, patch_infos)
+            stats.merge(img_stats)
+            log_progress(logger, task_infos[ori_id], img_stats,
+                         stats.counts['images'], len(tasks),
+                         time.time() - start)
+            # the image only counts as done once its records are on disk
+            record = pending.pop(ori_id, None)
+            if record is not None:
+                record['patches'] = [p['filename'] for p in patch_infos]
+                append_split_cache(cache_file, record)
+        if pool is not None:
+            pool.close()
+            pool.join()
+    close_shard_writer()
+    if args.incremental:
+        save_split_cache(cache_file, load_split_cache(cache_file))
 
-    patch_infos = reduce(lambda x, y: x + y, patch_infos)
     stop = time.time()
+    summary = stats.summary(stop - start)
+    with open(osp.join(args.save_dir, 'split_stats.json'), 'w') as f:
+        json.dump(summary, f, indent=4)
     print(f'Finish splitting images in {int(stop - start)} second!!!')
-    print(f'Total images number: {len(patch_infos)}')
+    print(f'Total images number: {num_patches}')
+    print(f"Dropped windows: {stats.counts['empty_dropped']} empty, "
+          f"{stats.counts['ignored_dropped']} ignored")
+    print(f"Throughput: {summary['images_per_s']:.2f} images/s, "
+          f"{summary['patches_per_s']:.1f} patches/s, "
+          f"{summary['mb_per_s']:.1f} MB/s")
+    print('Stage seconds: ' + ', '.join(
+        f'{k} {v:.1f}' for k, v in summary['stage_seconds'].items()))
+    print(f'Patch manifest saved to {manifest}')
 
 
 if __name__ == '__main__':
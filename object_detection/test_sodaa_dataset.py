@@ -0,0 +1,53 @@
+import os
+
+import cv2
+import numpy as np
+
+from sodaa_dataset import SodaaPatchDataset
+from sodaa_split import format_labels, load_sodaa
+
+from test_sodaa_split import read_manifest, run_split, sodaa_data  # noqa
+
+
+def test_patches_match_split_output(sodaa_data, tmp_path):
+    save_dir = tmp_path / 'split'
+    run_split(sodaa_data, save_dir)
+    records = {(r['ori_id'], r['x_start'], r['y_start']): r
+               for r in read_manifest(save_dir)}
+
+    infos = load_sodaa(sodaa_data[0], sodaa_data[1], nproc=1)
+    dataset = SodaaPatchDataset(infos, sodaa_data[0], [400], [100])
+    assert len(dataset) == len(records)
+    for idx, (patch, labels) in enumerate(dataset):
+        patch_info = dataset.patch_info(idx)
+        record = records[(patch_info['ori_id'], patch_info['x_start'],
+                          patch_info['y_start'])]
+        np.testing.assert_array_equal(
+            patch, cv2.imread(str(save_dir / 'Images' / record['filename'])))
+        with open(save_dir / 'Annotations' / (record['id'] + '.txt')) as f:
+            assert format_labels(labels['polys'], labels['cat_ids'],
+                                 patch.shape[1], patch.shape[0]) == f.read()
+
+
+def test_windowed_read_matches_decoded_scene(sodaa_data, tmp_path):
+    # jpeg decoders differ, so compare on lossless copies of the scenes
+    img_dir = tmp_path / 'Images'
+    os.makedirs(img_dir)
+    infos = load_sodaa(sodaa_data[0], sodaa_data[1], nproc=1)
+    for info in infos:
+        img = cv2.imread(os.path.join(sodaa_data[0], info['filename']))
+        info['filename'] = info['id'] + '.png'
+        cv2.imwrite(str(img_dir / info['filename']), img)
+
+    dataset = SodaaPatchDataset(infos, str(img_dir), [400], [100],
+                                cache_size=1)
+    windowed = SodaaPatchDataset(infos, str(img_dir), [400], [100],
+                                 cache_size=1, windowed_read=True)
+    assert len(windowed) == len(dataset)
+    # visit the scenes back and forth through the scene caches
+    for idx in list(range(len(dataset))) + [0, -1, 0]:
+        (patch, labels), (expected, expected_labels) = windowed[idx], \
+            dataset[idx]
+        assert (patch != expected).any(axis=2).mean() < 1e-3
+        np.testing.assert_array_equal(labels['polys'],
+                                      expected_labels['polys'])
@@ -0,0 +1,453 @@
+import glob
+import json
+import os
+import os.path as osp
+import shutil
+import subprocess
+import sys
+import tarfile
+
+import cv2
+import numpy as np
+import pytest
+
+import sodaa_split
+from sodaa_bench import make_synthetic_sodaa
+
+from sodaa_split import (CLASSES, PatchWriter, ShardWriter,
+                         WindowedImageReader,
+                         _bbox_overlaps_iof_shapely, bbox_overlaps_iof,
+                         bbox_overlaps_iof_sparse, fill_ign_window,
+                         format_labels, get_window_obj, load_sodaa,
+                         mask_ign_regions, select_windows,
+                         use_shared_scene)
+
+WINDOWS = np.array([[0, 0, 800, 800], [600, 0, 1400, 800]])
+
+
+def random_polys(num, seed=0):
+    """Rotated rectangles of 2 to 1200 pixels around a 1400x800 image."""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform([-100, -100], [1500, 900], (num, 2))
+    sizes = rng.uniform(2, 1200, (num, 2)) * rng.choice([0.05, 1], (num, 1))
+    angles = rng.uniform(0, np.pi, num)
+    corners = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) / 2
+    rot = np.stack([np.cos(angles), -np.sin(angles), np.sin(angles),
+                    np.cos(angles)], axis=1).reshape(num, 2, 2)
+    points = centers[:, None] + np.einsum('nij,nkj->nki', rot,
+                                          corners * sizes[:, None])
+    return points.reshape(num, 8).astype(np.float32)
+
+
+def get_info(polys):
+    polys = np.asarray(polys, dtype=np.float32).reshape(-1, 8)
+    return dict(ann=dict(polys=polys,
+                         labels=np.zeros(polys.shape[0], dtype=np.int64)))
+
+
+@pytest.mark.parametrize('iof_thr', [0.7, 0])
+def test_get_window_obj_empty_scene(iof_thr):
+    window_anns = get_window_obj(get_info([]), WINDOWS, iof_thr)
+    assert [len(ann['polys']) for ann in window_anns] == [0, 0]
+
+
+@pytest.mark.parametrize('iof_thr', [0.7, 0])
+def test_get_window_obj_border_object(iof_thr):
+    # 50 of the 60 pixels of width lie inside the image
+    polys = [-10, 10, 50, 10, 50, 60, -10, 60]
+    window_anns = get_window_obj(get_info(polys), WINDOWS, iof_thr)
+    assert len(window_anns[0]['polys']) == 1
+    assert window_anns[0]['trunc'].tolist() == [True]
+
+
+@pytest.mark.parametrize('iof_thr', [0.7, 0])
+def test_get_window_obj_object_larger_than_window(iof_thr):
+    polys = [50, 100, 950, 100, 950, 150, 50, 150]
+    window_anns = get_window_obj(get_info(polys), WINDOWS, iof_thr)
+    assert [len(ann['polys']) for ann in window_anns] == \
+        [1, 0 if iof_thr else 1]
+    assert window_anns[0]['trunc'].tolist() == [True]
+
+
+@pytest.mark.parametrize('num', [0, 1, 200])
+def test_bbox_overlaps_iof_matches_shapely(num):
+    pytest.importorskip('shapely')
+    polys = random_polys(num)
+    # axis-aligned objects crossing the border and longer than a window
+    polys = np.concatenate([
+        polys,
+        np.array([[-10, 10, 50, 10, 50, 60, -10, 60],
+                  [50, 100, 950, 100, 950, 150, 50, 150]],
+                 dtype=np.float32)[:num]
+    ])
+    expected = _bbox_overlaps_iof_shapely(polys, WINDOWS)
+    overlaps = bbox_overlaps_iof(polys, WINDOWS)
+    assert overlaps.shape == expected.shape
+    np.testing.assert_allclose(overlaps, expected, rtol=1e-5, atol=1e-5)
+
+    obj_inds, win_inds, iofs = bbox_overlaps_iof_sparse(polys, WINDOWS)
+    dense = np.zeros(expected.shape)
+    dense[obj_inds, win_inds] = iofs
+    np.testing.assert_allclose(dense, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_bbox_overlaps_iof_no_windows():
+    polys = random_polys(3)
+    assert bbox_overlaps_iof(polys, np.zeros((0, 4))).shape == (3, 0)
+    obj_inds, _, _ = bbox_overlaps_iof_sparse(polys, np.zeros((0, 4)))
+    assert len(obj_inds) == 0
+
+
+@pytest.mark.parametrize('row_major', [True, False])
+def test_sequential_reader_matches_imread(tmp_path, row_major):
+    pytest.importorskip('rasterio')
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (500, 700, 3), dtype=np.uint8)
+    img_path = str(tmp_path / 'scene.png')
+    cv2.imwrite(img_path, img)
+    windows = np.stack([
+        rng.integers(0, 650, 40),
+        rng.integers(0, 450, 40),
+    ], axis=1)
+    sizes = rng.integers(1, 300, (40, 2))
+    windows = np.concatenate([windows, windows + sizes], axis=1)
+    if row_major:
+        windows = windows[np.lexsort((windows[:, 0], windows[:, 1]))]
+
+    with WindowedImageReader(img_path, sequential=True) as reader:
+        for x_start, y_start, x_stop, y_stop in windows.tolist():
+            patch = reader.read(x_start, y_start, x_stop, y_stop)
+            np.testing.assert_array_equal(
+                patch, img[y_start:y_stop, x_start:x_stop])
+
+
+def test_use_shared_scene():
+    pytest.importorskip('rasterio')
+    # jpeg scenes are decoded from the top, so batches share one decode
+    assert use_shared_scene(dict(filename='P0001.jpg'), windowed_read=True)
+    assert use_shared_scene(dict(filename='P0001.png'), windowed_read=True)
+    assert not use_shared_scene(dict(filename='P0001.TIF'),
+                                windowed_read=True)
+    assert use_shared_scene(dict(filename='P0001.tif'), windowed_read=False)
+
+
+@pytest.fixture(scope='module')
+def sodaa_data(tmp_path_factory):
+    """Two small synthetic scenes and a split config."""
+    data_dir = tmp_path_factory.mktemp('sodaa')
+    img_dir, ann_dir = make_synthetic_sodaa(
+        str(data_dir), num_images=2, img_size=(900, 700), density=400.,
+        ign_regions=2)
+    config = str(data_dir / 'split_config.json')
+    with open(config, 'w') as f:
+        json.dump(dict(sizes=[400], gaps=[100], save_ext='.png'), f)
+    return img_dir, ann_dir, config
+
+
+def run_split(sodaa_data, save_dir, *args):
+    """Run sodaa_split.py and return its stdout."""
+    img_dir, ann_dir, config = sodaa_data
+    return subprocess.run([
+        sys.executable, sodaa_split.__file__, '--base-json', config,
+        '--img-dirs', img_dir, '--ann-dirs', ann_dir, '--save-dir',
+        str(save_dir), '--nproc', '1', *args
+    ], check=True, capture_output=True, text=True).stdout
+
+
+def assert_contents_equal(contents, expected):
+    assert len(contents) == len(expected)
+    for content, expected_content in zip(contents, expected):
+        ann, expected_ann = content.pop('ann'), expected_content.pop('ann')
+        assert content == expected_content
+        np.testing.assert_array_equal(ann['polys'], expected_ann['polys'])
+        assert ann['polys'].dtype == expected_ann['polys'].dtype
+        np.testing.assert_array_equal(ann['cat_ids'], expected_ann['cat_ids'])
+        assert ann['ign_polys'] == expected_ann['ign_polys']
+
+
+def test_load_sodaa_index_matches_plain_load(sodaa_data, tmp_path, capsys):
+    img_dir, ann_dir = str(tmp_path / 'Images'), str(tmp_path / 'Annotations')
+    shutil.copytree(sodaa_data[0], img_dir)
+    shutil.copytree(sodaa_data[1], ann_dir)
+    index_file = str(tmp_path / 'index.npz')
+
+    def load(**kwargs):
+        return load_sodaa(img_dir, ann_dir, nproc=1, **kwargs)
+
+    assert_contents_equal(load(index_file=index_file), load())
+    assert_contents_equal(load(index_file=index_file), load())
+    assert '(0 parsed)' in capsys.readouterr().out
+
+    # drop the objects of one annotation, only that one is parsed again
+    annfile = osp.join(ann_dir, sorted(os.listdir(ann_dir))[0])
+    with open(annfile) as f:
+        ann = json.load(f)
+    ann['annotations'] = [a for a in ann['annotations']
+                          if a['category_id'] == 9]
+    with open(annfile, 'w') as f:
+        json.dump(ann, f)
+    capsys.readouterr()
+    assert_contents_equal(load(index_file=index_file), load())
+    assert '(1 parsed)' in capsys.readouterr().out
+
+
+def test_incremental_split_key(sodaa_data, tmp_path):
+    save_dir = tmp_path / 'split'
+    assert '2 new or changed images' in run_split(sodaa_data, save_dir,
+                                                  '--incremental')
+    assert '0 new or changed images, 2 up to date' in run_split(
+        sodaa_data, save_dir, '--incremental')
+    # windowed reads decode jpeg pixels differently
+    assert '2 new or changed images, 0 up to date' in run_split(
+        sodaa_data, save_dir, '--incremental', '--windowed-read')
+    assert '0 new or changed images, 2 up to date' in run_split(
+        sodaa_data, save_dir, '--incremental', '--windowed-read')
+    assert '2 new or changed images, 0 up to date' in run_split(
+        sodaa_data, save_dir, '--incremental', '--label-format', 'dota')
+
+
+def format_labels_per_object(polys, cat_ids, width, height, label_format):
+    """Reference formatting one object at a time."""
+    rows = []
+    for poly, cat_id in zip(polys.tolist(), cat_ids.tolist()):
+        xs, ys = poly[0::2], poly[1::2]
+        if label_format == 'yolo-obb':
+            coords = [int(v) / (height if i % 2 else width)
+                      for i, v in enumerate(poly)]
+            rows.append([cat_id] + coords)
+        elif label_format == 'yolo-hbb':
+            x1, x2 = min(max(min(xs), 0), width), min(max(max(xs), 0), width)
+            y1, y2 = min(max(min(ys), 0), height), \
+                min(max(max(ys), 0), height)
+            rows.append([cat_id, (x1 + x2) / 2 / width,
+                         (y1 + y2) / 2 / height, (x2 - x1) / width,
+                         (y2 - y1) / height])
+        else:
+            rows.append(poly + [CLASSES[cat_id], 0])
+    return rows
+
+
+@pytest.mark.parametrize('label_format', ['yolo-obb', 'yolo-hbb', 'dota'])
+def test_format_labels_matches_per_object(label_format):
+    polys = random_polys(50).astype(np.float64) - 300
+    cat_ids = np.random.default_rng(0).integers(0, len(CLASSES) - 1, 50)
+    text = format_labels(polys, cat_ids, 800, 600, label_format)
+    expected = format_labels_per_object(polys, cat_ids, 800, 600,
+                                        label_format)
+
+    lines = text.splitlines()
+    assert len(lines) == len(expected) and text.endswith('\n')
+    for line, row in zip(lines, expected):
+        fields = line.split()
+        assert len(fields) == len(row)
+        if label_format == 'dota':
+            assert fields[8:] == [row[8], '0']
+            np.testing.assert_allclose([float(v) for v in fields[:8]],
+                                       row[:8], atol=0.05)
+        else:
+            assert int(fields[0]) == row[0]
+            np.testing.assert_allclose([float(v) for v in fields[1:]],
+                                       row[1:], atol=1e-6)
+
+
+@pytest.mark.parametrize('label_format', ['yolo-obb', 'yolo-hbb', 'dota'])
+def test_format_labels_no_objects(label_format):
+    assert format_labels(np.zeros((0, 8)), np.zeros(0), 800, 600,
+                         label_format) == ''
+
+
+def read_shards(shard_dir):
+    """Read the members of all shards through their idx files."""
+    samples = dict()
+    for idx_file in sorted(glob.glob(osp.join(shard_dir, '*.idx'))):
+        tar_file = idx_file[:-len('.idx')] + '.tar'
+        with open(idx_file) as f, open(tar_file, 'rb') as tar:
+            for line in f:
+                record = json.loads(line)
+                members = dict()
+                for name, (offset, size) in record['members'].items():
+                    tar.seek(offset)
+                    members[name] = tar.read(size)
+                samples[record['key']] = members
+        # the index must agree with the tar headers
+        with tarfile.open(tar_file) as tar:
+            for tarinfo in tar:
+                key = osp.splitext(tarinfo.name)[0]
+                assert tar.extractfile(tarinfo).read() == \
+                    samples[key][tarinfo.name]
+    return samples
+
+
+def test_shard_writer_index(tmp_path):
+    rng = np.random.default_rng(0)
+    expected = dict()
+    writer = ShardWriter(str(tmp_path), shard_size=10000)
+    for i in range(30):
+        key = f'P{i:04d}__400__0___0'
+        members = [(key + '.png', rng.bytes(int(rng.integers(0, 3000)))),
+                   (key + '.txt', b'0 0.1 0.2\n' * i)]
+        writer.write(key, members)
+        expected[key] = dict(members)
+    writer.close()
+
+    assert len(glob.glob(str(tmp_path / '*.tar'))) > 1
+    assert read_shards(str(tmp_path)) == expected
+
+
+def read_split(save_dir):
+    """Read the patches, labels and sorted manifest of a split."""
+    files = dict()
+    for sub in ['Images', 'Annotations']:
+        for path in glob.glob(osp.join(save_dir, sub, '*')):
+            with open(path, 'rb') as f:
+                files[osp.basename(path)] = f.read()
+    return files, sorted(read_manifest(save_dir), key=lambda r: r['id'])
+
+
+@pytest.mark.parametrize('args', [
+    ['--window-batch', '3', '--nproc', '2'],
+    ['--window-batch', '2', '--nproc', '2', '--scene-lookahead', '1'],
+    # jpeg scenes are shared even with windowed reads
+    ['--window-batch', '3', '--nproc', '2', '--windowed-read'],
+])
+def test_window_batches_match_image_tasks(sodaa_data, tmp_path, args):
+    run_split(sodaa_data, tmp_path / 'images')
+    run_split(sodaa_data, tmp_path / 'batches', *args)
+    assert read_split(str(tmp_path / 'batches')) == \
+        read_split(str(tmp_path / 'images'))
+
+
+def test_tar_output_matches_files(sodaa_data, tmp_path):
+    run_split(sodaa_data, tmp_path / 'files')
+    run_split(sodaa_data, tmp_path / 'tar', '--output-format', 'tar',
+              '--shard-size', '1')
+    samples = read_shards(str(tmp_path / 'tar' / 'Shards'))
+
+    files = dict()
+    for sub in ['Images', 'Annotations']:
+        for path in glob.glob(str(tmp_path / 'files' / sub / '*')):
+            with open(path, 'rb') as f:
+                files[osp.basename(path)] = f.read()
+    members = {name: data for sample in samples.values()
+               for name, data in sample.items()}
+    assert len(os.listdir(tmp_path / 'tar' / 'Shards')) > 2
+    assert members == files
+
+
+@pytest.mark.parametrize('num_threads', [0, 3])
+def test_patch_writer_matches_imwrite(tmp_path, num_threads):
+    rng = np.random.default_rng(0)
+    writer = PatchWriter(num_threads, max_pending=2)
+    expected = dict()
+    for i in range(20):
+        patch = rng.integers(0, 256, (40 + i, 60, 3), dtype=np.uint8)
+        img_path = str(tmp_path / f'{i}.png')
+        writer.write(img_path, patch, str(tmp_path / f'{i}.txt'), f'{i}\n')
+        expected[img_path] = patch
+    writer.close()
+    assert writer.stats.counts['bytes'] == sum(
+        os.path.getsize(tmp_path / f) for f in os.listdir(tmp_path))
+    for i, (img_path, patch) in enumerate(expected.items()):
+        np.testing.assert_array_equal(cv2.imread(img_path), patch)
+        with open(tmp_path / f'{i}.txt') as f:
+            assert f.read() == f'{i}\n'
+
+
+def test_patch_writer_raises_write_errors(tmp_path):
+    writer = PatchWriter(2)
+    writer.write(str(tmp_path / 'missing' / '0.png'),
+                 np.zeros((4, 4, 3), np.uint8), str(tmp_path / '0.txt'), '')
+    with pytest.raises(OSError):
+        writer.close()
+
+
+def full_image_mask(img, ign_polys, vld_polys):
+    """Mask ignore regions by rasterizing them over the whole image."""
+    ign_mask = np.ones_like(img[:, :, 0])
+    for ign_poly in ign_polys:
+        ign_poly = np.array(ign_poly).astype(np.int32).reshape([-1, 2])
+        cv2.fillPoly(ign_mask, [ign_poly], 0)
+    for vld_poly in vld_polys.reshape(-1, 8):
+        cv2.fillPoly(ign_mask, [vld_poly.astype(np.int32).reshape([-1, 2])],
+                     1)
+    return img * ign_mask[..., None]
+
+
+def test_mask_ign_regions_matches_full_image_mask():
+    rng = np.random.default_rng(0)
+    img = rng.integers(1, 256, (800, 1400, 3), dtype=np.uint8)
+    polys = random_polys(300)
+    polys = polys[np.ptp(polys[:, 0::2], axis=1) < 100]
+    # ignore regions crossing the image border, and one outside of it
+    ign_polys = [[100, 50, 700, 80, 650, 500, 90, 450],
+                 [500, 300, 1500, 350, 1450, 900],
+                 [-50, 600, 300, 700, 200, 850],
+                 [-50, -50, -10, -50, -10, -10, -50, -10]]
+    expected = full_image_mask(img, ign_polys, polys)
+    assert (expected == 0).all(axis=2).mean() > 0.3
+
+    masked = mask_ign_regions(img.copy(), ign_polys, polys)
+    np.testing.assert_array_equal(masked, expected)
+    # windows inside the image only differ by cv2 rounding at their border
+    for x_start, y_start, x_stop, y_stop in WINDOWS.tolist():
+        patch = fill_ign_window(img[y_start:y_stop, x_start:x_stop].copy(),
+                                dict(polys=polys, ign_polys=ign_polys),
+                                x_start, y_start)
+        assert (patch != expected[y_start:y_stop, x_start:x_stop]).any(
+            axis=2).mean() < 1e-3
+
+
+def test_select_windows_matches_full_image_mask():
+    polys = random_polys(300)
+    polys = polys[np.ptp(polys[:, 0::2], axis=1) < 100][:20]
+    ign_polys = [[0, 0, 900, 0, 900, 500, 0, 500],
+                 [500, 300, 1500, 350, 1450, 900]]
+    info = dict(id='P0001', width=1400, height=800,
+                ann=dict(polys=polys, cat_ids=np.zeros(len(polys)),
+                         ign_polys=ign_polys))
+    x, y = np.meshgrid(np.arange(0, 1400, 100), np.arange(0, 800, 100))
+    windows = np.stack([x.ravel(), y.ravel(), x.ravel() + 200,
+                        y.ravel() + 200], axis=1)
+    window_anns = get_window_obj(info, windows, 0.7)
+    empty = np.array([len(ann['polys']) == 0 for ann in window_anns])
+
+    # windows without objects whose pixels a full image mask all zeroes
+    masked = full_image_mask(np.ones((800, 1400, 1), np.uint8), ign_polys,
+                             polys)
+    ignored = np.array([empty[i] and not masked[y0:y1, x0:x1].any()
+                        for i, (x0, y0, x1, y1) in enumerate(windows)])
+    assert 0 < ignored.sum() < empty.sum()
+    kept, kept_anns, counts = select_windows(info, windows, window_anns,
+                                             drop_ignored=True)
+    np.testing.assert_array_equal(kept, windows[~ignored])
+    assert kept_anns == [a for a, i in zip(window_anns, ignored) if not i]
+    assert counts == dict(windows=len(windows), empty_dropped=0,
+                          ignored_dropped=ignored.sum())
+
+    kept, _, counts = select_windows(info, windows, window_anns, 0.5, seed=3)
+    assert counts['empty_dropped'] == empty.sum() - round(empty.sum() / 2)
+    np.testing.assert_array_equal(
+        kept, select_windows(info, windows, window_anns, 0.5, seed=3)[0])
+    # windows with objects are always kept
+    assert {tuple(w) for w in windows[~empty]} <= {tuple(w) for w in kept}
+    kept, _, _ = select_windows(info, windows, window_anns, 0.)
+    np.testing.assert_array_equal(kept, windows[~empty])
+
+
+def read_manifest(save_dir):
+    with open(osp.join(save_dir, 'patch_infos.jsonl')) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_manifest_matches_patches(sodaa_data, tmp_path):
+    save_dir = tmp_path / 'split'
+    run_split(sodaa_data, save_dir)
+    records = read_manifest(save_dir)
+    assert sorted(r['filename'] for r in records) == \
+        sorted(os.listdir(save_dir / 'Images'))
+    assert len({r['id'] for r in records}) == len(records)
+    assert {r['ori_id'] for r in records} == \
+        {osp.splitext(f)[0] for f in os.listdir(sodaa_data[0])}
+    for record in records:
+        patch = cv2.imread(str(save_dir / 'Images' / record['filename']))
+        assert patch.shape[:2] == (record['height'], record['width'])
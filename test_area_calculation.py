@@ -0,0 +1,84 @@
+import os
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import pytest
+
+gpd = pytest.importorskip('geopandas')
+from shapely.geometry import box  # noqa: E402
+
+from area_calculation import (area_table, class_areas,  # noqa: E402
+                              get_class_column)
+
+CLASSES = ['Agriculture', 'Built Up', 'Forest', 'Wasteland', 'Water Bodies']
+
+
+def write_layer(path, class_col, classes, seed=0):
+    """Write random boxes of the given classes in UTM zone 44N."""
+    rng = np.random.default_rng(seed)
+    x0, y0 = rng.uniform(0, 5000, (2, 60))
+    sizes = rng.uniform(0.5, 400, (2, 60))
+    gdf = gpd.GeoDataFrame(
+        {class_col: rng.choice(classes, 60), 'Other': np.arange(60)},
+        geometry=[box(x + 500000, y + 3000000, x + w + 500000, y + h + 3000000)
+                  for x, y, w, h in zip(x0, y0, *sizes)],
+        crs='EPSG:32644')
+    gdf.to_file(path, driver='GPKG')
+    return str(path)
+
+
+def notebook_area_table(vector_files, class_col):
+    """The groupby apply and chained outer merges of the notebook."""
+    list_df = []
+    for filename in vector_files:
+        gpkg_file = gpd.read_file(filename)
+        gpkg_file['Area'] = gpkg_file.area
+        area_data = gpkg_file.groupby([class_col])['Area'].apply(
+            lambda x: x.astype(int).sum())
+        area_df = area_data.reset_index()
+        area_df.rename(columns={
+            'Area': os.path.basename(filename).split('.')[0]
+        }, inplace=True)
+        list_df.append(area_df)
+    df = reduce(lambda x, y: pd.merge(x, y, on=class_col, how='outer'),
+                list_df)
+    return df.set_index(class_col).rename_axis('Class').sort_index()
+
+
+@pytest.fixture
+def vector_files(tmp_path):
+    return [
+        write_layer(tmp_path / 'sisdp_0506.gpkg', 'Level_I', CLASSES[:4]),
+        write_layer(tmp_path / 'sisdp_1516.gpkg', 'Level_I', CLASSES[1:],
+                    seed=1),
+        write_layer(tmp_path / 'sisdp_2122.gpkg', 'Level_I', CLASSES[::2],
+                    seed=2)
+    ]
+
+
+def test_class_areas_matches_notebook(vector_files):
+    expected = notebook_area_table(vector_files[:1], 'Level_I')
+    areas = class_areas(vector_files[0])
+    assert areas.name == 'sisdp_0506'
+    pd.testing.assert_series_equal(areas, expected['sisdp_0506'],
+                                   check_dtype=False)
+
+
+@pytest.mark.parametrize('nproc', [1, 2])
+def test_area_table_matches_notebook(vector_files, nproc):
+    table = area_table(vector_files, nproc=nproc)
+    assert table.columns.tolist() == ['sisdp_0506', 'sisdp_1516',
+                                      'sisdp_2122']
+    pd.testing.assert_frame_equal(table.astype(float),
+                                  notebook_area_table(vector_files, 'Level_I')
+                                  .astype(float))
+
+
+def test_get_class_column(tmp_path):
+    descr = write_layer(tmp_path / 'lulc_50K.gpkg', 'DESCR_1', CLASSES)
+    assert get_class_column(descr) == 'DESCR_1'
+    assert class_areas(descr).index.tolist() == CLASSES
+    other = write_layer(tmp_path / 'other.gpkg', 'Class', CLASSES)
+    with pytest.raises(ValueError):
+        get_class_column(other)
@@ -0,0 +1,145 @@
+import csv
+import os
+
+import numpy as np
+import pytest
+
+from combine_csv import (combine_in_memory, combine_streaming,
+                         get_param_parser, get_parameter_name, merge_join,
+                         sort_predictions)
+
+pd = pytest.importorskip('pandas')
+from combine_csv import (combine_columnar, load_store,  # noqa: E402
+                         update_store, write_columnar)
+
+PARAMS = ['beauty', 'safety', 'lively', 'wealthy']
+
+
+def write_predictions(path, image_ids, values):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['image_id', 'predication'])
+        writer.writerows(zip(image_ids, [f'{v:.4f}' for v in values]))
+    return str(path)
+
+
+@pytest.fixture
+def csv_files(tmp_path):
+    """Prediction files of shuffled, partly shared image_ids.
+
+    The first file repeats some image_ids, the later row is the prediction.
+    """
+    rng = np.random.default_rng(0)
+    all_ids = np.array([f'{i:05d}_{j}.jpg' for i in range(300)
+                        for j in range(2)])
+    files = []
+    for param in PARAMS:
+        ids = rng.permutation(all_ids)[:rng.integers(200, 600)]
+        if param == PARAMS[0]:
+            ids = np.concatenate([ids, ids[:25]])
+        files.append(write_predictions(tmp_path / f'pred_{param}.csv', ids,
+                                       rng.random(len(ids))))
+    return sorted(files)
+
+
+def brute_force_combine(csv_files):
+    """Last prediction of every image_id and parameter."""
+    combined = dict()
+    for file in csv_files:
+        with open(file, newline='') as f:
+            for row in csv.DictReader(f):
+                combined.setdefault(row['image_id'], dict())[
+                    get_parameter_name(file)] = float(row['predication'])
+    df = pd.DataFrame.from_dict(combined, orient='index')
+    df = df.reindex(columns=sorted(df.columns)).astype(np.float32)
+    return df.rename_axis('image_id').sort_index()
+
+
+def read_combined(file):
+    df = pd.read_csv(file, dtype={'image_id': str})
+    return df.set_index('image_id').astype(np.float32).sort_index()
+
+
+def test_combine_in_memory(csv_files, tmp_path):
+    out = str(tmp_path / 'combined.csv')
+    assert combine_in_memory(csv_files, out) == \
+        len(brute_force_combine(csv_files))
+    pd.testing.assert_frame_equal(read_combined(out),
+                                  brute_force_combine(csv_files))
+
+
+@pytest.mark.parametrize('chunk_rows', [7, 1000000])
+def test_combine_streaming(csv_files, tmp_path, chunk_rows):
+    out = str(tmp_path / 'combined.csv')
+    assert combine_streaming(csv_files, out, chunk_rows,
+                             str(tmp_path)) == \
+        len(brute_force_combine(csv_files))
+    df = pd.read_csv(out, dtype={'image_id': str})
+    assert df['image_id'].is_monotonic_increasing
+    pd.testing.assert_frame_equal(read_combined(out),
+                                  brute_force_combine(csv_files))
+
+
+def test_sort_predictions_is_stable(tmp_path):
+    ids = ['b', 'a', 'c', 'a', 'b', 'a']
+    file = write_predictions(tmp_path / 'pred_x.csv', ids, range(6))
+    rows = list(sort_predictions(file, str(tmp_path), chunk_rows=2))
+    assert rows == [('a', '1.0000'), ('a', '3.0000'), ('a', '5.0000'),
+                    ('b', '0.0000'), ('b', '4.0000'), ('c', '2.0000')]
+    assert list(merge_join([iter(rows)], ['x'])) == [
+        ('a', dict(x='5.0000')), ('b', dict(x='4.0000')),
+        ('c', dict(x='2.0000'))]
+
+
+@pytest.mark.parametrize('nproc', [1, 2])
+def test_combine_columnar(csv_files, tmp_path, nproc):
+    df = combine_columnar(csv_files, nproc)
+    assert all(df[param].dtype == np.float32 for param in PARAMS)
+    pd.testing.assert_frame_equal(df.set_index('image_id').sort_index(),
+                                  brute_force_combine(csv_files))
+
+    out = str(tmp_path / 'combined.csv')
+    write_columnar(df, out)
+    pd.testing.assert_frame_equal(read_combined(out),
+                                  brute_force_combine(csv_files))
+
+
+def test_param_regex(csv_files):
+    parser = get_param_parser(r'pred_(\w+)\.csv')
+    assert [parser(f) for f in csv_files] == \
+        [get_parameter_name(f) for f in csv_files]
+    with pytest.raises(ValueError):
+        get_param_parser(r'score_(\w+)\.csv')(csv_files[0])
+
+
+def test_update_store(csv_files, tmp_path):
+    store = str(tmp_path / 'store')
+    assert update_store(store, csv_files[:3], nproc=1) == \
+        sorted(get_parameter_name(f) for f in csv_files[:3])
+    assert update_store(store, csv_files[:3], nproc=1) == []
+
+    def load():
+        return load_store(store).set_index('image_id').sort_index()
+
+    pd.testing.assert_frame_equal(load(), brute_force_combine(csv_files[:3]))
+
+    # add a file, change a file and remove a file
+    column_files = {f: os.stat(os.path.join(store, f)).st_mtime_ns
+                    for f in os.listdir(store) if f[0].isdigit()}
+    rng = np.random.default_rng(1)
+    changed = write_predictions(csv_files[1], [f'{i:05d}_9.jpg'
+                                               for i in range(50)],
+                                rng.random(50))
+    current = [csv_files[1], csv_files[2], csv_files[3]]
+    assert update_store(store, current, nproc=2) == sorted(
+        get_parameter_name(f) for f in [csv_files[0], changed,
+                                         csv_files[3]])
+
+    # image_ids are never removed, so rows of the removed file stay empty
+    expected = brute_force_combine(current)
+    pd.testing.assert_frame_equal(
+        load().dropna(how='all').sort_index(), expected)
+    unchanged = [f for f, mtime in column_files.items()
+                 if os.path.exists(os.path.join(store, f))
+                 and os.stat(os.path.join(store, f)).st_mtime_ns == mtime]
+    assert len(unchanged) == 1
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from evaluate_predictions import (density_histograms, evaluate_pairs,
+                                  get_eval_pairs)
+
+STUDIES = ['safe', 'lively', 'wealthy']
+
+
+def random_predictions(num=500, seed=0):
+    """Predictions correlated with their actual scores, with missing rows."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(dict(image_filename=[f'{i}.jpg' for i in range(num)]))
+    for k, study in enumerate(STUDIES):
+        actual = rng.uniform(0, 10, num)
+        pred = actual * (0.5 + k) + rng.normal(0, 2, num)
+        actual[rng.random(num) < 0.2] = np.nan
+        pred[rng.random(num) < 0.1] = np.nan
+        df[study] = pred
+        df[f'{study}_norm_act'] = actual
+    df['unpaired_norm_act'] = 1.
+    return df
+
+
+def test_get_eval_pairs():
+    assert get_eval_pairs(random_predictions()) == \
+        [(study, f'{study}_norm_act') for study in STUDIES]
+
+
+def test_evaluate_pairs_matches_per_study():
+    df = random_predictions()
+    pairs = get_eval_pairs(df)
+    metrics = evaluate_pairs(df, pairs).set_index('study')
+
+    for pred_col, actual_col in pairs:
+        data = df[[pred_col, actual_col]].dropna()
+        pred, actual = data[pred_col], data[actual_col]
+        slope, intercept = np.polyfit(actual, pred, 1)
+        row = metrics.loc[pred_col]
+        assert row['n'] == len(data)
+        np.testing.assert_allclose(
+            [row['pearson'], row['spearman'], row['slope'],
+             row['intercept'], row['rmse'], row['mae']],
+            [actual.corr(pred), actual.rank().corr(pred.rank()), slope,
+             intercept, np.sqrt(((pred - actual) ** 2).mean()),
+             (pred - actual).abs().mean()])
+
+
+def test_density_histograms_match_histogram2d():
+    df = random_predictions()
+    pairs = get_eval_pairs(df)
+    counts, actual_edges, pred_edges = density_histograms(df, pairs, 20)
+    assert counts.shape == (len(pairs), 20, 20)
+
+    for i, (pred_col, actual_col) in enumerate(pairs):
+        data = df[[pred_col, actual_col]].dropna()
+        expected, _, _ = np.histogram2d(data[pred_col], data[actual_col],
+                                        [pred_edges[i], actual_edges[i]])
+        np.testing.assert_array_equal(counts[i], expected)
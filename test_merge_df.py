@@ -0,0 +1,77 @@
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from merge_df import add_normalized_scores, multiway_merge
+
+
+def random_predictions(num_frames=4, seed=0):
+    """Frames of shuffled, partly shared image ids with a score column."""
+    rng = np.random.default_rng(seed)
+    ids = np.array([f'img_{i:03d}.jpg' for i in range(60)])
+    dfs = []
+    for k in range(num_frames):
+        frame_ids = rng.permutation(ids)[:rng.integers(20, 60)]
+        dfs.append(pd.DataFrame({
+            'image_filename': frame_ids,
+            f'study_{k}': rng.random(len(frame_ids))
+        }))
+    return dfs
+
+
+@pytest.mark.parametrize('how', ['outer', 'inner'])
+def test_multiway_merge_matches_merge_chain(how):
+    dfs = random_predictions()
+    expected = reduce(
+        lambda x, y: pd.merge(x, y, on='image_filename', how=how), dfs)
+    merged = multiway_merge(dfs, how=how)
+    pd.testing.assert_frame_equal(
+        merged.sort_values('image_filename').reset_index(drop=True),
+        expected.sort_values('image_filename').reset_index(drop=True))
+
+
+def test_multiway_merge_sort_matches_outer_merge_chain():
+    dfs = random_predictions()
+    expected = reduce(
+        lambda x, y: pd.merge(x, y, on='image_filename', how='outer'), dfs)
+    pd.testing.assert_frame_equal(multiway_merge(dfs, sort=True), expected)
+
+
+def test_multiway_merge_duplicated_keys():
+    df = pd.DataFrame(dict(image_filename=['a', 'a'], study_0=[1., 2.]))
+    with pytest.raises(ValueError):
+        multiway_merge([df, df.rename(columns=dict(study_0='study_1'))])
+
+
+def test_add_normalized_scores_matches_per_study_loop():
+    rng = np.random.default_rng(1)
+    ids = [f'img_{i:03d}.jpg' for i in range(50)]
+    trueskill_data = pd.concat([
+        pd.DataFrame({
+            'img_id': rng.permutation(ids)[:30],
+            'study_id': study,
+            'trueskill.score': rng.normal(25, 5, 30)
+        }) for study in ['safe', 'lively', 'wealthy']
+    ], ignore_index=True)
+    combined_pred = pd.DataFrame(dict(image_filename=ids,
+                                      safe=rng.random(50)))
+
+    # per-study loop of merge_df.ipynb
+    expected = combined_pred.copy()
+    for study in trueskill_data['study_id'].unique():
+        scores = trueskill_data[trueskill_data['study_id'] == study]
+        low, high = scores['trueskill.score'].min(), \
+            scores['trueskill.score'].max()
+        scores = pd.DataFrame({
+            'img_id': scores['img_id'],
+            f'{study}_norm_act': (scores['trueskill.score'] - low) /
+            (high - low) * 10
+        })
+        expected = pd.merge(expected, scores, left_on='image_filename',
+                            right_on='img_id',
+                            how='left').drop(columns=['img_id'])
+
+    pd.testing.assert_frame_equal(
+        add_normalized_scores(combined_pred, trueskill_data), expected)
@@ -0,0 +1,232 @@
+import numpy as np
+import pytest
+
+rasterio = pytest.importorskip('rasterio')
+from rasterio.transform import from_origin  # noqa: E402
+
+from num_pixels_in_tiff import (CategoryCounts,  # noqa: E402
+                                TransitionCounts, area_table,
+                                calculate_area_per_category,
+                                count_categories, get_row_areas,
+                                transition_matrix, zonal_category_stats)
+
+NODATA = 255
+
+
+def write_raster(path, data, transform=None, crs='EPSG:32644',
+                 nodata=NODATA):
+    """Write a tiled single band raster."""
+    if transform is None:
+        transform = from_origin(500000, 3000000, 30, 30)
+    with rasterio.open(path, 'w', driver='GTiff', height=data.shape[0],
+                       width=data.shape[1], count=1, dtype=data.dtype,
+                       crs=crs, transform=transform, tiled=True,
+                       blockxsize=32, blockysize=32,
+                       nodata=nodata) as dst:
+        dst.write(data, 1)
+    return str(path)
+
+
+def random_categories(shape, num_categories=12, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.integers(0, num_categories, shape).astype(np.uint8)
+    data[rng.random(shape) < 0.05] = NODATA
+    return data
+
+
+def unique_counts(data, nodata=None):
+    """Categories and pixel counts by np.unique, without nodata and NaN."""
+    data = data[~np.isnan(data)] if data.dtype.kind == 'f' else data.ravel()
+    if nodata is not None:
+        data = data[data != nodata]
+    return np.unique(data, return_counts=True)
+
+
+@pytest.mark.parametrize('dtype,high', [
+    (np.uint8, 256), (np.int16, 1000), (np.int32, 100), (np.int32, 10**9),
+    (np.float32, 50)])
+def test_category_counts_matches_unique(dtype, high):
+    rng = np.random.default_rng(0)
+    data = rng.integers(-high // 4 if dtype != np.uint8 else 0, high,
+                        (60, 70)).astype(dtype)
+    if dtype == np.float32:
+        data[rng.random(data.shape) < 0.1] = np.nan
+    weights = rng.random(60)
+
+    counts = CategoryCounts()
+    # blocks of several sizes, merged through a second instance
+    other = CategoryCounts()
+    for i, rows in enumerate(np.array_split(np.arange(60), 7)):
+        (counts if i % 2 else other).update(data[rows],
+                                            weights[rows, None])
+    counts.merge(other)
+    nodata = data.flat[0]
+    categories, pixels, areas = counts.result(nodata)
+
+    expected, expected_pixels = unique_counts(data, nodata)
+    np.testing.assert_array_equal(categories, expected)
+    np.testing.assert_array_equal(pixels, expected_pixels)
+    expected_areas = [
+        (np.broadcast_to(weights[:, None], data.shape)[data == v]).sum()
+        for v in expected]
+    np.testing.assert_allclose(areas, expected_areas)
+
+
+@pytest.mark.parametrize('nproc', [1, 2])
+def test_count_categories_matches_unique(tmp_path, nproc):
+    data = random_categories((90, 110))
+    tiff_file = write_raster(tmp_path / 'lulc.tif', data)
+    categories, pixels, areas = count_categories(tiff_file,
+                                                 max_pixels=1000,
+                                                 nproc=nproc)
+    expected, expected_pixels = unique_counts(data, NODATA)
+    np.testing.assert_array_equal(categories, expected)
+    np.testing.assert_array_equal(pixels, expected_pixels)
+    np.testing.assert_allclose(areas, expected_pixels * 900.)
+
+    category_area = calculate_area_per_category(tiff_file, pixel_size=10,
+                                                max_pixels=1000)
+    assert category_area == dict(zip(expected.tolist(),
+                                     (expected_pixels * 100.).tolist()))
+
+
+def test_geodesic_row_areas(tmp_path):
+    pyproj = pytest.importorskip('pyproj')
+    transform = from_origin(-180, 90, 1, 1)
+    tiff_file = write_raster(tmp_path / 'globe.tif',
+                             np.zeros((180, 360), dtype=np.uint8),
+                             transform, crs='EPSG:4326')
+    with rasterio.open(tiff_file) as src:
+        row_areas = get_row_areas(src)
+
+    # the WGS84 ellipsoid has an area of 510065621.7 km2
+    assert row_areas.sum() * 360 == pytest.approx(5.100656217e14, rel=1e-9)
+    geod = pyproj.Geod(ellps='WGS84')
+    # pixel edges follow parallels, not geodesics, so densify them
+    lons = np.linspace(0, 1, 2001)
+    for row in [0, 45, 89, 130]:
+        top, bottom = 90 - row, 89 - row
+        area, _ = geod.polygon_area_perimeter(
+            np.concatenate([lons, lons[::-1]]),
+            np.repeat([bottom, top], len(lons)))
+        assert row_areas[row] == pytest.approx(abs(area), rel=1e-7)
+
+
+@pytest.mark.parametrize('nproc', [1, 2])
+def test_area_table(tmp_path, nproc):
+    projected = random_categories((90, 110), seed=1)
+    geographic = random_categories((60, 80), num_categories=14, seed=2)
+    tiff_files = [
+        write_raster(tmp_path / 'lulc_0506.tif', projected),
+        write_raster(tmp_path / 'lulc_1516.tif', geographic,
+                     from_origin(70, 30, 0.01, 0.01), crs='EPSG:4326')
+    ]
+    table = area_table(tiff_files, max_pixels=1000, nproc=nproc)
+    assert table.columns.tolist() == ['lulc_0506', 'lulc_1516']
+    assert table.index.tolist() == list(range(14))
+
+    expected, pixels = unique_counts(projected, NODATA)
+    np.testing.assert_allclose(table['lulc_0506'].to_numpy(),
+                               np.bincount(expected, pixels * 900., 14))
+    with rasterio.open(tiff_files[1]) as src:
+        row_areas = get_row_areas(src)
+    weights = np.broadcast_to(row_areas[:, None], geographic.shape)
+    valid = geographic != NODATA
+    np.testing.assert_allclose(
+        table['lulc_1516'].to_numpy(),
+        np.bincount(geographic[valid], weights[valid], 14))
+
+
+def brute_force_transitions(data_a, data_b, weights, nodata_a, nodata_b):
+    """Count pairs of categories one pixel at a time with np.add.at."""
+    valid = (data_a == data_a) & (data_b == data_b) & \
+        (data_a != nodata_a) & (data_b != nodata_b)
+    from_cats, from_inds = np.unique(data_a[valid], return_inverse=True)
+    to_cats, to_inds = np.unique(data_b[valid], return_inverse=True)
+    pixels = np.zeros((len(from_cats), len(to_cats)), dtype=np.int64)
+    areas = np.zeros((len(from_cats), len(to_cats)))
+    np.add.at(pixels, (from_inds, to_inds), 1)
+    np.add.at(areas, (from_inds, to_inds),
+              np.broadcast_to(weights, data_a.shape)[valid])
+    return from_cats, to_cats, pixels, areas
+
+
+@pytest.mark.parametrize('dtype,high', [(np.uint8, 12), (np.int32, 10**6),
+                                        (np.float32, 9)])
+def test_transition_counts_matches_add_at(dtype, high):
+    rng = np.random.default_rng(0)
+    data_a = rng.integers(0, high, (50, 40)).astype(dtype)
+    data_b = rng.integers(0, high, (50, 40)).astype(dtype)
+    weights = rng.random((50, 1))
+
+    counts = TransitionCounts()
+    for rows in np.array_split(np.arange(50), 4):
+        block = TransitionCounts()
+        block.update(data_a[rows], data_b[rows], weights[rows])
+        counts.merge(block)
+    result = counts.result(data_a.flat[0], data_b.flat[1])
+    expected = brute_force_transitions(data_a, data_b, weights,
+                                       data_a.flat[0], data_b.flat[1])
+    for value, expected_value in zip(result, expected):
+        np.testing.assert_allclose(value, expected_value)
+
+
+@pytest.mark.parametrize('geographic,nproc', [(False, 1), (True, 2)])
+def test_transition_matrix(tmp_path, geographic, nproc):
+    transform, crs = (from_origin(70, 30, 0.01, 0.01), 'EPSG:4326') \
+        if geographic else (from_origin(500000, 3000000, 30, 30),
+                            'EPSG:32644')
+    data_a = random_categories((90, 110), seed=1)
+    data_b = random_categories((90, 110), num_categories=9, seed=2)
+    tiff_a = write_raster(tmp_path / 'lulc_0506.tif', data_a, transform, crs)
+    tiff_b = write_raster(tmp_path / 'lulc_1516.tif', data_b, transform, crs)
+    with rasterio.open(tiff_a) as src:
+        row_areas = get_row_areas(src)
+
+    result = transition_matrix(tiff_a, tiff_b, max_pixels=1000, nproc=nproc)
+    expected = brute_force_transitions(data_a, data_b, row_areas[:, None],
+                                       NODATA, NODATA)
+    for value, expected_value in zip(result, expected):
+        np.testing.assert_allclose(value, expected_value)
+
+
+def test_transition_matrix_other_grid(tmp_path):
+    data = random_categories((90, 110))
+    tiff_a = write_raster(tmp_path / 'a.tif', data)
+    tiff_b = write_raster(tmp_path / 'b.tif', data,
+                          from_origin(500030, 3000000, 30, 30))
+    with pytest.raises(ValueError):
+        transition_matrix(tiff_a, tiff_b)
+
+
+def pixel_box(transform, row_start, col_start, row_stop, col_stop):
+    """GeoJSON box along pixel edges, covering the pixel centers inside."""
+    left, top = transform * (col_start, row_start)
+    right, bottom = transform * (col_stop, row_stop)
+    return dict(type='Polygon',
+                coordinates=[[(left, bottom), (right, bottom), (right, top),
+                              (left, top), (left, bottom)]])
+
+
+@pytest.mark.parametrize('nproc', [1, 2])
+def test_zonal_category_stats_many_overlapping_zones(tmp_path, nproc):
+    data = random_categories((90, 110))
+    transform = from_origin(500000, 3000000, 30, 30)
+    tiff_file = write_raster(tmp_path / 'lulc.tif', data, transform)
+
+    # more zones than fit a zone x category bincount of 1 << 24 bins
+    rng = np.random.default_rng(1)
+    num_zones = 4200
+    starts = rng.integers(0, [90, 110], (num_zones, 2))
+    stops = np.minimum(starts + rng.integers(1, 12, (num_zones, 2)),
+                       [90, 110])
+    zones = [pixel_box(transform, *start, *stop)
+             for start, stop in zip(starts.tolist(), stops.tolist())]
+
+    categories, pixels, areas = zonal_category_stats(
+        tiff_file, zones, max_pixels=1024, nproc=nproc)
+    assert categories.tolist() == list(range(12))
+    for i, ((r0, c0), (r1, c1)) in enumerate(zip(starts, stops)):
+        expected = np.bincount(data[r0:r1, c0:c1].ravel(), minlength=256)
+        np.testing.assert_array_equal(pixels[i], expected[:12])
+    np.testing.assert_allclose(areas, pixels * 900.)